@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os.path
+import sqlite3
+import uuid
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from utils.type_hinting import Color
+
+FileStat = Tuple[int, int]  # Two-tuple: size in bytes, modification time in nanoseconds
+
+# Number of bytes of a photo to read at once when hashing its content
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class AnalysisCache:
+    """
+    Persistent cache of the average color of photos, stored in an SQLite database
+
+    A cached color is only valid as long as the size and modification time of the photo are unchanged.
+    Optionally, the content hash of every photo is stored as well. Photos of which the size or modification
+    time changed, or that are renamed, then reuse the cached color when their content is unchanged.
+
+    The cache has a fingerprint that changes whenever the cached colors change, to check whether data derived from
+    all colors, like a ColorStore, is up-to-date without comparing all colors.
+    """
+
+    def __init__(self, db_fp: str, use_content_hash: bool = False):
+        """
+        :param db_fp: Full path to the SQLite database file, which is created if it does not exist
+        :param use_content_hash: Whether to hash the content of photos to identify them
+        """
+
+        self.use_content_hash = use_content_hash
+        self._connection = sqlite3.connect(db_fp)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS photo ('
+                'filename TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, content_hash TEXT, '
+                'red INTEGER, green INTEGER, blue INTEGER)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS photo_content_hash ON photo (content_hash)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._connection.execute("INSERT OR IGNORE INTO meta VALUES ('fingerprint', ?)", (uuid.uuid4().hex,))
+        self._stats: Dict[str, FileStat] = {}
+        self._content_hashes: Dict[str, str] = {}
+
+    def close(self) -> None:
+        self._connection.close()
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Return the identifier of the current cached colors, which is replaced every time they change
+        """
+
+        return self._connection.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()[0]
+
+    def lookup(self, photos_dir: str, filenames: Iterable[str]) -> Tuple[Dict[str, Color], Set[str]]:
+        """
+        Return the cached colors that are still valid for the given photos
+
+        :param photos_dir: Directory that contains the photos
+        :param filenames: Filenames of the photos to look up
+        :return: Two-tuple with the valid color per filename, and the filenames that are cached, but changed since
+                 they were cached. The color of a changed photo can still be valid, when its content is identical
+                 to that of another cached photo, but everything else derived from it, like its resized photos,
+                 is outdated.
+        """
+
+        rows = self._connection.execute('SELECT filename, size, mtime_ns, content_hash, red, green, blue FROM photo')
+        cached = {filename: ((size, mtime_ns), content_hash, (red, green, blue))
+                  for filename, size, mtime_ns, content_hash, red, green, blue in rows}
+
+        colors: Dict[str, Color] = {}
+        changed_filenames: Set[str] = set()
+        renamed_colors: Dict[str, Color] = {}
+        for filename in filenames:
+            stat = os.stat(os.path.join(photos_dir, filename))
+            self._stats[filename] = (stat.st_size, stat.st_mtime_ns)
+            cached_stat, cached_content_hash, cached_color = cached.get(filename, (None, None, None))
+            if cached_stat == self._stats[filename]:
+                colors[filename] = cached_color
+                continue
+
+            if cached_stat is not None:
+                changed_filenames.add(filename)
+            if self.use_content_hash:
+                content_hash = self._content_hash(os.path.join(photos_dir, filename))
+                color = self._lookup_content_hash(content_hash)
+                if color is not None:
+                    colors[filename] = color
+                    renamed_colors[filename] = color
+                    if content_hash == cached_content_hash:
+                        # Only the modification time changed, so the resized photos are still valid
+                        changed_filenames.discard(filename)
+        if renamed_colors:
+            self.store(renamed_colors)
+        return colors, changed_filenames
+
+    def import_json(self, json_fp: str, photos_dir: str, filenames: Iterable[str]) -> int:
+        """
+        Import the colors of the given photos from the photo_analysis.json of an earlier version, once
+
+        The colors are only imported while the cache is empty. That file holds nothing but a color per filename,
+        so a color is only imported if the photo was not modified after the file was written.
+
+        :param json_fp: Full path to the JSON file with a color per filename
+        :param photos_dir: Directory that contains the photos
+        :param filenames: Filenames of the photos to import
+        :return: The number of imported colors
+        """
+
+        if not os.path.exists(json_fp) or self._connection.execute('SELECT 1 FROM photo LIMIT 1').fetchone():
+            return 0
+        with open(json_fp) as f:
+            json_colors = json.load(f)
+        json_mtime_ns = os.stat(json_fp).st_mtime_ns
+
+        colors: Dict[str, Color] = {}
+        for filename in filenames:
+            if filename not in json_colors:
+                continue
+            fp = os.path.join(photos_dir, filename)
+            stat = os.stat(fp)
+            if stat.st_mtime_ns > json_mtime_ns:
+                continue
+            self._stats[filename] = (stat.st_size, stat.st_mtime_ns)
+            if self.use_content_hash:
+                self._content_hash(fp)
+            colors[filename] = tuple(json_colors[filename])
+        self.store(colors)
+        return len(colors)
+
+    def store(self, colors: Dict[str, Color]) -> None:
+        """
+        Store the colors of the given photos in a single transaction
+
+        The file statistics and content hashes are the ones determined in lookup, before the photos were analyzed.
+        This ensures that a photo that changes while being analyzed is analyzed again in the next run.
+        """
+
+        rows = [
+            (filename, *self._stats[filename], self._content_hashes.get(filename), *color)
+            for filename, color in colors.items()
+        ]
+        if not rows:
+            return
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO photo VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self._replace_fingerprint()
+
+    def remove_all_except(self, filenames: Iterable[str]) -> int:
+        """
+        Remove the cached colors of all photos that are not in filenames
+
+        :return: The number of removed photos
+        """
+
+        filenames = set(filenames)
+        rows = self._connection.execute('SELECT filename FROM photo')
+        filenames_to_remove = [(filename,) for filename, in rows if filename not in filenames]
+        if filenames_to_remove:
+            with self._connection:
+                self._connection.executemany('DELETE FROM photo WHERE filename = ?', filenames_to_remove)
+                self._replace_fingerprint()
+        return len(filenames_to_remove)
+
+    def _replace_fingerprint(self) -> None:
+        self._connection.execute("UPDATE meta SET value = ? WHERE key = 'fingerprint'", (uuid.uuid4().hex,))
+
+    def _content_hash(self, fp: str) -> str:
+        blake2b = hashlib.blake2b(digest_size=16)
+        with open(fp, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                blake2b.update(chunk)
+        content_hash = blake2b.hexdigest()
+        self._content_hashes[os.path.basename(fp)] = content_hash
+        return content_hash
+
+    def _lookup_content_hash(self, content_hash: str) -> Optional[Color]:
+        row = self._connection.execute(
+            'SELECT red, green, blue FROM photo WHERE content_hash = ? LIMIT 1', (content_hash,)
+        ).fetchone()
+        return tuple(row) if row else None
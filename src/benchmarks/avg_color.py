@@ -0,0 +1,53 @@
+import random
+import timeit
+
+from PIL import Image
+
+from photo import Photo
+from utils.type_hinting import Color, Size
+
+
+def legacy_avg_color(photo: Photo) -> Color:
+    """
+    Pure Python implementation of the average color that Photo used before ImageStat, kept as reference
+    """
+
+    pixels = list(photo.getdata())
+    nr_pixels = len(pixels)
+    channels = list(zip(*pixels))  # [(R values), (G values), (B values)]
+    return (
+        round(sum(channels[0]) / nr_pixels),  # R mean
+        round(sum(channels[1]) / nr_pixels),  # G mean
+        round(sum(channels[2]) / nr_pixels),  # B mean
+    )
+
+
+def random_photo(size: Size) -> Photo:
+    """
+    Create an RGB photo of the given size with random pixel values
+    """
+
+    nr_bytes = size[0] * size[1] * 3
+    return Photo(Image.frombytes('RGB', size, random.randbytes(nr_bytes)))
+
+
+def benchmark(size: Size, number: int = 3) -> None:
+    """
+    Print the time per photo of the legacy and the current average color implementation
+
+    :param size: Size of the random photo to average
+    :param number: Number of repetitions per implementation
+    """
+
+    photo = random_photo(size)
+    assert legacy_avg_color(photo) == photo._determine_avg_color()
+    legacy = timeit.timeit(lambda: legacy_avg_color(photo), number=number) / number
+    current = timeit.timeit(lambda: photo._determine_avg_color(), number=number) / number
+    print(f'{size[0]}x{size[1]}: legacy {legacy * 1000:.1f} ms, '
+          f'current {current * 1000:.1f} ms, speedup {legacy / current:.0f}x')
+
+
+if __name__ == '__main__':
+    random.seed(1)
+    for _size in ((100, 100), (1000, 750), (4000, 3000)):
+        benchmark(_size)
@@ -0,0 +1,316 @@
+import argparse
+import json
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from collector.photo_collector import PhotoCollector
+from mosaic_creator import MosaicCreator
+from photo_analyzer import PhotoAnalyzer
+from utils.instrumentation import Instrumentation, peak_rss
+from utils.path import Path
+from utils.type_hinting import Size, size_as_string
+
+# uniform: colors spread evenly over the RGB cube, clustered: colors around a few random centers
+ColorDistribution = Literal['uniform', 'clustered']
+
+BENCHMARKS_DIR = os.path.join(Path.tmp, 'benchmarks')  # Generated libraries and targets are cached here
+ORIGINAL_SIZE: Size = (160, 120)  # Size of the generated tile photos
+TILE_SIZE: Size = (40, 30)  # Size of the tiles in the mosaic
+NR_CLUSTERS = 8
+CLUSTER_STDDEV = 20
+TEXTURE_WEIGHT = 0.2  # Weight of the noise texture in every tile photo, such that the photos are not flat
+MAX_NR_SELECTIONS = 10_000
+TILES_PER_TARGET_PIXELS = 40  # Number of target pixels per tile in both directions, for photo_pixelate
+REGRESSION_THRESHOLD = 0.1  # Relative slowdown compared to the baseline that is reported as a regression
+
+BenchmarkResult = Dict[str, Any]
+
+
+def create_library(nr_tiles: int, distribution: ColorDistribution = 'uniform', seed: int = 1) -> str:
+    """
+    Create a library of synthetic tile photos, or reuse it if it was created before
+
+    Every tile photo is a single color with a faint noise texture, saved as JPEG. The colors are drawn
+    from the given distribution with the given seed, such that the library is the same in every run.
+
+    :return: Full path to the library, which contains a subdirectory original_input_photos
+    """
+
+    library_dir = os.path.join(BENCHMARKS_DIR, f'library_{nr_tiles}_{distribution}_{seed}')
+    originals_dir = os.path.join(library_dir, 'original_input_photos')
+    if os.path.isdir(originals_dir) and len(os.listdir(originals_dir)) == nr_tiles:
+        return library_dir
+
+    shutil.rmtree(library_dir, ignore_errors=True)
+    os.makedirs(originals_dir)
+    rng = np.random.default_rng(seed)
+    if distribution == 'uniform':
+        colors = rng.integers(0, 256, size=(nr_tiles, 3))
+    else:
+        centers = rng.integers(0, 256, size=(NR_CLUSTERS, 3))
+        colors = centers[rng.integers(0, NR_CLUSTERS, size=nr_tiles)] + rng.normal(0, CLUSTER_STDDEV, (nr_tiles, 3))
+        colors = np.clip(np.round(colors), 0, 255).astype(int)
+    width, height = ORIGINAL_SIZE
+    texture = Image.fromarray(rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8))
+    for index, color in enumerate(colors):
+        tile = Image.blend(Image.new('RGB', ORIGINAL_SIZE, tuple(int(channel) for channel in color)),
+                           texture, TEXTURE_WEIGHT)
+        tile.save(os.path.join(originals_dir, f'{index:08d}.jpg'), quality=90)
+    return library_dir
+
+
+def create_target(size: Size, seed: int = 1) -> str:
+    """
+    Create a synthetic target photo of the given size, or reuse it if it was created before
+
+    The target is a smooth color gradient with some noise, saved as JPEG.
+
+    :return: Full path to the target photo
+    """
+
+    target_fp = os.path.join(BENCHMARKS_DIR, f'target_{size_as_string(size)}_{seed}.jpg')
+    if os.path.exists(target_fp):
+        return target_fp
+
+    os.makedirs(BENCHMARKS_DIR, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    width, height = size
+    x = np.linspace(0, 255, width)[np.newaxis, :]
+    y = np.linspace(0, 255, height)[:, np.newaxis]
+    gradient = np.stack(np.broadcast_arrays(x, y, (x + y) / 2), axis=-1)
+    pixels = np.clip(gradient + rng.normal(0, 10, (height, width, 3)), 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(target_fp, quality=90)
+    return target_fp
+
+
+def clean_library(library_dir: str, keep_resized: bool = False) -> None:
+    """
+    Remove everything that PhotoAnalyzer stored in the library, such that the next analyzer starts cold
+
+    :param keep_resized: Whether to keep the resized photos, and only remove the analysis
+    """
+
+    analysis_fp = os.path.join(library_dir, 'photo_analysis.sqlite')
+    if os.path.exists(analysis_fp):
+        os.remove(analysis_fp)
+    if not keep_resized:
+        shutil.rmtree(os.path.join(library_dir, 'resized_input_photos'), ignore_errors=True)
+
+
+def benchmark_resize_images(library_dir: str) -> Tuple[float, int]:
+    """
+    Time resizing all photos of a cold library, which analyzes them at the same time
+
+    :return: Two-tuple with the number of seconds and the number of processed photos
+    """
+
+    clean_library(library_dir)
+    instrumentation = Instrumentation(verbose=False)
+    analyzer = PhotoAnalyzer(library_dir, nr_photo_pixels=1, tile_size=TILE_SIZE, instrumentation=instrumentation)
+    return instrumentation.timers['analyzer.resize']['seconds'], len(analyzer.originals)
+
+
+def benchmark_analyze_photos(library_dir: str) -> Tuple[float, int]:
+    """
+    Time analyzing all photos of a library of which the photos are resized, but not analyzed
+
+    :return: Two-tuple with the number of seconds and the number of analyzed photos
+    """
+
+    PhotoAnalyzer(library_dir, nr_photo_pixels=1, tile_size=TILE_SIZE, instrumentation=Instrumentation(verbose=False))
+    clean_library(library_dir, keep_resized=True)
+    instrumentation = Instrumentation(verbose=False)
+    analyzer = PhotoAnalyzer(library_dir, nr_photo_pixels=1, tile_size=TILE_SIZE, instrumentation=instrumentation)
+    return instrumentation.timers['analyzer.analyze']['seconds'], len(analyzer.originals)
+
+
+def benchmark_select_best_photo(library_dir: str) -> Tuple[float, int]:
+    """
+    Time selecting the best photo for random colors from a warm library, including reading the resized photos
+
+    :return: Two-tuple with the number of seconds and the number of selected photos
+    """
+
+    nr_selections = min(len(os.listdir(os.path.join(library_dir, 'original_input_photos'))), MAX_NR_SELECTIONS)
+    analyzer = PhotoAnalyzer(library_dir, nr_photo_pixels=nr_selections, tile_size=TILE_SIZE,
+                             instrumentation=Instrumentation(verbose=False))
+    rng = np.random.default_rng(1)
+    colors = [tuple(int(channel) for channel in color) for color in rng.integers(0, 256, (nr_selections, 3))]
+    start = time.perf_counter()
+    for color in colors:
+        analyzer.select_best_photo(color)
+    return time.perf_counter() - start, nr_selections
+
+
+def benchmark_photo_pixelate(library_dir: str, target_fp: str) -> Tuple[float, int]:
+    """
+    Time creating a mosaic of the target at its own size, from a library that is resized and analyzed for it
+
+    :return: Two-tuple with the number of seconds and the number of tiles in the mosaic
+    """
+
+    with Image.open(target_fp) as img:
+        width, height = img.size
+    nr_pixels_in_x, nr_pixels_in_y = width // TILES_PER_TARGET_PIXELS, height // TILES_PER_TARGET_PIXELS
+    creator = MosaicCreator(target_fp, nr_pixels_in_x=nr_pixels_in_x, nr_pixels_in_y=nr_pixels_in_y,
+                            max_output_size=max(width, height), instrumentation=Instrumentation(verbose=False))
+    # Resize and analyze the library for this tile size up front
+    PhotoAnalyzer(library_dir, nr_photo_pixels=1, tile_size=creator.tile_size,
+                  instrumentation=Instrumentation(verbose=False))
+    start = time.perf_counter()
+    creator.photo_pixelate(library_dir)
+    return time.perf_counter() - start, nr_pixels_in_x * nr_pixels_in_y
+
+
+def benchmark_collect(library_dir: str) -> Tuple[float, int]:
+    """
+    Time collecting the photos of the library from a raw directory end to end
+
+    :return: Two-tuple with the number of seconds and the number of collected photos
+    """
+
+    dirname = f'benchmark_{os.path.basename(library_dir)}'
+    raw_dir = Path.to_raw_photos_dir(dirname)
+    shutil.rmtree(raw_dir, ignore_errors=True)
+    shutil.copytree(os.path.join(library_dir, 'original_input_photos'), raw_dir)
+    try:
+        start = time.perf_counter()
+        PhotoCollector(dirname, instrumentation=Instrumentation(verbose=False)).collect()
+        return time.perf_counter() - start, len(os.listdir(raw_dir))
+    finally:
+        shutil.rmtree(raw_dir, ignore_errors=True)
+        shutil.rmtree(Path.to_src_photos_dir(dirname), ignore_errors=True)
+
+
+def run_isolated(func: Callable[..., Tuple[float, int]], *args: Any) -> Tuple[float, int, Optional[int]]:
+    """
+    Run a benchmark function in a new process, such that its peak memory is not affected by earlier benchmarks
+
+    :return: Three-tuple with the number of seconds, the number of processed items and the peak RSS in bytes
+    """
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_run_and_measure, func, *args).result()
+
+
+def _run_and_measure(func: Callable[..., Tuple[float, int]], *args: Any) -> Tuple[float, int, Optional[int]]:
+    seconds, nr_items = func(*args)
+    return seconds, nr_items, peak_rss()
+
+
+def run_suite(library_sizes: List[int], target_sizes: List[Size], distribution: ColorDistribution = 'uniform',
+              nr_repeats: int = 3) -> Dict[str, Any]:
+    """
+    Run all benchmarks on synthetic libraries and targets of the given sizes
+
+    Every benchmark is repeated nr_repeats times in a new process, and the fastest repetition is reported,
+    together with the highest peak RSS of all repetitions.
+
+    :return: The results, including the environment they were measured in, that can be serialized to JSON
+    """
+
+    benchmarks: List[Tuple[str, Dict[str, Any], Callable[..., Tuple[float, int]], Tuple]] = []
+    for nr_tiles in library_sizes:
+        library_dir = create_library(nr_tiles, distribution)
+        params = {'nr_tiles': nr_tiles, 'distribution': distribution}
+        benchmarks.append(('resize_images', params, benchmark_resize_images, (library_dir,)))
+        benchmarks.append(('analyze_photos', params, benchmark_analyze_photos, (library_dir,)))
+        benchmarks.append(('select_best_photo', params, benchmark_select_best_photo, (library_dir,)))
+        for target_size in target_sizes:
+            target_fp = create_target(target_size)
+            benchmarks.append(('photo_pixelate', {**params, 'target_size': size_as_string(target_size)},
+                               benchmark_photo_pixelate, (library_dir, target_fp)))
+        benchmarks.append(('collect', params, benchmark_collect, (library_dir,)))
+
+    results: List[BenchmarkResult] = []
+    for name, params, func, args in benchmarks:
+        measurements = [run_isolated(func, *args) for _ in range(nr_repeats)]
+        seconds, nr_items, _ = min(measurements)
+        rss_values = [rss for _, _, rss in measurements if rss is not None]
+        result = {
+            'name': name,
+            'params': params,
+            'seconds': seconds,
+            'nr_items': nr_items,
+            'items_per_second': nr_items / seconds if seconds > 0 else None,
+            'peak_rss_bytes': max(rss_values) if rss_values else None,
+        }
+        print(f'{_result_key(result):<72} {seconds:>9.3f}s {result["items_per_second"] or 0:>12.0f} items/s')
+        results.append(result)
+
+    return {
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'nr_cpus': os.cpu_count(),
+        'results': results,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any],
+            threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """
+    Print the relative change in time of every benchmark that is in both runs
+
+    :return: Keys of the benchmarks that are slower than the baseline by more than the threshold
+    """
+
+    baseline_results = {_result_key(result): result for result in baseline['results']}
+    regressions = []
+    print(f'Compared to baseline of commit {baseline.get("commit")}:')
+    for result in current['results']:
+        key = _result_key(result)
+        if key not in baseline_results:
+            continue
+        ratio = result['seconds'] / baseline_results[key]['seconds']
+        is_regression = ratio > 1 + threshold
+        if is_regression:
+            regressions.append(key)
+        print(f'{key:<72} {ratio:>8.2f}x time{" REGRESSION" if is_regression else ""}')
+    return regressions
+
+
+def _result_key(result: BenchmarkResult) -> str:
+    params = ','.join(f'{key}={value}' for key, value in sorted(result['params'].items()))
+    return f'{result["name"]}[{params}]'
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path.root, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the mosaic pipeline on synthetic tile libraries')
+    parser.add_argument('--library-sizes', type=int, nargs='+', default=[1000, 10_000],
+                        help='Number of tiles per library, e.g. 1000 10000 100000')
+    parser.add_argument('--target-sizes', nargs='+', default=['1000x750', '4000x3000'],
+                        help='Sizes of the targets to create mosaics of')
+    parser.add_argument('--distribution', choices=['uniform', 'clustered'], default='uniform',
+                        help='Distribution of the colors of the tile photos')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions per benchmark')
+    parser.add_argument('--output', help='JSON file to write the results to, e.g. to use as baseline later')
+    parser.add_argument('--baseline', help='JSON file with earlier results to compare with')
+    _args = parser.parse_args()
+
+    _target_sizes = [tuple(int(value) for value in size.split('x')) for size in _args.target_sizes]
+    _results = run_suite(_args.library_sizes, _target_sizes, _args.distribution, _args.repeat)
+    if _args.output:
+        with open(_args.output, 'w') as f:
+            json.dump(_results, f, indent=2)
+    if _args.baseline:
+        with open(_args.baseline) as f:
+            _regressions = compare(json.load(f), _results)
+        sys.exit(1 if _regressions else 0)
@@ -0,0 +1,49 @@
+import contextlib
+import io
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from benchmarks import suite
+from photo import Photo
+from utils.path import Path
+
+
+class SuiteTestCase(TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        patcher = patch.object(suite, 'BENCHMARKS_DIR', tmp_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_that_create_library_is_reproducible(self):
+        library_dir = suite.create_library(5, 'clustered', seed=3)
+        originals_dir = os.path.join(library_dir, 'original_input_photos')
+        filenames = sorted(os.listdir(originals_dir))
+        colors = [Photo.open(os.path.join(originals_dir, filename)).avg_color for filename in filenames]
+
+        shutil.rmtree(library_dir)
+        suite.create_library(5, 'clustered', seed=3)
+        self.assertListEqual(filenames, sorted(os.listdir(originals_dir)))
+        self.assertListEqual(colors, [Photo.open(os.path.join(originals_dir, filename)).avg_color
+                                      for filename in filenames])
+
+    def test_that_benchmarks_process_all_tiles(self):
+        library_dir = suite.create_library(6)
+        for benchmark in (suite.benchmark_resize_images, suite.benchmark_analyze_photos):
+            seconds, nr_items = benchmark(library_dir)
+            self.assertEqual(6, nr_items)
+            self.assertGreater(seconds, 0)
+
+    def test_that_compare_reports_regressions(self):
+        baseline = {'results': [{'name': 'collect', 'params': {'nr_tiles': 10}, 'seconds': 1.0},
+                                {'name': 'analyze_photos', 'params': {'nr_tiles': 10}, 'seconds': 1.0}]}
+        current = {'results': [{'name': 'collect', 'params': {'nr_tiles': 10}, 'seconds': 1.05},
+                               {'name': 'analyze_photos', 'params': {'nr_tiles': 10}, 'seconds': 1.5},
+                               {'name': 'analyze_photos', 'params': {'nr_tiles': 20}, 'seconds': 3.0}]}
+        with contextlib.redirect_stdout(io.StringIO()):
+            regressions = suite.compare(baseline, current)
+        self.assertListEqual(['analyze_photos[nr_tiles=10]'], regressions)
@@ -0,0 +1,307 @@
+import argparse
+import cProfile
+import pstats
+import random
+from typing import List, Optional
+
+from collector.photo_collector import PhotoCollector
+from mosaic_batch import read_manifest, render_batch
+from mosaic_creator import MosaicCreator
+from mosaic_plan import MosaicPlan
+from photo_analyzer import PhotoAnalyzer
+from utils.strip_writer import can_write_in_strips
+from utils.instrumentation import Instrumentation
+from utils.type_hinting import Size
+
+# Number of functions to print when profiling, sorted by cumulative time
+NR_PROFILED_FUNCTIONS_TO_PRINT = 25
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Run the command line interface with the given arguments, default is the arguments of the program
+    """
+
+    args = _create_parser().parse_args(argv)
+    instrumentation = Instrumentation()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        args.command(args, instrumentation)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f'Profile written to {args.profile}, the most expensive functions are:')
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(NR_PROFILED_FUNCTIONS_TO_PRINT)
+        if args.timings:
+            print(instrumentation.format_timers())
+        if args.report:
+            instrumentation.write_report(args.report)
+
+
+def _collect(args: argparse.Namespace, instrumentation: Instrumentation) -> None:
+    with instrumentation.timer('cli.collect'):
+        collector = PhotoCollector(args.dirname, instrumentation=instrumentation, nr_workers=args.jobs)
+        collector.collect(desired_width=args.width, fast_decode=args.fast_decode, deduplicate=args.deduplicate,
+                          max_hash_distance=args.max_hash_distance, tile_sizes=args.tile_size or ())
+
+
+def _analyze(args: argparse.Namespace, instrumentation: Instrumentation) -> None:
+    with instrumentation.timer('cli.load_library'):
+        # The number of tiles only matters when selecting photos, which is not done here
+        PhotoAnalyzer(args.src_dir, nr_photo_pixels=1, tile_size=args.tile_size, fast_decode=args.fast_decode,
+                      use_atlas=args.atlas, nr_workers=args.jobs, use_content_hash=args.content_hash,
+                      use_pyramid=args.pyramid, max_cache_bytes=_nr_bytes(args.max_cache_size),
+                      max_tile_cache_bytes=_nr_bytes(args.tile_cache_size), use_color_store=args.color_store,
+                      instrumentation=instrumentation)
+
+
+def _render(args: argparse.Namespace, instrumentation: Instrumentation) -> None:
+    if args.seed is not None:
+        random.seed(args.seed)
+    with instrumentation.timer('cli.load_target'):
+        creator = MosaicCreator(args.target, nr_pixels_in_x=args.nr_pixels_in_x, nr_pixels_in_y=args.nr_pixels_in_y,
+                                max_output_size=args.max_output_size, cheat_parameter=args.cheat_parameter,
+                                nr_prefetch_threads=args.prefetch_threads, instrumentation=instrumentation)
+    with instrumentation.timer('cli.load_library'):
+        analyzer = PhotoAnalyzer(args.src_dir, nr_photo_pixels=args.nr_pixels_in_x * args.nr_pixels_in_y,
+                                 tile_size=creator.tile_size, fast_decode=args.fast_decode, use_atlas=args.atlas,
+                                 nr_workers=args.jobs, use_content_hash=args.content_hash,
+                                 use_pyramid=args.pyramid, max_cache_bytes=_nr_bytes(args.max_cache_size),
+                                 max_tile_cache_bytes=_nr_bytes(args.tile_cache_size),
+                                 use_color_store=args.color_store, instrumentation=instrumentation)
+    if can_write_in_strips(args.output):
+        with instrumentation.timer('cli.render'):
+            creator.photo_pixelate_to_file(args.src_dir, args.output, jpeg_fp=args.jpeg,
+                                           assignment=args.assignment, analyzer=analyzer)
+    else:
+        with instrumentation.timer('cli.render'):
+            photo = creator.photo_pixelate(args.src_dir, assignment=args.assignment, analyzer=analyzer,
+                                           nr_render_workers=args.render_jobs)
+        with instrumentation.timer('cli.save'):
+            photo.save(args.output)
+
+
+def _plan(args: argparse.Namespace, instrumentation: Instrumentation) -> None:
+    with instrumentation.timer('cli.load_target'):
+        creator = MosaicCreator(args.target, nr_pixels_in_x=args.nr_pixels_in_x, nr_pixels_in_y=args.nr_pixels_in_y,
+                                max_output_size=args.max_output_size, instrumentation=instrumentation)
+    with instrumentation.timer('cli.load_library'):
+        analyzer = PhotoAnalyzer(args.src_dir, nr_photo_pixels=args.nr_pixels_in_x * args.nr_pixels_in_y,
+                                 tile_size=creator.tile_size, fast_decode=args.fast_decode, use_atlas=args.atlas,
+                                 nr_workers=args.jobs, use_content_hash=args.content_hash,
+                                 use_pyramid=args.pyramid, max_tile_cache_bytes=_nr_bytes(args.tile_cache_size),
+                                 use_color_store=args.color_store, instrumentation=instrumentation)
+    with instrumentation.timer('cli.plan'):
+        plan = creator.plan(args.src_dir, assignment=args.assignment, seed=args.seed, analyzer=analyzer)
+    plan.save(args.output)
+    instrumentation.log(f'Wrote plan with seed {plan.seed} to {args.output}')
+
+
+def _render_plan(args: argparse.Namespace, instrumentation: Instrumentation) -> None:
+    plan = MosaicPlan.load(args.plan)
+    with instrumentation.timer('cli.load_target'):
+        creator = MosaicCreator(plan.target_fp, nr_pixels_in_x=plan.nr_pixels_in_x,
+                                nr_pixels_in_y=plan.nr_pixels_in_y, max_output_size=args.max_output_size,
+                                cheat_parameter=args.cheat_parameter, nr_prefetch_threads=args.prefetch_threads,
+                                instrumentation=instrumentation)
+    with instrumentation.timer('cli.load_library'):
+        analyzer = PhotoAnalyzer(plan.src_dir, nr_photo_pixels=plan.nr_pixels_in_x * plan.nr_pixels_in_y,
+                                 tile_size=creator.tile_size, fast_decode=args.fast_decode, use_atlas=args.atlas,
+                                 nr_workers=args.jobs, use_pyramid=args.pyramid,
+                                 max_cache_bytes=_nr_bytes(args.max_cache_size),
+                                 max_tile_cache_bytes=_nr_bytes(args.tile_cache_size),
+                                 instrumentation=instrumentation)
+    if can_write_in_strips(args.output):
+        with instrumentation.timer('cli.render'):
+            creator.render_plan_to_file(plan, args.output, jpeg_fp=args.jpeg, analyzer=analyzer)
+    else:
+        with instrumentation.timer('cli.render'):
+            photo = creator.render_plan(plan, analyzer=analyzer, nr_render_workers=args.render_jobs)
+        with instrumentation.timer('cli.save'):
+            photo.save(args.output)
+
+
+def _pixelate(args: argparse.Namespace, instrumentation: Instrumentation) -> None:
+    with instrumentation.timer('cli.load_target'):
+        creator = MosaicCreator(args.target, nr_pixels_in_x=args.nr_pixels_in_x, nr_pixels_in_y=args.nr_pixels_in_y,
+                                max_output_size=args.max_output_size, instrumentation=instrumentation)
+    if can_write_in_strips(args.output):
+        with instrumentation.timer('cli.render'):
+            creator.pixelate_to_file(args.nr_pixels_in_x, args.nr_pixels_in_y, args.output)
+    else:
+        with instrumentation.timer('cli.render'):
+            photo = creator.pixelate(args.nr_pixels_in_x, args.nr_pixels_in_y)
+        with instrumentation.timer('cli.save'):
+            photo.save(args.output)
+
+
+def _batch(args: argparse.Namespace, instrumentation: Instrumentation) -> None:
+    with instrumentation.timer('cli.read_manifest'):
+        jobs = read_manifest(args.manifest)
+    with instrumentation.timer('cli.render'):
+        render_batch(jobs, summary_fp=args.summary, nr_processes=args.jobs, fast_decode=args.fast_decode,
+                     use_atlas=args.atlas, use_pyramid=args.pyramid,
+                     max_tile_cache_bytes=_nr_bytes(args.tile_cache_size), use_color_store=args.color_store,
+                     instrumentation=instrumentation)
+
+
+def _nr_bytes(nr_megabytes: Optional[int]) -> Optional[int]:
+    return nr_megabytes * 1024 * 1024 if nr_megabytes is not None else None
+
+
+def _size(text: str) -> Size:
+    """
+    Parse a size in the format of size_as_string, e.g. 25x40
+    """
+
+    try:
+        width, height = (int(value) for value in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{text} is not a size like 25x40')
+    return width, height
+
+
+def _create_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--profile', metavar='FILE',
+                        help='Profile the command with cProfile, and write the statistics to FILE for pstats')
+    common.add_argument('--timings', action='store_true',
+                        help='Print the wall time and peak resident memory of every stage of the command')
+    common.add_argument('--report', metavar='FILE',
+                        help='Write the timers, counters and progress messages of the command to FILE as JSON')
+
+    library = argparse.ArgumentParser(add_help=False)
+    library.add_argument('--fast-decode', action='store_true',
+                         help='Decode the tile photos at reduced resolution, with a slight drift in average color')
+    library.add_argument('--atlas', action='store_true',
+                         help='Store the resized tile photos in a memory-mapped tile atlas instead of in JPEG files')
+    library.add_argument('--jobs', type=int, default=1, help='Number of worker processes')
+    library.add_argument('--pyramid', action='store_true',
+                         help='Keep the tile photos at a few power-of-two sizes, to resize them to new tile sizes from')
+    library.add_argument('--tile-cache-size', type=int, metavar='MB',
+                         default=PhotoAnalyzer.DEFAULT_MAX_TILE_CACHE_BYTES // (1024 * 1024),
+                         help='Maximum number of megabytes of decoded tile photos to keep in memory')
+    library.add_argument('--color-store', action='store_true',
+                         help='Select tile photos with a memory-mapped color store, for libraries with many photos')
+
+    target = argparse.ArgumentParser(add_help=False)
+    target.add_argument('target', help='Photo to create a mosaic of')
+    target.add_argument('-x', '--nr-pixels-in-x', type=int, required=True, help='Number of tiles horizontally')
+    target.add_argument('-y', '--nr-pixels-in-y', type=int, required=True, help='Number of tiles vertically')
+    target.add_argument('--max-output-size', type=int, default=MosaicCreator.DEFAULT_MAX_OUTPUT_SIZE,
+                        help='Maximum width or height of the output')
+    target.add_argument('-o', '--output', required=True,
+                        help='File to write the output to. .ppm, .tif and .tiff files are written in strips, '
+                             'without the complete output in memory')
+
+    parser = argparse.ArgumentParser(description='Create a photo mosaic from other photos')
+    subparsers = parser.add_subparsers(required=True, metavar='command')
+
+    collect_parser = subparsers.add_parser('collect', parents=[common],
+                                           help='Collect the photos with the most common aspect ratio from raw/DIRNAME')
+    collect_parser.add_argument('dirname', help='Directory within the raw directory')
+    collect_parser.add_argument('--width', type=int, default=250, help='Width to resize the collected photos to')
+    collect_parser.add_argument('--fast-decode', action='store_true',
+                                help='Decode JPEG photos at reduced resolution before resizing them')
+    collect_parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes')
+    collect_parser.add_argument('--deduplicate', action='store_true',
+                                help='Leave out identical and near-identical photos, and list them in duplicates.json')
+    collect_parser.add_argument('--max-hash-distance', type=int, default=PhotoCollector.DEFAULT_MAX_HASH_DISTANCE,
+                                help='Maximum number of differing bits in the perceptual hashes of near-identical '
+                                     'photos')
+    collect_parser.add_argument('--tile-size', type=_size, action='append',
+                                help='Collect the photos as a tile library in original_input_photos, resized to this '
+                                     'tile size and analyzed while collecting, e.g. 25x40. Can be repeated.')
+    collect_parser.set_defaults(command=_collect)
+
+    # Only for commands that load a single library, since a batch could remove the tiles of one of its other libraries
+    cache = argparse.ArgumentParser(add_help=False)
+    cache.add_argument('--max-cache-size', type=int, metavar='MB',
+                       help='Remove the least recently used resized tile photos of other tile sizes, until all '
+                            'resized tile photos take at most this many megabytes')
+
+    analyze_parser = subparsers.add_parser('analyze', parents=[common, library, cache],
+                                           help='Resize and analyze the tile photos, to make later renders faster')
+    analyze_parser.add_argument('src_dir', help='Directory with a subdirectory original_input_photos')
+    analyze_parser.add_argument('--tile-size', type=_size, required=True, help='Size of a tile, e.g. 25x40')
+    analyze_parser.add_argument('--content-hash', action='store_true',
+                                help='Identify photos by content, such that renamed photos are not analyzed again')
+    analyze_parser.set_defaults(command=_analyze)
+
+    render_parser = subparsers.add_parser('render', parents=[common, library, cache, target],
+                                          help='Create a mosaic of the target from the tile photos')
+    render_parser.add_argument('src_dir', help='Directory with a subdirectory original_input_photos')
+    render_parser.add_argument('--cheat-parameter', type=int, default=MosaicCreator.DEFAULT_CHEAT_PARAMETER,
+                               help='Value between 0 (no cheat) and 255 (full cheat) to color the tiles '
+                                    'in the color of the target')
+    render_parser.add_argument('--assignment', choices=['greedy', 'optimal'], default='greedy',
+                               help='Match tiles one by one in random order, or minimize the total color distance')
+    render_parser.add_argument('--content-hash', action='store_true',
+                               help='Identify photos by content, such that renamed photos are not analyzed again')
+    render_parser.add_argument('--jpeg', help='Additionally convert an output written in strips to this JPEG file')
+    render_parser.add_argument('--seed', type=int, help='Random seed, to render the same greedy mosaic again')
+    render_parser.add_argument('--render-jobs', type=int, default=1,
+                               help='Number of worker processes to paste the tiles of an output rendered in '
+                                    'memory with')
+    render_parser.add_argument('--prefetch-threads', type=int, default=PhotoAnalyzer.DEFAULT_NR_PREFETCH_THREADS,
+                               help='Number of threads to read and decode the upcoming tile photos with, 0 to read '
+                                    'them one by one')
+    render_parser.set_defaults(command=_render)
+
+    plan_parser = subparsers.add_parser('plan', parents=[common, library],
+                                        help='Match the tile photos to the target, and write the plan to a JSON file '
+                                             'to render it later')
+    plan_parser.add_argument('target', help='Photo to create a mosaic of')
+    plan_parser.add_argument('src_dir', help='Directory with a subdirectory original_input_photos')
+    plan_parser.add_argument('-x', '--nr-pixels-in-x', type=int, required=True, help='Number of tiles horizontally')
+    plan_parser.add_argument('-y', '--nr-pixels-in-y', type=int, required=True, help='Number of tiles vertically')
+    plan_parser.add_argument('--max-output-size', type=int, default=MosaicCreator.DEFAULT_MAX_OUTPUT_SIZE,
+                             help='Maximum width or height of the output, to prepare the tile photos for')
+    plan_parser.add_argument('-o', '--output', required=True, help='JSON file to write the plan to')
+    plan_parser.add_argument('--assignment', choices=['greedy', 'optimal'], default='greedy',
+                             help='Match tiles one by one in random order, or minimize the total color distance')
+    plan_parser.add_argument('--content-hash', action='store_true',
+                             help='Identify photos by content, such that renamed photos are not analyzed again')
+    plan_parser.add_argument('--seed', type=int, help='Random seed to match the tiles with, default is random')
+    plan_parser.set_defaults(command=_plan)
+
+    render_plan_parser = subparsers.add_parser('render-plan', parents=[common, library, cache],
+                                               help='Render the mosaic of a plan written by the plan command')
+    render_plan_parser.add_argument('plan', help='JSON file with the plan')
+    render_plan_parser.add_argument('--max-output-size', type=int, default=MosaicCreator.DEFAULT_MAX_OUTPUT_SIZE,
+                                    help='Maximum width or height of the output')
+    render_plan_parser.add_argument('--cheat-parameter', type=int, default=MosaicCreator.DEFAULT_CHEAT_PARAMETER,
+                                    help='Value between 0 (no cheat) and 255 (full cheat) to color the tiles '
+                                         'in the color of the target')
+    render_plan_parser.add_argument('-o', '--output', required=True,
+                                    help='File to write the output to. .ppm, .tif and .tiff files are written in '
+                                         'strips, without the complete output in memory')
+    render_plan_parser.add_argument('--jpeg',
+                                    help='Additionally convert an output written in strips to this JPEG file')
+    render_plan_parser.add_argument('--render-jobs', type=int, default=1,
+                                    help='Number of worker processes to paste the tiles of an output rendered in '
+                                         'memory with')
+    render_plan_parser.add_argument('--prefetch-threads', type=int,
+                                    default=PhotoAnalyzer.DEFAULT_NR_PREFETCH_THREADS,
+                                    help='Number of threads to read and decode the upcoming tile photos with, 0 to '
+                                         'read them one by one')
+    render_plan_parser.set_defaults(command=_render_plan)
+
+    pixelate_parser = subparsers.add_parser('pixelate', parents=[common, target],
+                                            help='Pixelate the target with the average color of every tile')
+    pixelate_parser.set_defaults(command=_pixelate)
+
+    batch_parser = subparsers.add_parser('batch', parents=[common, library],
+                                         help='Render all mosaics in a manifest against shared tile libraries')
+    batch_parser.add_argument('manifest', help='JSON lines (.jsonl) or CSV (.csv) file with one job per line')
+    batch_parser.add_argument('--summary', help='JSON file to write the timings of all jobs to')
+    batch_parser.set_defaults(command=_batch)
+
+    return parser
+
+
+if __name__ == '__main__':
+    main()
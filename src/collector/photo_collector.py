@@ -1,15 +1,56 @@
+import hashlib
+import io
 import json
 import os
 import shutil
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
 
 import math
 
+import numpy as np
+from PIL import Image
+
+from analysis_cache import AnalysisCache
 from photo import Photo
+from photo_analyzer import PhotoAnalyzer
+from utils.bk_tree import BKTree
 from utils.image_utils import is_image
+from utils.instrumentation import Instrumentation
 from utils.os_utils import ensure_empty_dir
+from utils.parallel_utils import imap_bounded
 from utils.path import Path
-from utils.type_hinting import Size
+from utils.type_hinting import Color, Size, size_as_string
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+# Number of bits per row and per column of the perceptual hash, which has HASH_SIZE ** 2 bits
+HASH_SIZE = 8
+
+# Transposition that makes an image upright, per EXIF orientation, as in PIL.ImageOps.exif_transpose
+ORIENTATION_TRANSPOSITIONS = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+
+class RawPhoto(NamedTuple):
+    """
+    A photo in the unorganized directory, as read from its header
+    """
+
+    fp: str  # Full path to the photo in the unorganized directory
+    filename: str  # Normalized filename in the organized directory: <zero_padded_index>.<extension>
+    size: Size  # Size as it is displayed, i.e. after applying the EXIF orientation
+    orientation: int  # EXIF orientation, where 1 is upright
+    content_hash: Optional[str] = None  # Hash of the file content, only determined when deduplicating
+    perceptual_hash: Optional[int] = None  # Difference hash of the upright pixels, only determined when deduplicating
 
 
 class PhotoCollector:
@@ -23,21 +64,59 @@ class PhotoCollector:
     # Resize images, even if the aspect ratio distorts by this amount (factor between 0 and 1, i.e. 0.05 means 5%)
     ALLOWED_DISTORTION_RATE = 0.05
 
-    def __init__(self, dirname: str) -> None:
+    # Number of threads to read the image headers with. Reading headers is dominated by waiting for the disk.
+    NR_HEADER_THREADS = 16
+
+    # Maximum number of bits in which the perceptual hashes of near-duplicate photos differ
+    DEFAULT_MAX_HASH_DISTANCE = 4
+
+    def __init__(self, dirname: str, instrumentation: Optional[Instrumentation] = None, nr_workers: int = 1) -> None:
         """
         :param dirname: Directory within the `raw` directory to collect photos from
                         Photos will be collected in this dirname in the `photos` directory
+        :param instrumentation: Instrumentation to record timers, counters and progress messages in
+        :param nr_workers: Number of processes to resize the selected photos with
         """
 
         self.raw_dir = Path.to_raw_photos_dir(dirname)
         self.photos_dir = Path.to_src_photos_dir(dirname)
+        self.instrumentation = instrumentation or Instrumentation()
+        self.nr_workers = nr_workers
+
+    def collect(self, desired_width: int = 250, fast_decode: bool = False, deduplicate: bool = False,
+                max_hash_distance: Optional[int] = DEFAULT_MAX_HASH_DISTANCE, tile_sizes: Iterable[Size] = ()) -> None:
+        """
+        Collect the photos with the most common size ratio in `photos/<dirname>/mosaic`, resized to desired_width
+
+        The unorganized directory is scanned once, reading only the header of every photo. Only the selected
+        photos are then decoded, and written to the organized directory. Photos that already have the
+        desired size and are upright are linked instead of copied where possible, so the raw tree must not
+        be modified in place afterwards.
+
+        If tile_sizes are given, the photos are collected as a tile library instead, that a PhotoAnalyzer of
+        `photos/<dirname>` uses without decoding any photo again: the photos are written to its originals
+        directory, and while each photo is decoded, it is also resized to every tile size and analyzed.
+
+        :param desired_width: The width of the final images to use in the MosaicCreator
+        :param fast_decode: Decode JPEG photos at the smallest resolution that is still at least the desired size
+        :param deduplicate: Whether to leave out duplicates and near-duplicates, see _remove_duplicates. This reads
+                            the complete photos during the scan, instead of only their headers.
+        :param max_hash_distance: Maximum distance between the perceptual hashes of near-duplicates,
+                                  or None to only leave out identical photos
+        :param tile_sizes: Tile sizes to prepare the resized photos of the tile library for
+        """
 
-    def collect(self, desired_width: int = 250) -> None:
         ensure_empty_dir(self.photos_dir)
-        self._collect_files()
-        most_common_size_ratio = self._split_by_size_ratio()
-        self._select_images(most_common_size_ratio)
-        self._resize_images(most_common_size_ratio, desired_width)
+        with self.instrumentation.timer('collector.scan'):
+            raw_photos = self._scan_raw_dir(deduplicate)
+        if deduplicate:
+            with self.instrumentation.timer('collector.deduplicate'):
+                raw_photos = self._remove_duplicates(raw_photos, max_hash_distance)
+        size_ratio_index = self._index_by_size_ratio(raw_photos)
+        most_common_size_ratio = max(size_ratio_index, key=lambda ratio: len(size_ratio_index[ratio]))
+        selected_photos = self._select_photos(size_ratio_index, most_common_size_ratio)
+        with self.instrumentation.timer('collector.materialize'):
+            self._materialize(selected_photos, most_common_size_ratio, desired_width, fast_decode, list(tile_sizes))
 
     def _clean_photos_dir(self) -> None:
         """
@@ -48,13 +127,16 @@ class PhotoCollector:
             shutil.rmtree(self.photos_dir)
         os.mkdir(self.photos_dir)
 
-    def _collect_files(self) -> None:
+    def _scan_raw_dir(self, deduplicate: bool = False) -> List[RawPhoto]:
         """
-        Store all files in the given directory inside `raw` (and subdirectories) in a single directory inside `photos`
+        Return all photos in the given directory inside `raw` (and subdirectories), reading only their headers
+
+        If deduplicate, the complete photos are read instead, to determine their content and perceptual hashes.
 
-        The filenames in the single directory are normalized: <zero_padded_index>.<extension>
+        The photos are numbered in the order of the directory walk, and get a normalized filename:
+        <zero_padded_index>.<extension>. Files that cannot be read as an image are skipped.
 
-        Before:
+        Example:
 
         raw/
             original_input_photos/
@@ -67,33 +149,85 @@ class PhotoCollector:
                     cat003.JPG
                     cat005.JPG
 
-        After:
-
-        photos/
-            original_input_photos/
-                00000001.jpg
-                00000002.jpg
-                00000003.jpg
-                00000004.jpg
-                00000005.jpg
+        results in the filenames 00000001.jpg up to and including 00000005.jpg
         """
 
-        nr_files = 0
+        fps = []
         for dirpath, _, filenames in os.walk(self.raw_dir):
-            for filename in filenames:
-                if not is_image(filename):
-                    continue
+            fps.extend(os.path.join(dirpath, filename) for filename in filenames if is_image(filename))
+
+        with ThreadPoolExecutor(max_workers=self.NR_HEADER_THREADS) as executor:
+            headers = list(executor.map(_read_header, fps, [deduplicate] * len(fps)))
+
+        raw_photos = []
+        for index, (fp, header) in enumerate(zip(fps, headers), start=1):
+            _, ext = os.path.splitext(fp)
+            if header is None:
+                self.instrumentation.log(f'Skipped {fp}, since it cannot be read as an image')
+                continue
+            raw_photos.append(RawPhoto(fp, str(index).zfill(8) + ext.lower(), *header))
+        self.instrumentation.count('collector.headers_read', len(fps))
+        self.instrumentation.log(f'Found {len(raw_photos)} photos in {self.raw_dir}')
+        return raw_photos
+
+    def _remove_duplicates(self, raw_photos: List[RawPhoto], max_hash_distance: Optional[int]) -> List[RawPhoto]:
+        """
+        Return the given photos without the duplicates, and write a report of the photos that are left out
+
+        A photo is identical to an earlier photo if their contents have the same hash. A photo is a near-duplicate,
+        e.g. of the same burst, if its perceptual hash is within max_hash_distance of the hash of an earlier photo
+        that is kept. These are found in a BKTree, instead of comparing all pairs of photos. Of every group of
+        duplicates, the first photo in the order of the directory walk is kept.
+
+        The report is written to `duplicates.json`, with per left out photo the kept photo it duplicates.
 
-                _, ext = os.path.splitext(filename)
-                nr_files += 1
-                src_full_path = os.path.join(dirpath, filename)
-                new_filename = str(nr_files).zfill(8) + ext.lower()
-                dst_full_path = os.path.join(self.photos_dir, new_filename)
-                shutil.copyfile(src_full_path, dst_full_path)
+        :param raw_photos: Photos as returned by _scan_raw_dir with deduplicate
+        :param max_hash_distance: Maximum distance between the perceptual hashes of near-duplicates,
+                                  or None to only leave out identical photos
+        """
+
+        kept_photo_per_content_hash: Dict[str, RawPhoto] = {}  # The kept photo that is identical or similar
+        perceptual_hashes: BKTree[RawPhoto] = BKTree()
+        kept_photos = []
+        duplicates = []
+        for raw_photo in raw_photos:
+            kept_photo = kept_photo_per_content_hash.get(raw_photo.content_hash)
+            if kept_photo:
+                # Point at the photo that is kept, also when the first photo with this content was left out itself
+                duplicates.append({'fp': raw_photo.fp, 'duplicate_of': kept_photo.fp, 'reason': 'identical',
+                                   'hash_distance': 0})
+                continue
 
-    def _split_by_size_ratio(self) -> int:
+            if max_hash_distance is not None:
+                similar_photos = perceptual_hashes.find(raw_photo.perceptual_hash, max_hash_distance)
+                if similar_photos:
+                    hash_distance, similar_photo = similar_photos[0]
+                    duplicates.append({'fp': raw_photo.fp, 'duplicate_of': similar_photo.fp, 'reason': 'similar',
+                                       'hash_distance': hash_distance})
+                    kept_photo_per_content_hash[raw_photo.content_hash] = similar_photo
+                    continue
+                perceptual_hashes.add(raw_photo.perceptual_hash, raw_photo)
+            kept_photo_per_content_hash[raw_photo.content_hash] = raw_photo
+            kept_photos.append(raw_photo)
+
+        nr_identical = sum(1 for duplicate in duplicates if duplicate['reason'] == 'identical')
+        report = {
+            'nr_photos': len(raw_photos),
+            'nr_identical': nr_identical,
+            'nr_similar': len(duplicates) - nr_identical,
+            'max_hash_distance': max_hash_distance,
+            'duplicates': duplicates,
+        }
+        with open(os.path.join(self.photos_dir, 'duplicates.json'), 'w') as f:
+            f.write(json.dumps(report, indent=4))
+        self.instrumentation.count('collector.duplicates', len(duplicates))
+        self.instrumentation.log(f'Left out {nr_identical} identical and {len(duplicates) - nr_identical} '
+                                 f'similar photos')
+        return kept_photos
+
+    def _index_by_size_ratio(self, raw_photos: List[RawPhoto]) -> Dict[int, List[RawPhoto]]:
         """
-        Split the flat directory structure of images in `photos/<dirname>` into a directory per size ratio
+        Return the photos per size ratio
 
         Size ratio is defined as width/height, multiplied by 100 and rounded to an integer
         In other words: 100 means 1:1, 160 means 8:5, etc.
@@ -101,83 +235,199 @@ class PhotoCollector:
         As a side effect, we write a file called `size_ratio.json` with per size ratio the
         amount of images with that size ratio. This can be used to manually inspect the
         various size ratios incase you receive surprising results.
-
-        :return: The most common size ratio
         """
 
-        # Exhaust the iterator in order to not iterate over directories created in the for-loop
-        files = list(os.scandir(self.photos_dir))
-        size_ratio_counter = defaultdict(int)
-        for file in files:
-            img = Photo.open(file.path)
-            w, h = img.size
-            resolution = int(round(w / h * 100))
-            dst_dirname = str(resolution)
-            dst_dir = os.path.join(self.photos_dir, dst_dirname)
-            if not os.path.isdir(dst_dir):
-                os.mkdir(dst_dir)
-            dst_full_path = os.path.join(dst_dir, file.name)
-            size_ratio_counter[resolution] += 1
-            shutil.move(file.path, dst_full_path)
+        size_ratio_index: Dict[int, List[RawPhoto]] = defaultdict(list)
+        for raw_photo in raw_photos:
+            w, h = raw_photo.size
+            size_ratio_index[int(round(w / h * 100))].append(raw_photo)
 
         # Sort by number of occurrences
-        size_ratio_counter = Counter(size_ratio_counter).most_common()
-        most_common = size_ratio_counter[0][0]
-        size_ratio_counter = dict(size_ratio_counter)
-
+        size_ratio_counter = Counter({ratio: len(photos) for ratio, photos in size_ratio_index.items()})
         resolution_file = os.path.join(self.photos_dir, 'size_ratio.json')
         with open(resolution_file, 'w') as f:
-            f.write(json.dumps(size_ratio_counter, indent=4))
+            f.write(json.dumps(dict(size_ratio_counter.most_common()), indent=4))
 
-        return most_common
+        return dict(size_ratio_index)
 
-    def _select_images(self, desired_size_ratio: int) -> None:
+    def _select_photos(self, size_ratio_index: Dict[int, List[RawPhoto]], desired_size_ratio: int) -> List[RawPhoto]:
         """
-        Copy all images with the given desired size ratio to photos/<dirname>/mosaic
+        Return all photos with the given desired size ratio, in the order of their normalized filenames
 
         Note that all images with approximately the same size ratio are also selected. What qualifies
         as approximately is defined by the constant self.ALLOWED_DISTORTION_RATE
 
-        :param desired_size_ratio: The desired size ratio for the final images (as defined in split_by_size_ratio)
+        :param size_ratio_index: Photos per size ratio, as returned by _index_by_size_ratio
+        :param desired_size_ratio: The desired size ratio for the final images (as defined in _index_by_size_ratio)
         """
 
-        mosaic_dir = os.path.join(self.photos_dir, 'mosaic')
-        ensure_empty_dir(mosaic_dir)
-
         min_resolution = int(math.ceil(desired_size_ratio * (1 - self.ALLOWED_DISTORTION_RATE)))
         max_resolution = int(math.floor(desired_size_ratio * (1 + self.ALLOWED_DISTORTION_RATE)))
+        selected_photos = []
         for resolution in range(min_resolution, max_resolution + 1):
-            img_dir = os.path.join(self.photos_dir, str(resolution))
-            if not os.path.isdir(img_dir):
-                continue
-            files = list(os.scandir(img_dir))
-            for file in files:
-                dst_file = os.path.join(mosaic_dir, file.name)
-                shutil.copy(file, dst_file)
+            selected_photos.extend(size_ratio_index.get(resolution, []))
+        return sorted(selected_photos, key=lambda raw_photo: raw_photo.filename)
 
-    def _resize_images(self, desired_size_ratio: int, desired_width: int) -> None:
+    def _materialize(self, raw_photos: List[RawPhoto], desired_size_ratio: int, desired_width: int,
+                     fast_decode: bool = False, tile_sizes: Sequence[Size] = ()) -> None:
         """
-        Resize all images from photos/<dirname>/mosaic to the desired width
+        Write the given photos to photos/<dirname>/mosaic, upright and resized to the desired width
+
+        If tile_sizes are given, write them to the originals directory of the tile library in photos/<dirname>
+        instead, together with the resized photos per tile size and the average colors, see collect.
+        The photos are processed in a stream on nr_workers processes, that decode every photo that is not linked
+        once to write it. If tile_sizes are given, every written photo is decoded once more, to derive the resized
+        photos and the average color from it exactly like PhotoAnalyzer does.
 
-        :param desired_size_ratio: The desired size ratio for the final images (as defined in split_by_size_ratio)
+        :param raw_photos: Photos to write, as selected by _select_photos
+        :param desired_size_ratio: The desired size ratio for the final images (as defined in _index_by_size_ratio)
         :param desired_width: The width of the final images to use in the MosaicCreator
+        :param fast_decode: Decode JPEG photos at the smallest resolution that is still at least the desired size
+        :param tile_sizes: Tile sizes to prepare the resized photos of the tile library for
 
         Rationale why we do not have desired_height as input: it needs to be calculated in a rather
-        tedious way, and we don't want the client to take care of that. The desired_
+        tedious way, and we don't want the client to take care of that.
         """
 
-        # TODO: I have the feeling that this should not be done here.
-
         desired_height = int(round(desired_width / desired_size_ratio * 100))
         desired_size: Size = (desired_width, desired_height)
 
-        mosaic_dir = os.path.join(self.photos_dir, 'mosaic')
+        mosaic_dir = os.path.join(self.photos_dir, PhotoAnalyzer.ORIGINALS_DIRNAME if tile_sizes else 'mosaic')
+        ensure_empty_dir(mosaic_dir)
+        tiles = [(tile_size, PhotoAnalyzer.resizeds_dir_of(self.photos_dir, tile_size)) for tile_size in tile_sizes]
+        for _, resizeds_dir in tiles:
+            # The photos directory was emptied at the start of collect
+            os.makedirs(resizeds_dir)
+
+        args_list = (
+            (raw_photo.fp, mosaic_dir, raw_photo.filename, raw_photo.size, raw_photo.orientation, desired_size,
+             fast_decode, tiles)
+            for raw_photo in raw_photos
+        )
+        nr_linked = 0
+        colors: Dict[str, Color] = {}
+        results = imap_bounded(_materialize_photo, args_list, nr_workers=self.nr_workers)
+        for raw_photo, (linked, avg_color) in zip(raw_photos, results):
+            nr_linked += linked
+            if avg_color is not None:
+                colors[raw_photo.filename] = avg_color
+        self.instrumentation.count('collector.photos_linked', nr_linked)
+        # Photos that are not linked are decoded to write them, and written photos are decoded again for the tiles
+        nr_decoded_to_write = len(raw_photos) - nr_linked
+        self.instrumentation.count('photos_decoded', nr_decoded_to_write + (len(raw_photos) if tile_sizes else 0))
+        self.instrumentation.log(f'Collected {len(raw_photos)} photos of {size_as_string(desired_size)} '
+                                 f'in {mosaic_dir}, of which {nr_linked} linked')
+
+        if tile_sizes:
+            # The lookup determines the file statistics of the written photos, which the stored colors are valid for
+            analysis_cache = AnalysisCache(os.path.join(self.photos_dir, PhotoAnalyzer.ANALYSIS_CACHE_FILENAME))
+            analysis_cache.lookup(mosaic_dir, colors)
+            analysis_cache.store(colors)
+            analysis_cache.close()
+            self.instrumentation.log(f'Resized {len(raw_photos)} photos to '
+                                     f'{", ".join(size_as_string(tile_size) for tile_size in tile_sizes)} '
+                                     f'and analyzed their average color')
+
+
+def _read_header(fp: str, deduplicate: bool = False) -> Optional[Tuple[Size, int, Optional[str], Optional[int]]]:
+    """
+    Return the size as displayed and the EXIF orientation of the given photo, without decoding its pixels
+
+    If deduplicate, additionally return the content hash and the perceptual hash of the photo. This reads the
+    complete file, and decodes it at a fraction of its resolution.
+
+    :return: Four-tuple with the size, the orientation, the content hash and the perceptual hash,
+             or None if the file cannot be read as an image
+    """
+
+    content_hash = perceptual_hash = None
+    try:
+        if deduplicate:
+            with open(fp, 'rb') as f:
+                content = f.read()
+            content_hash = hashlib.blake2b(content, digest_size=16).hexdigest()
+            fp_or_file = io.BytesIO(content)
+        else:
+            fp_or_file = fp
+        with Image.open(fp_or_file) as img:
+            width, height = img.size
+            orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            if orientation not in ORIENTATION_TRANSPOSITIONS:
+                orientation = 1
+            if deduplicate:
+                perceptual_hash = _difference_hash(img, orientation)
+    except (OSError, SyntaxError):
+        return None
+    if orientation >= 5:
+        # Orientations 5 to 8 rotate the photo by a quarter turn
+        width, height = height, width
+    return (width, height), orientation, content_hash, perceptual_hash
+
+
+def _difference_hash(img: Image.Image, orientation: int) -> int:
+    """
+    Return the difference hash of the upright image, which is equal for photos that look alike
+
+    The image is shrunk to HASH_SIZE + 1 by HASH_SIZE gray pixels, and every bit of the hash tells whether a
+    pixel is brighter than its right neighbour. This is insensitive to scaling, compression and small changes.
+    """
+
+    hash_size = (HASH_SIZE + 1, HASH_SIZE)
+    if img.format == 'JPEG':
+        # Decode at the smallest scale the JPEG decoder supports, which is still plenty for the hash
+        img.draft('L', (hash_size[0] * 4, hash_size[1] * 4))
+    small_img = img.convert('L')
+    if orientation != 1:
+        small_img = small_img.transpose(ORIENTATION_TRANSPOSITIONS[orientation])
+    pixels = np.asarray(small_img.resize(hash_size, Image.BOX))
+
+    difference_hash = 0
+    for is_brighter in (pixels[:, :-1] > pixels[:, 1:]).ravel():
+        difference_hash = (difference_hash << 1) | int(is_brighter)
+    return difference_hash
+
+
+def _materialize_photo(src_fp: str, dst_dir: str, filename: str, size: Size, orientation: int, desired_size: Size,
+                       fast_decode: bool, tiles: List[Tuple[Size, str]]) -> Tuple[bool, Optional[Color]]:
+    """
+    Write the given photo upright and in the desired size, linking it if it is both already
+
+    If tiles are given, additionally write the photo resized to every tile size, and determine its average color.
+    This is done on the written photo, such that the tiles and the color are identical to the ones PhotoAnalyzer
+    determines from the original, also after the photo is compressed when it is written.
+
+    This is a module level function, such that it can be sent to worker processes.
+
+    :param tiles: Tile size and directory to write the resized photo to, per tile size
+    :return: Two-tuple with whether the photo is linked instead of written, and the average color if tiles
+    """
 
-        files = list(os.scandir(mosaic_dir))
-        for file in files:
-            img = Photo.open(file.path)
-            img = img.resize(desired_size)
-            img.save(file.path)
+    dst_fp = os.path.join(dst_dir, filename)
+    linked = orientation == 1 and size == desired_size
+    if linked:
+        try:
+            os.link(src_fp, dst_fp)
+        except OSError:
+            # E.g. the raw and photos directory are on different file systems
+            shutil.copyfile(src_fp, dst_fp)
+    else:
+        # Resize in the stored orientation, which is cheaper than rotating the full size photo first
+        stored_size = (desired_size[1], desired_size[0]) if orientation >= 5 else desired_size
+        with Photo.open(src_fp, min_size=stored_size if fast_decode else None) as photo:
+            img = photo.resize(stored_size)
+        if orientation != 1:
+            img = img.transpose(ORIENTATION_TRANSPOSITIONS[orientation])
+        img.save(dst_fp)
+    if not tiles:
+        return linked, None
+
+    # Resize and analyze the written photo as PhotoAnalyzer does for its originals. For a photo that is not
+    # linked, this decodes it again, since writing it changed its pixels.
+    photo = Photo.open(dst_fp)
+    with photo:
+        for tile_size, resizeds_dir in tiles:
+            photo.resize(tile_size).save(os.path.join(resizeds_dir, filename))
+        return linked, photo.avg_color
 
 
 if __name__ == '__main__':
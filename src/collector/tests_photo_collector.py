@@ -1,9 +1,14 @@
+import json
 import os.path
 import shutil
 from unittest import TestCase
 
-from collector.photo_collector import PhotoCollector
+from PIL import Image
+
+from collector.photo_collector import EXIF_ORIENTATION_TAG, PhotoCollector, RawPhoto
 from photo import Photo
+from photo_analyzer import PhotoAnalyzer
+from utils.instrumentation import Instrumentation
 from utils.path import Path
 
 
@@ -30,61 +35,154 @@ class PhotoCollectorTestCase(TestCase):
             if os.path.exists(test_dir):
                 shutil.rmtree(test_dir)
 
-    def test_that_collect_files_gathers_files_from_single_directory(self):
+    def test_that_scan_raw_dir_numbers_photos_from_all_directories(self):
         self.setup_raw_dir_structure()
-        collector = PhotoCollector(self.dirname)
-        collector._clean_photos_dir()
-        collector._collect_files()
-        present_files = sorted(entry.name for entry in os.scandir(self.photos_dir))
+        raw_photos = PhotoCollector(self.dirname)._scan_raw_dir()
         self.assertListEqual(['00000001.jpg', '00000002.jpg', '00000003.jpg',
-                              '00000004.jpg', '00000005.jpg', '00000006.jpg'], present_files)
+                              '00000004.jpg', '00000005.jpg', '00000006.jpg'],
+                             sorted(raw_photo.filename for raw_photo in raw_photos))
+        sizes = sorted(raw_photo.size for raw_photo in raw_photos)
+        self.assertListEqual([(455, 455)] * 5 + [(474, 296)], sizes)
 
-    def test_that_split_by_size_ratio_results_in_correct_folder_structure(self):
-        self.setup_photo_dir_structure()
+    def test_that_scan_raw_dir_skips_unreadable_images(self):
+        self.setup_raw_dir_structure()
+        with open(os.path.join(self.raw_dir, 'broken.jpg'), 'w') as f:
+            f.write('This is not a photo')
+        raw_photos = PhotoCollector(self.dirname)._scan_raw_dir()
+        self.assertEqual(6, len(raw_photos))
+
+    def test_that_scan_raw_dir_applies_exif_orientation(self):
+        os.mkdir(self.raw_dir)
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION_TAG] = 6
+        Image.new('RGB', (60, 40)).save(os.path.join(self.raw_dir, 'rotated.jpg'), exif=exif.tobytes())
+        raw_photo, = PhotoCollector(self.dirname)._scan_raw_dir()
+        self.assertTupleEqual((40, 60), raw_photo.size)
+        self.assertEqual(6, raw_photo.orientation)
+
+    def test_that_index_by_size_ratio_groups_photos(self):
+        self.setup_raw_dir_structure()
         collector = PhotoCollector(self.dirname)
-        most_common_resolution = collector._split_by_size_ratio()
+        collector._clean_photos_dir()
+        size_ratio_index = collector._index_by_size_ratio(collector._scan_raw_dir())
 
         # Five photos are 455x455 (1:1), one photo is 474x296 (1:1.601)
-        self.assertEqual(100, most_common_resolution)
-        dirname = os.path.join(self.photos_dir, '100')
-        nr_files_in_dir = sum(1 for _ in os.scandir(dirname))
-        self.assertEqual(5, nr_files_in_dir)
-        dirname = os.path.join(self.photos_dir, '160')
-        nr_files_in_dir = sum(1 for _ in os.scandir(dirname))
-        self.assertEqual(1, nr_files_in_dir)
-
-    def test_that_select_images_selects_all_correct_images(self):
-        self.setup_photo_dir_structure()
-        collector = PhotoCollector(self.dirname)
-        collector._split_by_size_ratio()
-
-        mosaic_dir = os.path.join(self.photos_dir, 'mosaic')
-        self.assertFalse(os.path.exists(mosaic_dir))
-        collector._select_images(desired_size_ratio=100)
+        self.assertSetEqual({100, 160}, set(size_ratio_index))
+        self.assertEqual(5, len(size_ratio_index[100]))
+        self.assertEqual(1, len(size_ratio_index[160]))
+        with open(os.path.join(self.photos_dir, 'size_ratio.json')) as f:
+            self.assertDictEqual({'100': 5, '160': 1}, json.load(f))
 
-        self.assertTrue(os.path.exists(mosaic_dir))
-        nr_files_in_dir = sum(1 for _ in os.scandir(mosaic_dir))
-        self.assertEqual(5, nr_files_in_dir)
-
-    def test_that_resize_images_resizes_all_images(self):
-        self.setup_photo_dir_structure()
-        collector = PhotoCollector(self.dirname)
-        collector._split_by_size_ratio()
-        collector._select_images(desired_size_ratio=100)
+    def test_that_collect_resizes_selected_photos_only(self):
+        self.setup_raw_dir_structure()
+        raw_files_before = sorted(os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(self.raw_dir)
+                                  for filename in filenames)
+        PhotoCollector(self.dirname).collect(desired_width=100)
 
-        # Crop the first image, such that the original is not square anymore
+        self.assertListEqual(['mosaic', 'size_ratio.json'], sorted(os.listdir(self.photos_dir)))
         mosaic_dir = os.path.join(self.photos_dir, 'mosaic')
-        first_cat = os.path.join(mosaic_dir, '00000001.jpg')
-        img = Photo.open(first_cat)
-        img = img.crop((0, 0, 400, 200))
-        img.save(first_cat)
-
-        collector._resize_images(desired_size_ratio=100, desired_width=100)
-
+        self.assertEqual(5, len(os.listdir(mosaic_dir)))
         for file in os.scandir(mosaic_dir):
             img = Photo.open(file.path)
-            desired_size = (100, 100)
-            self.assertTupleEqual(desired_size, img.size)
+            self.assertTupleEqual((100, 100), img.size)
+        raw_files_after = sorted(os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(self.raw_dir)
+                                 for filename in filenames)
+        self.assertListEqual(raw_files_before, raw_files_after)
+
+    def test_that_collect_links_photos_that_have_the_desired_size(self):
+        self.setup_raw_dir_structure()
+        PhotoCollector(self.dirname).collect(desired_width=455)
+        raw_fp = os.path.join(self.raw_dir, 'cat_odd', 'cat003.JPG')
+        mosaic_fps = [file.path for file in os.scandir(os.path.join(self.photos_dir, 'mosaic'))]
+        self.assertEqual(5, len(mosaic_fps))
+        self.assertTrue(any(os.path.samefile(raw_fp, mosaic_fp) for mosaic_fp in mosaic_fps))
+
+    def test_that_collect_writes_rotated_photos_upright(self):
+        os.mkdir(self.raw_dir)
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION_TAG] = 6
+        img = Image.new('RGB', (60, 40), color=(0, 0, 255))
+        img.paste((255, 0, 0), box=(0, 0, 30, 40))  # Red left half, which is the top half when displayed
+        img.save(os.path.join(self.raw_dir, 'rotated.jpg'), exif=exif.tobytes())
+        PhotoCollector(self.dirname).collect(desired_width=20, fast_decode=True)
+
+        with Image.open(os.path.join(self.photos_dir, 'mosaic', '00000001.jpg')) as collected_img:
+            self.assertTupleEqual((20, 30), collected_img.size)
+            red, _, blue = collected_img.getpixel((10, 5))
+            self.assertGreater(red, blue)
+
+    def test_that_collect_prepares_tile_library_for_analyzer(self):
+        self.setup_raw_dir_structure()
+        instrumentation = Instrumentation(verbose=False)
+        PhotoCollector(self.dirname, instrumentation=instrumentation).collect(desired_width=100,
+                                                                             tile_sizes=[(20, 20), (10, 10)])
+        nr_linked = instrumentation.counters['collector.photos_linked']
+        self.assertEqual(5 + 5 - nr_linked, instrumentation.counters['photos_decoded'])
+
+        originals = sorted(os.listdir(os.path.join(self.photos_dir, 'original_input_photos')))
+        self.assertEqual(5, len(originals))
+        for tile_size in ((20, 20), (10, 10)):
+            resizeds_dir = PhotoAnalyzer.resizeds_dir_of(self.photos_dir, tile_size)
+            self.assertListEqual(originals, sorted(os.listdir(resizeds_dir)))
+            with Image.open(os.path.join(resizeds_dir, originals[0])) as img:
+                self.assertTupleEqual(tile_size, img.size)
+
+        instrumentation = Instrumentation(verbose=False)
+        PhotoAnalyzer(self.photos_dir, nr_photo_pixels=1, tile_size=(20, 20), instrumentation=instrumentation)
+        self.assertNotIn('photos_decoded', instrumentation.counters)
+        self.assertIn('Photo analysis of 5 photos is up-to-date', instrumentation.messages)
+
+        # The colors and tiles are identical to the ones of a library that is analyzed from scratch
+        analyzer = PhotoAnalyzer(self.photos_dir, nr_photo_pixels=1, tile_size=(20, 20),
+                                 instrumentation=Instrumentation(verbose=False))
+        fresh_dir = os.path.join(self.photos_dir, 'fresh')
+        shutil.copytree(analyzer.originals_dir, os.path.join(fresh_dir, 'original_input_photos'))
+        fresh_analyzer = PhotoAnalyzer(fresh_dir, nr_photo_pixels=1, tile_size=(20, 20),
+                                       instrumentation=Instrumentation(verbose=False))
+        self.assertDictEqual(fresh_analyzer._photo_analysis, analyzer._photo_analysis)
+        for filename in originals:
+            self.assertEqual(fresh_analyzer.get_resized_photo(filename), analyzer.get_resized_photo(filename))
+
+    def test_that_collect_leaves_out_identical_and_similar_photos(self):
+        self.setup_raw_dir_structure()
+        src_dir = os.path.join(Path.testdata, 'cats')
+        shutil.copyfile(os.path.join(src_dir, 'cat001.jpg'), os.path.join(self.raw_dir, 'cat001_copy.jpg'))
+        with Image.open(os.path.join(src_dir, 'cat003.jpg')) as img:
+            img.save(os.path.join(self.raw_dir, 'cat003_recompressed.jpg'), quality=50)
+        PhotoCollector(self.dirname).collect(desired_width=100, deduplicate=True)
+
+        self.assertEqual(5, len(os.listdir(os.path.join(self.photos_dir, 'mosaic'))))
+        with open(os.path.join(self.photos_dir, 'duplicates.json')) as f:
+            report = json.load(f)
+        self.assertEqual(8, report['nr_photos'])
+        self.assertEqual(1, report['nr_identical'])
+        self.assertEqual(1, report['nr_similar'])
+        # Which photo of a pair is kept depends on the order of the directory walk
+        duplicates = {(frozenset({os.path.basename(duplicate['fp']), os.path.basename(duplicate['duplicate_of'])}),
+                       duplicate['reason']) for duplicate in report['duplicates']}
+        self.assertSetEqual({(frozenset({'cat001.JPG', 'cat001_copy.jpg'}), 'identical'),
+                             (frozenset({'cat003.JPG', 'cat003_recompressed.jpg'}), 'similar')}, duplicates)
+
+    def test_that_duplicate_report_points_at_kept_photo(self):
+        os.makedirs(self.photos_dir)
+        kept = RawPhoto('kept.jpg', '1.jpg', (10, 10), 1, content_hash='a', perceptual_hash=0b0000)
+        similar = RawPhoto('similar.jpg', '2.jpg', (10, 10), 1, content_hash='b', perceptual_hash=0b0001)
+        identical_to_similar = RawPhoto('copy.jpg', '3.jpg', (10, 10), 1, content_hash='b', perceptual_hash=0b0001)
+        collector = PhotoCollector(self.dirname, instrumentation=Instrumentation(verbose=False))
+
+        self.assertListEqual([kept], collector._remove_duplicates([kept, similar, identical_to_similar], 1))
+        with open(os.path.join(self.photos_dir, 'duplicates.json')) as f:
+            report = json.load(f)
+        self.assertListEqual(['kept.jpg', 'kept.jpg'],
+                             [duplicate['duplicate_of'] for duplicate in report['duplicates']])
+
+    def test_that_collect_keeps_similar_photos_without_max_hash_distance(self):
+        self.setup_raw_dir_structure()
+        with Image.open(os.path.join(Path.testdata, 'cats', 'cat003.jpg')) as img:
+            img.save(os.path.join(self.raw_dir, 'cat003_recompressed.jpg'), quality=50)
+        PhotoCollector(self.dirname).collect(desired_width=100, deduplicate=True, max_hash_distance=None)
+
+        self.assertEqual(6, len(os.listdir(os.path.join(self.photos_dir, 'mosaic'))))
 
     def setup_raw_dir_structure(self):
         """
@@ -112,7 +210,7 @@ class PhotoCollectorTestCase(TestCase):
         cat001 = os.path.join(first_cat, 'cat001.JPG')
         cat003 = os.path.join(cat_odd, 'cat003.JPG')
         cat005 = os.path.join(cat_odd, 'cat005.JPG')
-        src_dir = os.path.join(Path.testdata, 'original_input_photos')
+        src_dir = os.path.join(Path.testdata, 'cats')
         shutil.copyfile(os.path.join(src_dir, 'cat001.jpg'), cat001)
         shutil.copyfile(os.path.join(src_dir, 'cat002.jpg'), cat002)
         shutil.copyfile(os.path.join(src_dir, 'cat003.jpg'), cat003)
@@ -122,9 +220,3 @@ class PhotoCollectorTestCase(TestCase):
 
         with open(os.path.join(self.raw_dir, 'info.txt'), 'w') as f:
             f.write('We now have 5 cat pictures in this directory')
-
-    def setup_photo_dir_structure(self):
-        self.setup_raw_dir_structure()
-        collector = PhotoCollector(self.dirname)
-        collector._clean_photos_dir()
-        collector._collect_files()
@@ -0,0 +1,375 @@
+import json
+import os.path
+import shutil
+import tempfile
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.type_hinting import Color
+
+# Version of the file format of a color store, to increase when it changes incompatibly
+COLOR_STORE_FORMAT_VERSION = 2
+
+
+class ColorStore:
+    """
+    Compact index of the average colors of all photos of a tile library, for libraries with millions of photos
+
+    The index is a struct of arrays instead of a dict of tuples: a uint8 matrix with the color of every photo, an
+    int32 array with the id of every photo, and a filename table that maps ids to filenames. The colors and ids are
+    split in shards of at most SHARD_SIZE photos, each stored in its own .npy file. The filename table is stored as
+    the concatenated UTF-8 filenames, with an array of the offset of every filename in it.
+
+    All files are memory-mapped, such that opening a store takes the same time for any number of photos, and
+    processes that open the same store share its pages through the OS. Independent queries are vectorized per shard.
+    The store also holds the ids and colors of all photos in the order of a balanced k-d tree, that index() searches
+    to select photos one at a time.
+
+    The ids are the positions of the filenames in sorted order. Taking the smallest id among equally close photos
+    therefore gives the same result as taking min((distance, filename)), like ColorIndex does.
+    """
+
+    SHARD_SIZE = 65536
+
+    # Number of query colors to calculate the distance to all photos of a shard for at once
+    QUERY_CHUNK_SIZE = 64
+
+    MANIFEST_FILENAME = 'manifest.json'
+    FILENAMES_FILENAME = 'filenames.bin'
+    FILENAME_OFFSETS_FILENAME = 'filename_offsets.npy'
+    TREE_IDS_FILENAME = 'tree_ids.npy'
+    TREE_COLORS_FILENAME = 'tree_colors.npy'
+
+    def __init__(self, store_dir: str):
+        """
+        :param store_dir: Directory that the store is written in, see write. If it does not contain a store,
+                          the store is empty.
+        """
+
+        self.store_dir = store_dir
+        self.shard_size = self.SHARD_SIZE
+        self.fingerprint: Optional[str] = None
+        self._shards: List[Tuple[np.ndarray, np.ndarray]] = []  # Ids and colors per shard
+        self._filenames = np.empty(0, dtype=np.uint8)
+        self._filename_offsets = np.zeros(1, dtype=np.int64)
+        self._tree_ids = np.empty(0, dtype=np.int32)
+        self._tree_colors = np.empty((0, 3), dtype=np.uint8)
+        manifest_fp = os.path.join(self.store_dir, self.MANIFEST_FILENAME)
+        if os.path.exists(manifest_fp):
+            self._load(manifest_fp)
+
+    def __len__(self) -> int:
+        return len(self._filename_offsets) - 1
+
+    @classmethod
+    def write(cls, store_dir: str, colors: Dict[str, Color], fingerprint: Optional[str] = None,
+              shard_size: int = SHARD_SIZE) -> 'ColorStore':
+        """
+        Write a store with the given colors to store_dir, replacing the store that is in it, and open it
+
+        The store is written next to store_dir and then moved over it, such that a crash never leaves a corrupt
+        store behind. Processes that opened the replaced store can keep reading it.
+
+        :param store_dir: Directory to write the store in
+        :param colors: Average color per filename
+        :param fingerprint: Identifier of the colors, to check whether the store is up-to-date with them when it is
+                            opened again, without comparing all colors
+        :param shard_size: Maximum number of photos per shard
+        """
+
+        parent_dir = os.path.dirname(os.path.abspath(store_dir))
+        os.makedirs(parent_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=f'.{os.path.basename(store_dir)}.')
+
+        filenames = sorted(colors)
+        encoded_filenames = [filename.encode() for filename in filenames]
+        with open(os.path.join(tmp_dir, cls.FILENAMES_FILENAME), 'wb') as f:
+            f.write(b''.join(encoded_filenames))
+        filename_offsets = np.zeros(len(filenames) + 1, dtype=np.int64)
+        np.cumsum([len(encoded) for encoded in encoded_filenames], out=filename_offsets[1:])
+        np.save(os.path.join(tmp_dir, cls.FILENAME_OFFSETS_FILENAME), filename_offsets)
+
+        all_colors = np.array([colors[filename] for filename in filenames], dtype=np.uint8).reshape(-1, 3)
+        nr_shards = 0
+        for start in range(0, len(filenames), shard_size):
+            shard_filenames = filenames[start:start + shard_size]
+            np.save(os.path.join(tmp_dir, cls._ids_filename(nr_shards)),
+                    np.arange(start, start + len(shard_filenames), dtype=np.int32))
+            np.save(os.path.join(tmp_dir, cls._colors_filename(nr_shards)), all_colors[start:start + shard_size])
+            nr_shards += 1
+        tree_ids = cls._tree_order(all_colors)
+        np.save(os.path.join(tmp_dir, cls.TREE_IDS_FILENAME), tree_ids)
+        np.save(os.path.join(tmp_dir, cls.TREE_COLORS_FILENAME), all_colors[tree_ids])
+
+        # The manifest is written last, since a directory without it is not a store
+        manifest = {
+            'version': COLOR_STORE_FORMAT_VERSION,
+            'nr_photos': len(filenames),
+            'shard_size': shard_size,
+            'nr_shards': nr_shards,
+            'fingerprint': fingerprint,
+        }
+        with open(os.path.join(tmp_dir, cls.MANIFEST_FILENAME), 'w') as f:
+            json.dump(manifest, f)
+
+        if os.path.isdir(store_dir):
+            shutil.rmtree(store_dir)
+        os.rename(tmp_dir, store_dir)
+        return cls(store_dir)
+
+    @property
+    def nr_shards(self) -> int:
+        return len(self._shards)
+
+    @property
+    def shards(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Return an iterator over the ids and the colors of every shard, in order of id
+        """
+
+        return iter(self._shards)
+
+    def filename(self, photo_id: int) -> str:
+        """
+        Return the filename of the photo with the given id
+        """
+
+        if not 0 <= photo_id < len(self):
+            raise IndexError(f'No photo with id {photo_id} in the color store')
+        start, end = self._filename_offsets[photo_id], self._filename_offsets[photo_id + 1]
+        return self._filenames[start:end].tobytes().decode()
+
+    def filenames(self, photo_ids: Sequence[int]) -> List[str]:
+        """
+        Return the filename of every photo with the given ids
+        """
+
+        return [self.filename(int(photo_id)) for photo_id in photo_ids]
+
+    def color(self, photo_id: int) -> Color:
+        """
+        Return the average color of the photo with the given id
+        """
+
+        if not 0 <= photo_id < len(self):
+            raise IndexError(f'No photo with id {photo_id} in the color store')
+        ids, colors = self._shards[photo_id // self.shard_size]
+        red, green, blue = colors[photo_id - int(ids[0])]
+        return int(red), int(green), int(blue)
+
+    def nearest(self, colors: Sequence[Color], capacities: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Return the id of the closest photo to each of the given colors, among the photos with capacity left
+
+        Among equally close photos, the one with the smallest id, and thus the first filename, is returned.
+        The photos are not used up, so every color is matched independently of the others.
+
+        >>> import tempfile
+        >>> store = ColorStore.write(tempfile.mkdtemp(), {'a': (0, 0, 0), 'b': (9, 9, 9), 'c': (0, 0, 0)})
+        >>> store.nearest([(1, 1, 1), (8, 8, 8)]).tolist(), store.nearest([(1, 1, 1)], np.array([0, 1, 1])).tolist()
+        ([0, 1], [2])
+
+        :param colors: Colors to find the closest photos of
+        :param capacities: Remaining number of uses per id. By default, all photos can be used.
+        :return: Id per color
+        :raises KeyError: if no photo has capacity left
+        """
+
+        if not len(self) or (capacities is not None and not capacities.any()):
+            raise KeyError('No photos with capacity left in the color store')
+        queries = np.asarray(colors, dtype=np.int32).reshape(-1, 3)
+        best_ids = np.zeros(len(queries), dtype=np.int32)
+        best_distances = np.full(len(queries), np.iinfo(np.int32).max, dtype=np.int32)
+        for ids, shard_colors in self._shards:
+            shard_colors = np.asarray(shard_colors, dtype=np.int32)
+            available = capacities[ids] > 0 if capacities is not None else None
+            if available is not None and not available.any():
+                continue
+            for start in range(0, len(queries), self.QUERY_CHUNK_SIZE):
+                chunk = queries[start:start + self.QUERY_CHUNK_SIZE]
+                # Squared distances of uint8 colors are at most 3 * 255^2, so they fit in int32
+                differences = chunk[:, np.newaxis, :] - shard_colors[np.newaxis, :, :]
+                squared_distances = np.einsum('ijk,ijk->ij', differences, differences)
+                if available is not None:
+                    squared_distances[:, ~available] = np.iinfo(np.int32).max
+                nearest = np.argmin(squared_distances, axis=1)
+                nearest_distances = squared_distances[np.arange(len(chunk)), nearest]
+                # Earlier shards have smaller ids, so they win ties
+                closer = nearest_distances < best_distances[start:start + len(chunk)]
+                best_distances[start:start + len(chunk)][closer] = nearest_distances[closer]
+                best_ids[start:start + len(chunk)][closer] = ids[nearest[closer]]
+        return best_ids
+
+    def index(self, nr_uses: int) -> 'ColorStoreIndex':
+        """
+        Return a nearest neighbour index over the photos of this store, in which every photo can be used nr_uses times
+        """
+
+        return ColorStoreIndex(self._tree_ids, self._tree_colors, nr_uses)
+
+    def _load(self, manifest_fp: str) -> None:
+        """
+        Memory-map the shards and the filename table of the store in store_dir
+        """
+
+        with open(manifest_fp) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != COLOR_STORE_FORMAT_VERSION:
+            # An outdated store is treated as empty, such that it is written again
+            return
+        self.shard_size = manifest['shard_size']
+        self.fingerprint = manifest['fingerprint']
+        self._shards = [
+            (np.load(os.path.join(self.store_dir, self._ids_filename(shard)), mmap_mode='r'),
+             np.load(os.path.join(self.store_dir, self._colors_filename(shard)), mmap_mode='r'))
+            for shard in range(manifest['nr_shards'])
+        ]
+        self._filename_offsets = np.load(os.path.join(self.store_dir, self.FILENAME_OFFSETS_FILENAME), mmap_mode='r')
+        if manifest['nr_photos'] > 0:
+            self._filenames = np.memmap(os.path.join(self.store_dir, self.FILENAMES_FILENAME), dtype=np.uint8,
+                                        mode='r')
+            self._tree_ids = np.load(os.path.join(self.store_dir, self.TREE_IDS_FILENAME), mmap_mode='r')
+            self._tree_colors = np.load(os.path.join(self.store_dir, self.TREE_COLORS_FILENAME), mmap_mode='r')
+
+    @staticmethod
+    def _tree_order(colors: np.ndarray) -> np.ndarray:
+        """
+        Return the ids of the given colors in the order of a balanced k-d tree over them
+
+        The subtree over the positions [start, end) has its root at position (start + end) // 2, its left subtree
+        before and its right subtree after it. Subtrees are split on red, green and blue in turn: no color in the
+        left subtree is larger on that axis than the root, and no color in the right subtree is smaller. The tree
+        is built one depth at a time, by sorting all subtrees of that depth at once.
+        """
+
+        order = np.arange(len(colors), dtype=np.int32)
+        starts, ends = np.zeros(1, dtype=np.int64), np.full(1, len(colors), dtype=np.int64)
+        axis = 0
+        while len(starts):
+            lengths = ends - starts
+            subtrees = np.repeat(np.arange(len(starts)), lengths)
+            positions = np.arange(int(lengths.sum())) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            ids = order[positions]
+            # Sort by subtree first, such that every subtree keeps its positions, and by id last, to be deterministic
+            order[positions] = ids[np.lexsort((ids, colors[ids, axis], subtrees))]
+            roots = (starts + ends) // 2
+            starts, ends = np.concatenate((starts, roots + 1)), np.concatenate((roots, ends))
+            non_empty = starts < ends
+            starts, ends = starts[non_empty], ends[non_empty]
+            axis = (axis + 1) % 3
+        return order
+
+    @staticmethod
+    def _ids_filename(shard: int) -> str:
+        return f'ids_{shard:04d}.npy'
+
+    @staticmethod
+    def _colors_filename(shard: int) -> str:
+        return f'colors_{shard:04d}.npy'
+
+
+class ColorStoreIndex:
+    """
+    Nearest neighbour index over the photos of a ColorStore, where every photo can be used a limited number of times
+
+    Like ColorIndex, but the k-d tree is the one stored with the color store, in which the position of a node
+    determines its subtree. Only the uses per node and the number of used up photos per subtree are held in memory,
+    such that creating an index takes no time to build a tree, and little memory for millions of photos.
+
+    Ties are broken by id, such that the result is identical to that of ColorIndex over the filenames.
+    """
+
+    def __init__(self, tree_ids: np.ndarray, tree_colors: np.ndarray, nr_uses: int):
+        """
+        :param tree_ids: Id of the photo at every node, see ColorStore._tree_order
+        :param tree_colors: Color of the photo at every node
+        :param nr_uses: Number of times every photo can be used
+        """
+
+        self.nr_uses = nr_uses
+        self._nr_nodes = len(tree_ids)
+        self._uses = np.zeros(self._nr_nodes, dtype=np.int32)  # Number of times the photo at every node is used
+        self._nr_used_up = np.zeros(self._nr_nodes, dtype=np.int32)  # Number of used up photos in every subtree
+        # Elements of memoryviews are read as Python ints, which is much faster than reading numpy scalars
+        self._ids = memoryview(tree_ids).cast('B').cast('i')
+        self._colors = memoryview(tree_colors).cast('B')
+        self._uses_view = memoryview(self._uses)
+        self._nr_used_up_view = memoryview(self._nr_used_up)
+
+    def __len__(self) -> int:
+        """
+        Return the number of photos that have uses left
+        """
+
+        if not self._nr_nodes:
+            return 0
+        return self._nr_nodes - self._nr_used_up_view[self._nr_nodes // 2]
+
+    def pop_nearest(self, color: Color) -> int:
+        """
+        Return the id of the photo with uses left of which the color is closest to the given color, and use it once
+
+        :raises KeyError: if no photo has uses left
+        """
+
+        if not len(self):
+            raise KeyError('No photos with uses left in the color store index')
+        best: List[Tuple[int, int, int]] = [(3 * 256 ** 2, 0, -1)]  # Squared distance, id and node of the best match
+        self._search(0, self._nr_nodes, 0, tuple(color), best)
+        _, photo_id, node = best[0]
+        self._use(node)
+        return photo_id
+
+    def _use(self, node: int) -> None:
+        """
+        Use the photo at the given node once, and count it in all subtrees that contain it when it is used up
+        """
+
+        self._uses_view[node] += 1
+        if self._uses_view[node] < self.nr_uses:
+            return
+        start, end = 0, self._nr_nodes
+        while True:
+            root = (start + end) // 2
+            self._nr_used_up_view[root] += 1
+            if root == node:
+                return
+            if node < root:
+                end = root
+            else:
+                start = root + 1
+
+    def _search(self, start: int, end: int, axis: int, color: Color, best: List[Tuple[int, int, int]]) -> None:
+        """
+        Update best[0] with the closest photo in the subtree over the nodes [start, end), if it is closer
+        """
+
+        if start >= end:
+            return
+        root = (start + end) // 2
+        if self._nr_used_up_view[root] == end - start:
+            return
+
+        colors = self._colors
+        root_color = colors[3 * root], colors[3 * root + 1], colors[3 * root + 2]
+        if self._uses_view[root] < self.nr_uses:
+            squared_distance = (
+                    (color[0] - root_color[0]) ** 2
+                    + (color[1] - root_color[1]) ** 2
+                    + (color[2] - root_color[2]) ** 2
+            )
+            if squared_distance <= best[0][0] and (squared_distance, self._ids[root]) < best[0][:2]:
+                best[0] = (squared_distance, self._ids[root], root)
+
+        # Like ColorIndex, search the side of the splitting plane that contains the color first
+        difference = color[axis] - root_color[axis]
+        next_axis = (axis + 1) % 3
+        if difference < 0:
+            self._search(start, root, next_axis, color, best)
+            if difference ** 2 <= best[0][0]:
+                self._search(root + 1, end, next_axis, color, best)
+        else:
+            self._search(root + 1, end, next_axis, color, best)
+            if difference ** 2 <= best[0][0]:
+                self._search(start, root, next_axis, color, best)
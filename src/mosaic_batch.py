@@ -0,0 +1,166 @@
+import csv
+import json
+import os.path
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from mosaic_creator import MosaicCreator
+from mosaic_service import MosaicService, RenderJob
+from photo_analyzer import PhotoAnalyzer
+from utils.instrumentation import Instrumentation
+
+# Fields of a RenderJob that are integers, which have to be converted when read from a CSV manifest
+_INT_FIELDS = ('nr_pixels_in_x', 'nr_pixels_in_y', 'max_output_size', 'cheat_parameter')
+# Fields of a RenderJob that are paths, which are relative to the directory of the manifest
+_PATH_FIELDS = ('target_fp', 'src_dir', 'output_fp')
+
+_worker_service: Optional[MosaicService] = None  # The resident service of a worker process, see _init_worker
+
+
+def read_manifest(manifest_fp: str) -> List[RenderJob]:
+    """
+    Read the jobs to render from a manifest file
+
+    The manifest is either a JSON lines file (.jsonl), with one object per job, or a CSV file (.csv), with a
+    header and one row per job. The keys of the objects and the columns of the CSV file are the fields of
+    RenderJob. Every job must have an output_fp. Relative paths are relative to the directory of the manifest.
+
+    :param manifest_fp: Full path to the manifest file
+    """
+
+    _, ext = os.path.splitext(manifest_fp)
+    with open(manifest_fp, newline='') as f:
+        if ext.lower() == '.jsonl':
+            rows = [json.loads(line) for line in f if line.strip()]
+        elif ext.lower() == '.csv':
+            rows = list(csv.DictReader(f))
+        else:
+            raise ValueError(f'Cannot read manifest {manifest_fp}, the extension must be .jsonl or .csv')
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_fp))
+    jobs = []
+    for line_nr, row in enumerate(rows, start=1):
+        # Empty CSV cells fall back to the default of the field
+        fields: Dict[str, Any] = {key: value for key, value in row.items() if value != ''}
+        for key in _INT_FIELDS:
+            if key in fields:
+                fields[key] = int(fields[key])
+        for key in _PATH_FIELDS:
+            if key in fields:
+                fields[key] = os.path.join(manifest_dir, fields[key])
+        if 'output_fp' not in fields:
+            raise ValueError(f'Job {line_nr} in manifest {manifest_fp} has no output_fp')
+        jobs.append(RenderJob(**fields))
+    return jobs
+
+
+def render_batch(jobs: List[RenderJob], summary_fp: Optional[str] = None, nr_processes: int = 1,
+                 fast_decode: bool = False, use_atlas: bool = False, use_pyramid: bool = False,
+                 max_tile_cache_bytes: Optional[int] = PhotoAnalyzer.DEFAULT_MAX_TILE_CACHE_BYTES,
+                 use_color_store: bool = False, instrumentation: Optional[Instrumentation] = None) -> Dict[str, Any]:
+    """
+    Render all given jobs, sharing the tile libraries over the jobs, and return a summary of the timings
+
+    All tile libraries are loaded once in the current process first, such that all resized photos, analyses,
+    color stores and tile atlases are up-to-date before the jobs start. The jobs are then divided over
+    nr_processes worker processes, that each keep a MosaicService with the libraries resident. Since the
+    libraries are up-to-date, loading them in a worker only reads them. A job that fails, also while loading its
+    library, is reported in the summary, and does not stop the other jobs.
+
+    :param jobs: Jobs to render, each with an output_fp
+    :param summary_fp: If given, write the summary to this JSON file
+    :param nr_processes: Number of worker processes to render the jobs with
+    :param fast_decode: Decode the tile photos at reduced resolution, see PhotoAnalyzer
+    :param use_atlas: Keep the tiles in a memory-mapped tile atlas, see TileAtlas
+    :param use_pyramid: Derive the tiles of new tile sizes from a tile pyramid, see TilePyramid
+    :param max_tile_cache_bytes: Maximum number of bytes of decoded tiles to keep in memory per library and process
+    :param use_color_store: Select the photos with a memory-mapped color store, see ColorStore
+    :param instrumentation: Instrumentation to record the timers, counters and progress messages in. Worker
+                            processes record in their own instrumentation, of which only the timings per job
+                            end up in the summary.
+    :return: The summary, with the timings per job and in total
+    """
+
+    instrumentation = instrumentation or Instrumentation()
+    start = time.perf_counter()
+    with MosaicService(fast_decode=fast_decode, use_atlas=use_atlas, use_pyramid=use_pyramid,
+                       max_tile_cache_bytes=max_tile_cache_bytes, use_color_store=use_color_store,
+                       instrumentation=instrumentation) as service:
+        load_errors: Dict[int, str] = {}  # Error per index of a job of which the library could not be loaded
+        for index, job in enumerate(jobs):
+            try:
+                creator = MosaicCreator(job.target_fp, nr_pixels_in_x=job.nr_pixels_in_x,
+                                        nr_pixels_in_y=job.nr_pixels_in_y, max_output_size=job.max_output_size)
+                service.get_library(job.src_dir, creator.tile_size)
+            except Exception as e:
+                instrumentation.log(f'Failed to load the tile library for mosaic of {job.target_fp}: {e!r}')
+                load_errors[index] = repr(e)
+        library_seconds = time.perf_counter() - start
+
+        jobs_to_render = [job for index, job in enumerate(jobs) if index not in load_errors]
+        if nr_processes <= 1:
+            rendered_summaries = [_render_job(service, job) for job in jobs_to_render]
+        else:
+            with ProcessPoolExecutor(max_workers=nr_processes, initializer=_init_worker,
+                                     initargs=(fast_decode, use_atlas, use_pyramid, max_tile_cache_bytes,
+                                               use_color_store)) as executor:
+                rendered_summaries = list(executor.map(_render_in_worker, jobs_to_render))
+        rendered_summaries_iter = iter(rendered_summaries)
+        job_summaries = [_job_summary(job, error=load_errors[index]) if index in load_errors
+                         else next(rendered_summaries_iter) for index, job in enumerate(jobs)]
+
+    nr_failed_jobs = sum(1 for job_summary in job_summaries if job_summary['error'])
+    summary = {
+        'nr_jobs': len(jobs),
+        'nr_failed_jobs': nr_failed_jobs,
+        'nr_processes': nr_processes,
+        'library_seconds': library_seconds,
+        'total_seconds': time.perf_counter() - start,
+        'jobs': job_summaries,
+    }
+    instrumentation.log(f'Rendered {len(jobs) - nr_failed_jobs} of {len(jobs)} mosaics in '
+                        f'{summary["total_seconds"]:.2f}s, of which {library_seconds:.2f}s loading the tile libraries')
+    if summary_fp:
+        with open(summary_fp, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def _render_job(service: MosaicService, job: RenderJob) -> Dict[str, Any]:
+    """
+    Render a single job with the given service, and return its summary
+    """
+
+    job_summary = _job_summary(job)
+    try:
+        result = service.render(job)
+    except Exception as e:
+        service.instrumentation.log(f'Failed to render mosaic of {job.target_fp}: {e!r}')
+        job_summary['error'] = repr(e)
+    else:
+        job_summary['library_seconds'] = result.library_seconds
+        job_summary['total_seconds'] = result.total_seconds
+    return job_summary
+
+
+def _job_summary(job: RenderJob, error: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Return the summary of a job that is not rendered (yet)
+    """
+
+    return {'target_fp': job.target_fp, 'output_fp': job.output_fp, 'library_seconds': None,
+            'total_seconds': None, 'error': error}
+
+
+def _init_worker(fast_decode: bool, use_atlas: bool, use_pyramid: bool, max_tile_cache_bytes: Optional[int],
+                 use_color_store: bool) -> None:
+    global _worker_service
+    _worker_service = MosaicService(fast_decode=fast_decode, use_atlas=use_atlas, nr_concurrent_jobs=1,
+                                    use_pyramid=use_pyramid, max_tile_cache_bytes=max_tile_cache_bytes,
+                                    use_color_store=use_color_store)
+
+
+def _render_in_worker(job: RenderJob) -> Dict[str, Any]:
+    return _render_job(_worker_service, job)
+
@@ -1,13 +1,22 @@
 import os.path
-from typing import List, Tuple
+import random
+import tempfile
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 from PIL import Image
 
+from mosaic_plan import AssignmentMethod, MosaicPlan
 from photo import Photo
 from photo_analyzer import PhotoAnalyzer
+from tile_atlas import TileAtlas
 from utils.type_hinting import Box, Color, Size, size_as_string
+from utils.instrumentation import Instrumentation
 from utils.list_utils import permutation_multiple_lists
+from utils.parallel_utils import imap_bounded, imap_prefetched
 from utils.path import Path
+from utils.strip_writer import open_strip_writer
 
 
 class MosaicCreator:
@@ -20,72 +29,383 @@ class MosaicCreator:
 
     original_photo: Photo  # The photo to create a mosaic of
     original_size: Size  # The size of the original photo
-    pixels: List[Color]  # The pixel data of the original photo
     output_size: Size  # The size of the output mosaic
 
     def __init__(self, filepath: str,
                  nr_pixels_in_x: int, nr_pixels_in_y: int,
                  max_output_size: int = DEFAULT_MAX_OUTPUT_SIZE,
-                 cheat_parameter: int = DEFAULT_CHEAT_PARAMETER):
+                 cheat_parameter: int = DEFAULT_CHEAT_PARAMETER,
+                 nr_prefetch_threads: int = PhotoAnalyzer.DEFAULT_NR_PREFETCH_THREADS,
+                 instrumentation: Optional[Instrumentation] = None):
         """
         :param filepath: Path to the file with the photo to recreate
         :param max_output_size: Maximum width or height of the output image
         :param cheat_parameter: Value between 0 (no cheat) and 255 (full cheat)
                                 to additionally color the photos in the original pixel's color
+        :param nr_prefetch_threads: Number of threads to read and decode the upcoming tile photos with while
+                                    rendering, see PhotoAnalyzer.prefetch_resized_photos. 0 reads them one by one.
+        :param instrumentation: Instrumentation to record timers, counters and progress messages in,
+                                which is shared with the PhotoAnalyzer that is created for the tile photos
         """
 
         assert 0 <= cheat_parameter <= 255
 
+        self.target_fp = filepath
         self.original_photo = Photo.open(filepath)
         self.original_size = self.original_photo.size
-        self.pixels = list(self.original_photo.getdata())
         self.max_output_size = max_output_size
         self.cheat_parameter = cheat_parameter
+        self.nr_prefetch_threads = nr_prefetch_threads
         self.nr_pixels_in_x = nr_pixels_in_x
         self.nr_pixels_in_y = nr_pixels_in_y
         self.output_size = self._determine_output_size()
+        self.instrumentation = instrumentation or Instrumentation()
 
     def pixelate(self, nr_pixels_in_x: int, nr_pixels_in_y: int) -> Photo:
         """
         Pixelate the given photo by chopping it up in rectangles, and replace every square by its average color
+
+        The original photo is resized to one pixel per rectangle, which takes care of averaging the colors.
+        The output is then drawn per row of rectangles, instead of per rectangle.
         """
 
-        # TODO: Instead of calculating the average color of a box, resize the source image
-        #       to the amount of pixels you need, then this resizing takes care of calculating
-        #       the average color. The result is not identical, but you can't say with the
-        #       human eye which one is better. We now do resize the original photo, but we
-        #       didn't remove the calculation yet and just take the one pixel value.
-        self.original_size = (nr_pixels_in_x, nr_pixels_in_y)
-        self.original_photo = self.original_photo.resize(self.original_size)
-
-        result = Photo.new(mode='RGB', size=self.output_size)
-        for original_box, output_box in self._get_boxes(nr_pixels_in_x, nr_pixels_in_y):
-            print(original_box)
-            sub_img = Photo(self.original_photo.crop(original_box))
-            output_img_size = (output_box[2] - output_box[0], output_box[3] - output_box[1])
-            colored_box = Image.new(mode='RGB', size=output_img_size, color=sub_img.avg_color)
-            result.paste(colored_box, box=output_box)
+        with self.instrumentation.timer('creator.pixelate'):
+            result = Photo.new(mode='RGB', size=self.output_size)
+            for upper, row_img in self._pixelate_rows(nr_pixels_in_x, nr_pixels_in_y):
+                result.paste(row_img, box=(0, upper))
         return result
 
-    def photo_pixelate(self, src_dir: str) -> Photo:
+    def pixelate_to_file(self, nr_pixels_in_x: int, nr_pixels_in_y: int, output_fp: str) -> None:
+        """
+        Like pixelate, but write the result to file per row of rectangles, such that it is never completely in memory
+
+        :param output_fp: Full path of the uncompressed output file, with extension .ppm, .tif or .tiff
+        """
+
+        with self.instrumentation.timer('creator.pixelate'), \
+                open_strip_writer(output_fp, self.output_size) as writer:
+            for _, row_img in self._pixelate_rows(nr_pixels_in_x, nr_pixels_in_y):
+                writer.write_strip(row_img)
+
+    def _pixelate_rows(self, nr_pixels_in_x: int, nr_pixels_in_y: int) -> Iterator[Tuple[int, Image.Image]]:
+        """
+        Yield the pixelated output per row of rectangles, from top to bottom
+
+        The original is resized to one pixel per rectangle, and every pixel is repeated over the width of its
+        rectangle in the output. Every row of that is then stretched to the height of its rectangles. Note that
+        the rectangles can differ one pixel in size, see _determine_box_borders.
+
+        :return: Iterator over (upper row in the output, image of the row of rectangles)
+        """
+
+        resized_img = self.original_photo.resize((nr_pixels_in_x, nr_pixels_in_y))
+        if resized_img.mode != 'RGB':
+            resized_img = resized_img.convert('RGB')
+        width = self.output_size[0]
+        x_borders = self._determine_box_borders(width, nr_pixels_in_x)
+        column_indices = np.repeat(np.arange(nr_pixels_in_x), [right - left for left, right in x_borders])
+        rows = np.asarray(resized_img)[:, column_indices]  # Shape (nr_pixels_in_y, width, 3)
+        for index, (upper, lower) in enumerate(self._determine_box_borders(self.output_size[1], nr_pixels_in_y)):
+            row_img = Image.frombytes('RGB', (width, 1), rows[index].tobytes())
+            yield upper, row_img.resize((width, lower - upper), Image.NEAREST)
+
+    def photo_pixelate(self, src_dir: str, fast_decode: bool = False,
+                       assignment: AssignmentMethod = 'greedy', use_atlas: bool = False,
+                       nr_workers: int = 1, analyzer: Optional[PhotoAnalyzer] = None,
+                       nr_render_workers: int = 1) -> Photo:
         """
         Pixelate the given photo by chopping it up in rectangles, and replace every square by its most matching photo
+
+        :param src_dir: Directory with the photos to use as tiles
+        :param fast_decode: Decode the tile photos at reduced resolution, see PhotoAnalyzer
+        :param assignment: Method to assign photos to tiles, see AssignmentMethod
+        :param use_atlas: Read the tiles from a memory-mapped tile atlas instead of from JPEG files, see TileAtlas
+        :param nr_workers: Number of processes to prepare the tile photos with
+        :param analyzer: Analyzer of the tile photos to use, instead of creating one for src_dir. Its tile size
+                         must be tile_size. Then fast_decode, use_atlas and nr_workers are not used.
+        :param nr_render_workers: Number of processes to paste and blend the tiles with, see _render_in_bands
+        """
+
+        analyzer = self._get_analyzer(src_dir, fast_decode, use_atlas, nr_workers, analyzer)
+        tiles = self._plan_tiles(self._plan(analyzer, assignment))
+        return self._render(analyzer, tiles, nr_render_workers)
+
+    def photo_pixelate_to_file(self, src_dir: str, output_fp: str, jpeg_fp: Optional[str] = None,
+                               fast_decode: bool = False, assignment: AssignmentMethod = 'greedy',
+                               use_atlas: bool = False, nr_workers: int = 1,
+                               analyzer: Optional[PhotoAnalyzer] = None) -> None:
+        """
+        Like photo_pixelate, but write the mosaic to file one row of tiles at a time
+
+        Only a single row of tiles is in memory at any time, such that the size of the mosaic is only limited by
+        disk space. Rendering the same mosaic as photo_pixelate requires the same random seed.
+
+        :param output_fp: Full path of the uncompressed output file, with extension .ppm, .tif or .tiff
+        :param jpeg_fp: If given, additionally convert the output file to a JPEG file. Note that this requires
+                        the complete mosaic in memory.
+
+        For the other parameters, see photo_pixelate
+        """
+
+        analyzer = self._get_analyzer(src_dir, fast_decode, use_atlas, nr_workers, analyzer)
+        tiles = self._plan_tiles(self._plan(analyzer, assignment))
+        self._render_to_file(analyzer, tiles, output_fp, jpeg_fp)
+
+    def plan(self, src_dir: str, assignment: AssignmentMethod = 'greedy', seed: Optional[int] = None,
+             fast_decode: bool = False, use_atlas: bool = False, nr_workers: int = 1,
+             analyzer: Optional[PhotoAnalyzer] = None) -> MosaicPlan:
+        """
+        Determine the best matching photo for every tile of the mosaic, without rendering it
+
+        The plan only depends on the target, the grid and the tile photos. Render it with render_plan, as often
+        as needed, e.g. with other creators of the same target and grid with another cheat parameter or
+        maximum output size. Matching is then done only once.
+
+        :param seed: Random seed to match the tiles with, which is stored in the plan. By default, a random seed.
+                     Note that this seeds the random module.
+
+        For the other parameters, see photo_pixelate
+        """
+
+        analyzer = self._get_analyzer(src_dir, fast_decode, use_atlas, nr_workers, analyzer)
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        random.seed(seed)
+        return self._plan(analyzer, assignment, seed)
+
+    def render_plan(self, plan: MosaicPlan, fast_decode: bool = False, use_atlas: bool = False, nr_workers: int = 1,
+                    analyzer: Optional[PhotoAnalyzer] = None, nr_render_workers: int = 1) -> Photo:
+        """
+        Render the mosaic of the given plan, which must have the same grid as this creator
+
+        For the parameters, see photo_pixelate. The tile photos are the ones in the src_dir of the plan.
+        """
+
+        analyzer = self._get_analyzer(plan.src_dir, fast_decode, use_atlas, nr_workers, analyzer)
+        return self._render(analyzer, self._plan_tiles(plan), nr_render_workers)
+
+    def render_plan_to_file(self, plan: MosaicPlan, output_fp: str, jpeg_fp: Optional[str] = None,
+                            fast_decode: bool = False, use_atlas: bool = False, nr_workers: int = 1,
+                            analyzer: Optional[PhotoAnalyzer] = None) -> None:
+        """
+        Like render_plan, but write the mosaic to file one row of tiles at a time, see photo_pixelate_to_file
+        """
+
+        analyzer = self._get_analyzer(plan.src_dir, fast_decode, use_atlas, nr_workers, analyzer)
+        self._render_to_file(analyzer, self._plan_tiles(plan), output_fp, jpeg_fp)
+
+    @property
+    def tile_size(self) -> Size:
+        """
+        Return the size of a single tile photo in the output mosaic
+        """
+
+        return int(self.output_size[0] / self.nr_pixels_in_x), int(self.output_size[1] / self.nr_pixels_in_y)
+
+    def _get_analyzer(self, src_dir: str, fast_decode: bool, use_atlas: bool, nr_workers: int,
+                      analyzer: Optional[PhotoAnalyzer] = None) -> PhotoAnalyzer:
+        """
+        Return the given analyzer, or create one for the tile photos in src_dir if it is None
+        """
+
+        if analyzer is None:
+            analyzer = PhotoAnalyzer(src_dir, nr_photo_pixels=self.nr_pixels_in_x * self.nr_pixels_in_y,
+                                     tile_size=self.tile_size, fast_decode=fast_decode, use_atlas=use_atlas,
+                                     nr_workers=nr_workers, instrumentation=self.instrumentation)
+        return analyzer
+
+    def _plan(self, analyzer: PhotoAnalyzer, assignment: AssignmentMethod, seed: Optional[int] = None) -> MosaicPlan:
+        """
+        Determine the best matching photo for every tile of the mosaic
+
+        The tiles are matched in random order, using the current state of the random module.
+
+        :param seed: Seed the random module was seeded with, if known, to store in the plan
         """
 
-        result = Photo.new(mode='RGB', size=self.output_size)
-        subimg_size = (int(self.output_size[0] / self.nr_pixels_in_x), int(self.output_size[1] / self.nr_pixels_in_y))
-        analyzer = PhotoAnalyzer(src_dir, nr_photo_pixels=self.nr_pixels_in_x * self.nr_pixels_in_y,
-                                 tile_size=subimg_size)
-        for original_box, output_box in self._get_boxes(self.nr_pixels_in_x, self.nr_pixels_in_y):
-            sub_img = Photo(self.original_photo.crop(original_box))
-            best_photo = analyzer.select_best_photo(sub_img.avg_color)
-            best_photo = best_photo.convert('RGBA')
-            colored_box = Image.new(mode='RGB', size=best_photo._size, color=sub_img.avg_color)
-            mask = Image.new(mode='RGBA', size=best_photo._size, color=(0, 0, 0, self.cheat_parameter))
-            best_photo.paste(colored_box, mask=mask)
-            result.paste(best_photo, box=output_box)
+        original_boxes = self._determine_boxes(*self.original_size, self.nr_pixels_in_x, self.nr_pixels_in_y)
+        with self.instrumentation.timer('creator.box_colors'):
+            colors = self._determine_box_colors(original_boxes)
+        # Permute the indices in the same way as the boxes used to be permuted, to keep the results of a seed
+        order = [index for index, in permutation_multiple_lists(list(range(len(original_boxes))))]
+        with self.instrumentation.timer('creator.match'):
+            ordered_colors = [colors[index] for index in order]
+            if assignment == 'optimal':
+                ordered_filenames = analyzer.select_best_filenames(ordered_colors)
+            else:
+                ordered_filenames = [analyzer.select_best_filename(color) for color in ordered_colors]
+        filenames = [''] * len(order)
+        for index, filename in zip(order, ordered_filenames):
+            filenames[index] = filename
+        return MosaicPlan(os.path.abspath(self.target_fp), os.path.abspath(analyzer.src_dir), self.nr_pixels_in_x,
+                          self.nr_pixels_in_y, assignment, seed, colors, filenames)
+
+    def _plan_tiles(self, plan: MosaicPlan) -> List[Tuple[Box, Color, str]]:
+        """
+        Return a list with per tile the box in the output, the color of the original and the filename of the photo
+        """
+
+        if (plan.nr_pixels_in_x, plan.nr_pixels_in_y) != (self.nr_pixels_in_x, self.nr_pixels_in_y):
+            raise ValueError(f'Cannot render a plan of {plan.nr_pixels_in_x}x{plan.nr_pixels_in_y} tiles with a '
+                             f'creator of {self.nr_pixels_in_x}x{self.nr_pixels_in_y} tiles')
+        output_boxes = self._determine_boxes(*self.output_size, self.nr_pixels_in_x, self.nr_pixels_in_y)
+        return list(zip(output_boxes, plan.colors, plan.filenames))
+
+    def _render(self, analyzer: PhotoAnalyzer, tiles: List[Tuple[Box, Color, str]],
+                nr_render_workers: int = 1) -> Photo:
+        """
+        Paste and blend the given tiles in memory
+
+        :param analyzer: Analyzer that holds the resized photos of the tiles
+        :param tiles: List of (box in the output, color of the original, filename) per tile, see _plan_tiles
+        :param nr_render_workers: Number of processes to paste and blend the tiles with, see _render_in_bands
+        """
+
+        if nr_render_workers > 1:
+            with self.instrumentation.timer('creator.render_bands'):
+                return self._render_in_bands(analyzer, tiles, nr_render_workers)
+
+        with self.instrumentation.timer('creator.paste'):
+            result = Photo.new(mode='RGB', size=self.output_size)
+            boxes_per_photo = _boxes_per_photo(tiles)
+            photos = analyzer.prefetch_resized_photos(boxes_per_photo, nr_threads=self.nr_prefetch_threads)
+            for output_boxes, photo in zip(boxes_per_photo.values(), photos):
+                for output_box in output_boxes:
+                    result.paste(photo.img, box=output_box)
+        with self.instrumentation.timer('creator.blend'):
+            self._blend_cheat_colors(result.img, tiles)
+        return result
+
+    def _render_to_file(self, analyzer: PhotoAnalyzer, tiles: List[Tuple[Box, Color, str]], output_fp: str,
+                        jpeg_fp: Optional[str] = None) -> None:
+        """
+        Paste and blend the given tiles one row at a time, and write every row to output_fp
+
+        For the parameters, see _render and photo_pixelate_to_file
+        """
+
+        tiles_per_row: Dict[int, List[Tuple[Box, Color, str]]] = defaultdict(list)
+        for tile in tiles:
+            output_box = tile[0]
+            tiles_per_row[output_box[1]].append(tile)
+
+        uppers = sorted(tiles_per_row)
+        boxes_per_photo_per_row = [_boxes_per_photo(tiles_per_row[upper]) for upper in uppers]
+        # Read ahead over the rows, such that the photos of the next row are decoded while this row is written
+        photos = analyzer.prefetch_resized_photos(
+            (filename for boxes_per_photo in boxes_per_photo_per_row for filename in boxes_per_photo),
+            nr_threads=self.nr_prefetch_threads
+        )
+        with open_strip_writer(output_fp, self.output_size) as writer:
+            for upper, boxes_per_photo in zip(uppers, boxes_per_photo_per_row):
+                row_tiles = tiles_per_row[upper]
+                lower = row_tiles[0][0][3]
+                with self.instrumentation.timer('creator.paste'):
+                    strip = Image.new(mode='RGB', size=(self.output_size[0], lower - upper))
+                    for output_boxes, photo in zip(boxes_per_photo.values(), photos):
+                        for output_box in output_boxes:
+                            strip.paste(photo.img, box=(output_box[0], 0))
+                with self.instrumentation.timer('creator.blend'):
+                    self._blend_cheat_colors(strip, row_tiles, upper=upper)
+                with self.instrumentation.timer('creator.write'):
+                    writer.write_strip(strip)
+
+        if jpeg_fp:
+            with self.instrumentation.timer('creator.encode'), Image.open(output_fp) as img:
+                img.save(jpeg_fp)
+
+    def _render_in_bands(self, analyzer: PhotoAnalyzer, tiles: List[Tuple[Box, Color, str]],
+                         nr_render_workers: int) -> Photo:
+        """
+        Paste and blend the given tiles on nr_render_workers processes, each rendering a horizontal band of rows
+
+        The bands are written to a single memory-mapped canvas, that all processes share through the OS like a
+        TileAtlas, such that no band is sent back to this process. When all bands are done, the canvas is copied
+        once into the resulting image: Pillow stores RGB images with four bytes per pixel, so it can not use the
+        canvas as its buffer. The result is identical to rendering all tiles in this process.
+
+        :param analyzer: Analyzer that holds the resized photos of the tiles
+        :param tiles: List of (box in the output, color of the original, filename) per tile, see _plan_tiles
+        :param nr_render_workers: Number of processes, which is also the number of bands
+        """
+
+        tiles_per_row: Dict[int, List[Tuple[Box, Color, str]]] = defaultdict(list)
+        for tile in tiles:
+            tiles_per_row[tile[0][1]].append(tile)
+        uppers = sorted(tiles_per_row)
+        bands = [band_uppers for band_uppers in np.array_split(uppers, nr_render_workers) if len(band_uppers) > 0]
+
+        width, height = self.output_size
+        canvas_fd, canvas_fp = tempfile.mkstemp(suffix='.raw', dir=Path.tmp)
+        os.close(canvas_fd)
+        try:
+            canvas = np.memmap(canvas_fp, dtype=np.uint8, mode='w+', shape=(height, width, 3))
+            args_list = (
+                (
+                    canvas_fp,
+                    self.output_size,
+                    [tile for upper in band_uppers for tile in tiles_per_row[upper]],
+                    self.cheat_parameter,
+                    analyzer.resizeds_dir,
+                    analyzer.tile_size,
+                    analyzer.atlas is not None,
+                    self.nr_prefetch_threads,
+                )
+                for band_uppers in bands
+            )
+            for _ in imap_bounded(_render_band, args_list, nr_workers=nr_render_workers):
+                pass
+            result = Photo(Image.frombytes('RGB', self.output_size, canvas))
+            del canvas
+        finally:
+            os.remove(canvas_fp)
         return result
 
+    def _blend_cheat_colors(self, canvas: Image.Image, tiles: List[Tuple[Box, Color, str]], upper: int = 0) -> None:
+        """
+        Blend every tile on the canvas in place with the color of the original, according to the cheat parameter
+
+        :param canvas: RGB image with all the given tiles pasted on it
+        :param tiles: List of (box in the output, color of the original, filename) per tile on the canvas
+        :param upper: Row of the output where the canvas starts, if the canvas is only a horizontal strip of it
+        """
+
+        _blend_cheat_colors(canvas, tiles, self.cheat_parameter, upper)
+
+    def _determine_box_colors(self, original_boxes: List[Box]) -> List[Color]:
+        """
+        Return the average color of the original photo in each of the given boxes
+
+        The pixels are summed per horizontal band of boxes, with one vectorized sum over the rows of the band and
+        one over the boxes in it, instead of cropping every box. Apart from the decoded original, only a single
+        band and the sums per box are held in memory.
+
+        :param original_boxes: Boxes as returned by _determine_boxes for the original photo, in any order
+        """
+
+        photo = self.original_photo
+        if photo.mode != 'RGB':
+            photo = Photo(photo.convert('RGB'))
+        width = self.original_size[0]
+        x_borders = self._determine_box_borders(width, self.nr_pixels_in_x)
+        y_borders = self._determine_box_borders(self.original_size[1], self.nr_pixels_in_y)
+        x_starts = [left for left, _ in x_borders]
+        y_starts = [upper for upper, _ in y_borders]
+        box_sums = np.empty((self.nr_pixels_in_y, self.nr_pixels_in_x, 3), dtype=np.uint64)
+        for index, (upper, lower) in enumerate(y_borders):
+            band = np.asarray(photo.crop((0, upper, width, lower)))
+            column_sums = band.sum(axis=0, dtype=np.uint64)
+            box_sums[index] = np.add.reduceat(column_sums, x_starts, axis=0)
+
+        x_indices = {left: index for index, left in enumerate(x_starts)}
+        y_indices = {upper: index for index, upper in enumerate(y_starts)}
+        colors = []
+        for left, upper, right, lower in original_boxes:
+            nr_pixels = (right - left) * (lower - upper)
+            box_sum = box_sums[y_indices[upper], x_indices[left]]
+            colors.append(tuple(round(int(channel_sum) / nr_pixels) for channel_sum in box_sum))
+        return colors
+
     def _determine_output_size(self) -> Size:
         """
         Based on the size of the photo to recreate and the MAX_SIZE of the output,
@@ -101,11 +421,6 @@ class MosaicCreator:
         new_height = round(factor * height / self.nr_pixels_in_y) * self.nr_pixels_in_y
         return new_width, new_height
 
-    def _get_boxes(self, nr_boxes_in_x: int, nr_boxes_in_y: int) -> List[Tuple[Box, Box]]:
-        original_boxes = self._determine_boxes(*self.original_size, nr_boxes_in_x, nr_boxes_in_y)
-        output_boxes = self._determine_boxes(*self.output_size, nr_boxes_in_x, nr_boxes_in_y)
-        return permutation_multiple_lists(original_boxes, output_boxes)
-
     @staticmethod
     def _determine_boxes(width, height, nr_boxes_in_x: int, nr_boxes_in_y: int) -> List[Box]:
         """
@@ -140,6 +455,79 @@ class MosaicCreator:
         ]
 
 
+def _blend_cheat_colors(canvas: Image.Image, tiles: List[Tuple[Box, Color, str]], cheat_parameter: int,
+                        upper: int = 0) -> None:
+    """
+    Blend every tile on the canvas in place with the color of the original, see MosaicCreator._blend_cheat_colors
+
+    All colors are drawn on a single color image first, such that the blending is done in one operation over
+    the whole canvas, instead of per tile.
+    """
+
+    if cheat_parameter == 0:
+        return
+
+    colors = np.empty((canvas.size[1], canvas.size[0], 3), dtype=np.uint8)
+    for (left, box_upper, right, lower), color, _ in tiles:
+        colors[box_upper - upper:lower - upper, left:right] = color
+    mask = Image.new(mode='L', size=canvas.size, color=cheat_parameter)
+    canvas.paste(Image.fromarray(colors), mask=mask)
+
+
+def _boxes_per_photo(tiles: List[Tuple[Box, Color, str]]) -> Dict[str, List[Box]]:
+    """
+    Return the boxes in the output of the given tiles per filename, in order of filename
+
+    Pasting all tiles of the same photo after each other makes that every photo is read only once, also when the
+    tile cache can not hold all photos.
+    """
+
+    boxes_per_photo: Dict[str, List[Box]] = defaultdict(list)
+    for output_box, _, filename in tiles:
+        boxes_per_photo[filename].append(output_box)
+    return {filename: boxes_per_photo[filename] for filename in sorted(boxes_per_photo)}
+
+
+def _render_band(canvas_fp: str, output_size: Size, tiles: List[Tuple[Box, Color, str]], cheat_parameter: int,
+                 resizeds_dir: str, tile_size: Size, use_atlas: bool, nr_prefetch_threads: int = 0) -> None:
+    """
+    Paste and blend the given tiles, which make up a band of whole rows, and write the band to the canvas
+
+    This is a module level function, such that it can be sent to worker processes.
+
+    :param canvas_fp: Full path to the raw RGB canvas of the complete output, which is memory-mapped
+    :param output_size: Size of the complete output
+    :param tiles: List of (box in the output, color of the original, filename) per tile in the band
+    :param cheat_parameter: See MosaicCreator
+    :param resizeds_dir: Directory of the resized photos, see PhotoAnalyzer
+    :param tile_size: Size of the resized photos
+    :param use_atlas: Whether to read the resized photos from the tile atlas next to resizeds_dir instead
+    :param nr_prefetch_threads: Number of threads to read and decode the upcoming resized photos with
+    """
+
+    upper = min(output_box[1] for output_box, _, _ in tiles)
+    lower = max(output_box[3] for output_box, _, _ in tiles)
+    atlas = TileAtlas(os.path.dirname(resizeds_dir), tile_size) if use_atlas else None
+    band = Image.new(mode='RGB', size=(output_size[0], lower - upper))
+
+    def read_photo(filename: str) -> Photo:
+        photo = atlas.get_photo(filename) if atlas is not None else Photo.open(os.path.join(resizeds_dir, filename))
+        photo.load()
+        return photo
+
+    boxes_per_photo = _boxes_per_photo(tiles)
+    photos = imap_prefetched(read_photo, boxes_per_photo, nr_threads=nr_prefetch_threads)
+    for output_boxes, photo in zip(boxes_per_photo.values(), photos):
+        for left, box_upper, _, _ in output_boxes:
+            band.paste(photo.img, box=(left, box_upper - upper))
+    _blend_cheat_colors(band, tiles, cheat_parameter, upper)
+
+    width, height = output_size
+    canvas = np.memmap(canvas_fp, dtype=np.uint8, mode='r+', shape=(height, width, 3))
+    canvas[upper:lower] = np.asarray(band)
+    canvas.flush()
+
+
 if __name__ == '__main__':
     _max_output_size = 1000
     _cheat_parameter = 25
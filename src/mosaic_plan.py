@@ -0,0 +1,75 @@
+import json
+from typing import List, Literal, NamedTuple, Optional
+
+from utils.type_hinting import Color
+
+# greedy: match tiles one by one in random order, optimal: minimize the total color distance over all tiles
+AssignmentMethod = Literal['greedy', 'optimal']
+
+# Version of the file format of a saved plan, to increase when it changes incompatibly
+PLAN_FORMAT_VERSION = 1
+
+
+class MosaicPlan(NamedTuple):
+    """
+    Assignment of tile photos to the cells of the grid of a mosaic, that can be rendered at any output size and
+    cheat parameter, see MosaicCreator.plan and MosaicCreator.render_plan
+
+    The cells are in the order of MosaicCreator._determine_boxes, i.e. column by column.
+    """
+
+    target_fp: str  # Full path to the photo to create a mosaic of
+    src_dir: str  # Directory with the tile photos, see PhotoAnalyzer
+    nr_pixels_in_x: int
+    nr_pixels_in_y: int
+    assignment: AssignmentMethod
+    seed: Optional[int]  # Random seed with which the cells were matched, if known
+    colors: List[Color]  # Average color of the target per cell
+    filenames: List[str]  # Filename of the tile photo per cell
+
+    def save(self, fp: str) -> None:
+        """
+        Write the plan to the given JSON file
+
+        Every photo is stored once, and every cell refers to it by index, to keep the file small for large grids.
+        """
+
+        photos = sorted(set(self.filenames))
+        photo_indices = {filename: index for index, filename in enumerate(photos)}
+        content = {
+            'version': PLAN_FORMAT_VERSION,
+            'target_fp': self.target_fp,
+            'src_dir': self.src_dir,
+            'nr_pixels_in_x': self.nr_pixels_in_x,
+            'nr_pixels_in_y': self.nr_pixels_in_y,
+            'assignment': self.assignment,
+            'seed': self.seed,
+            'photos': photos,
+            # Per cell: red, green, blue and the index of the photo
+            'cells': [[*color, photo_indices[filename]] for color, filename in zip(self.colors, self.filenames)],
+        }
+        with open(fp, 'w') as f:
+            json.dump(content, f, separators=(',', ':'))
+
+    @staticmethod
+    def load(fp: str) -> 'MosaicPlan':
+        """
+        Read a plan from the given JSON file, as written by save
+        """
+
+        with open(fp) as f:
+            content = json.load(f)
+        if content.get('version') != PLAN_FORMAT_VERSION:
+            raise ValueError(f'Cannot read plan {fp} with format version {content.get("version")}, '
+                             f'expected version {PLAN_FORMAT_VERSION}')
+        photos = content['photos']
+        return MosaicPlan(
+            target_fp=content['target_fp'],
+            src_dir=content['src_dir'],
+            nr_pixels_in_x=content['nr_pixels_in_x'],
+            nr_pixels_in_y=content['nr_pixels_in_y'],
+            assignment=content['assignment'],
+            seed=content['seed'],
+            colors=[(red, green, blue) for red, green, blue, _ in content['cells']],
+            filenames=[photos[photo_index] for _, _, _, photo_index in content['cells']],
+        )
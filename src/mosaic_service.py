@@ -0,0 +1,191 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from mosaic_creator import MosaicCreator
+from mosaic_plan import AssignmentMethod
+from photo import Photo
+from photo_analyzer import PhotoAnalyzer
+from utils.instrumentation import Instrumentation
+from utils.path import Path
+from utils.strip_writer import can_write_in_strips
+from utils.type_hinting import Size
+
+
+class RenderJob(NamedTuple):
+    """
+    Description of a single mosaic to render
+    """
+
+    target_fp: str  # Full path to the photo to create a mosaic of
+    src_dir: str  # Directory with the tile photos, see PhotoAnalyzer
+    nr_pixels_in_x: int
+    nr_pixels_in_y: int
+    max_output_size: int = MosaicCreator.DEFAULT_MAX_OUTPUT_SIZE
+    cheat_parameter: int = MosaicCreator.DEFAULT_CHEAT_PARAMETER
+    assignment: AssignmentMethod = 'greedy'
+    # If given, write the mosaic to this file instead of returning it. Uncompressed .ppm, .tif and .tiff files
+    # are written in strips, see photo_pixelate_to_file.
+    output_fp: Optional[str] = None
+
+
+class RenderResult(NamedTuple):
+    """
+    Outcome of a single rendered mosaic
+    """
+
+    job: RenderJob
+    photo: Optional[Photo]  # The mosaic, or None if it is written to job.output_fp
+    library_seconds: float  # Time spent loading the tile library, which is 0 if it was resident already
+    total_seconds: float  # Time between the start of the job and the finished mosaic
+
+
+class MosaicService:
+    """
+    Long-lived service to render many mosaics from the same tile libraries
+
+    Every tile library is loaded once, the first time a job needs it with its tile size, and is then kept resident:
+    the photo analysis, the resized photos that were read, and the tile atlas. Jobs can be rendered concurrently
+    from multiple threads. Each job selects its photos independently, while sharing the resident library.
+    """
+
+    DEFAULT_NR_CONCURRENT_JOBS = 2
+
+    _libraries: Dict[Tuple[str, Size], PhotoAnalyzer]  # Resident library, where key is (src_dir, tile size)
+    _library_locks: Dict[Tuple[str, Size], threading.Lock]
+
+    def __init__(self, fast_decode: bool = False, use_atlas: bool = False, nr_workers: int = 1,
+                 nr_concurrent_jobs: int = DEFAULT_NR_CONCURRENT_JOBS, use_pyramid: bool = False,
+                 max_tile_cache_bytes: Optional[int] = PhotoAnalyzer.DEFAULT_MAX_TILE_CACHE_BYTES,
+                 use_color_store: bool = False, instrumentation: Optional[Instrumentation] = None):
+        """
+        :param fast_decode: Decode the tile photos at reduced resolution when loading a library, see PhotoAnalyzer
+        :param use_atlas: Keep the tiles of every library in a memory-mapped tile atlas, see TileAtlas
+        :param use_pyramid: Derive the tiles of new tile sizes from a tile pyramid, see TilePyramid
+        :param max_tile_cache_bytes: Maximum number of bytes of decoded tiles to keep in memory per library
+        :param use_color_store: Select the photos of every library with a memory-mapped color store, see ColorStore
+        :param nr_workers: Number of processes to prepare the tile photos with when loading a library
+        :param nr_concurrent_jobs: Maximum number of submitted jobs that are rendered at the same time
+        :param instrumentation: Instrumentation to record the timers, counters and progress messages of all jobs in
+        """
+
+        self.fast_decode = fast_decode
+        self.use_atlas = use_atlas
+        self.use_pyramid = use_pyramid
+        self.max_tile_cache_bytes = max_tile_cache_bytes
+        self.use_color_store = use_color_store
+        self.nr_workers = nr_workers
+        self.instrumentation = instrumentation or Instrumentation()
+        self._libraries = {}
+        self._library_locks = {}
+        self._lock = threading.Lock()  # Guards the dictionaries above, not the loading of the libraries themselves
+        self._executor = ThreadPoolExecutor(max_workers=nr_concurrent_jobs)
+
+    def __enter__(self) -> 'MosaicService':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Wait for all submitted jobs to finish, and stop accepting new ones
+        """
+
+        self._executor.shutdown(wait=True)
+
+    def submit(self, job: RenderJob) -> 'Future[RenderResult]':
+        """
+        Render the given job in the background
+        """
+
+        return self._executor.submit(self.render, job)
+
+    def render(self, job: RenderJob) -> RenderResult:
+        """
+        Render the given job in the current thread, and report how long it took
+        """
+
+        start = time.perf_counter()
+        creator = MosaicCreator(job.target_fp, nr_pixels_in_x=job.nr_pixels_in_x, nr_pixels_in_y=job.nr_pixels_in_y,
+                                max_output_size=job.max_output_size, cheat_parameter=job.cheat_parameter,
+                                instrumentation=self.instrumentation)
+        library_start = time.perf_counter()
+        library = self.get_library(job.src_dir, creator.tile_size)
+        library_seconds = time.perf_counter() - library_start
+        analyzer = library.for_mosaic(nr_photo_pixels=job.nr_pixels_in_x * job.nr_pixels_in_y)
+
+        photo = None
+        if job.output_fp and can_write_in_strips(job.output_fp):
+            creator.photo_pixelate_to_file(job.src_dir, job.output_fp, assignment=job.assignment, analyzer=analyzer)
+        else:
+            photo = creator.photo_pixelate(job.src_dir, assignment=job.assignment, analyzer=analyzer)
+            if job.output_fp:
+                photo.save(job.output_fp)
+                photo = None
+        total_seconds = time.perf_counter() - start
+        self.instrumentation.count('service.jobs')
+        self.instrumentation.log(f'Rendered mosaic of {job.target_fp} in {total_seconds:.2f}s, '
+                                 f'of which {library_seconds:.2f}s loading the tile library')
+        return RenderResult(job, photo, library_seconds, total_seconds)
+
+    def get_library(self, src_dir: str, tile_size: Size) -> PhotoAnalyzer:
+        """
+        Return the resident analyzer of the tile photos in src_dir with the given tile size, loading it if needed
+
+        Concurrent calls for the same library wait for a single load, calls for other libraries do not wait for it.
+        Use PhotoAnalyzer.for_mosaic to select photos from it.
+        """
+
+        key = (src_dir, tile_size)
+        while True:
+            with self._lock:
+                library_lock = self._library_locks.setdefault(key, threading.Lock())
+            with library_lock:
+                with self._lock:
+                    if self._library_locks.get(key) is not library_lock:
+                        # The library was unloaded while waiting for the lock, wait for the lock of the next load
+                        continue
+                if key not in self._libraries:
+                    # The number of tiles is set for each mosaic, see PhotoAnalyzer.for_mosaic
+                    library = PhotoAnalyzer(src_dir, nr_photo_pixels=1, tile_size=tile_size,
+                                            fast_decode=self.fast_decode, use_atlas=self.use_atlas,
+                                            nr_workers=self.nr_workers, use_pyramid=self.use_pyramid,
+                                            max_tile_cache_bytes=self.max_tile_cache_bytes,
+                                            use_color_store=self.use_color_store, instrumentation=self.instrumentation)
+                    with self._lock:
+                        self._libraries[key] = library
+                return self._libraries[key]
+
+    def unload_library(self, src_dir: str) -> None:
+        """
+        Remove all resident libraries of src_dir, such that the next job loads them again
+
+        Use this after photos in src_dir are added, changed or removed. Jobs that are running keep using the old one.
+        A library that is being loaded is removed once it is loaded, such that it is not added after this returns.
+        """
+
+        with self._lock:
+            keys = [key for key in self._library_locks if key[0] == src_dir]
+        for key in keys:
+            with self._lock:
+                library_lock = self._library_locks.get(key)
+            if library_lock is None:
+                continue
+            with library_lock, self._lock:
+                self._libraries.pop(key, None)
+                if self._library_locks.get(key) is library_lock:
+                    del self._library_locks[key]
+
+
+if __name__ == '__main__':
+    with MosaicService() as service:
+        futures = [
+            service.submit(RenderJob(Path.to_photo('wolf_high_res'), Path.to_src_photos_dir('cats'),
+                                     nr_pixels_in_x=nr_pixels, nr_pixels_in_y=nr_pixels, max_output_size=1000))
+            for nr_pixels in (20, 40)
+        ]
+        for future in futures:
+            result = future.result()
+            print(f'{result.job.nr_pixels_in_x}x{result.job.nr_pixels_in_y}: {result.total_seconds:.2f}s')
@@ -1,7 +1,7 @@
 import os.path
 from typing import Any, Optional, Literal
 
-from PIL import Image
+from PIL import Image, ImageStat
 
 from utils.type_hinting import Color, Size
 
@@ -27,16 +27,36 @@ class Photo:
         return Photo(img)
 
     @staticmethod
-    def open(fp: str) -> 'Photo':
+    def open(fp: str, min_size: Optional[Size] = None) -> 'Photo':
         """
         Open and identify the given image file as Photo
 
         :param fp: full path to the file to open
+        :param min_size: If given, decode the image at the smallest resolution that is still at least this size.
+                         JPEG images are scaled during decoding, other images are reduced right after decoding.
         """
 
         img = Image.open(fp)
+        if min_size:
+            img = Photo._shrink_on_load(img, min_size)
         return Photo(img)
 
+    @staticmethod
+    def _shrink_on_load(img: Image.Image, min_size: Size) -> Image.Image:
+        """
+        Return the image at the smallest resolution that is at least min_size in both dimensions
+        """
+
+        if img.format == 'JPEG':
+            # The JPEG decoder can scale by 1/2, 1/4 or 1/8 in the DCT domain, which is almost free
+            img.draft('RGB', min_size)
+        factor = min(img.size[0] // min_size[0], img.size[1] // min_size[1])
+        if factor > 1:
+            reduced_img = img.reduce(factor)
+            img.close()
+            img = reduced_img
+        return img
+
     def __init__(self, img: Image.Image = None):
         """
         Initialize with an Image in memory
@@ -60,17 +80,23 @@ class Photo:
     def _determine_avg_color(self) -> Color:
         """
         Determine the average color of the Photo
-        """
 
-        # TODO: Check if resizing to 1 pixel is faster and still gives good results
-        pixels = list(self.getdata())
-        nr_pixels = len(pixels)
-        channels = list(zip(*pixels))  # [(R values), (G values), (B values)]
-        return (
-            round(sum(channels[0]) / nr_pixels),  # R mean
-            round(sum(channels[1]) / nr_pixels),  # G mean
-            round(sum(channels[2]) / nr_pixels),  # B mean
-        )
+        The channel sums are computed by Pillow from the band histograms, so no pixel is ever converted to a
+        Python object. Photos that are not RGB are converted first, such that grayscale, palette and CMYK photos
+        are averaged in RGB space. Fully transparent pixels do not contribute to the average, unless all pixels are.
+        """
+
+        img = self.img
+        mask = None
+        if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+            img = img.convert('RGBA')
+            alpha = img.getchannel('A')
+            if alpha.getbbox() is not None:
+                mask = alpha
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        r_mean, g_mean, b_mean = ImageStat.Stat(img, mask).mean
+        return round(r_mean), round(g_mean), round(b_mean)
 
     def __getattr__(self, item: Any) -> Any:
         """
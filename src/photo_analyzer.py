@@ -1,11 +1,22 @@
-import json
+import copy
 import os.path
 from pprint import pprint
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import math
 
+from PIL import Image
+
+from analysis_cache import AnalysisCache
+from color_store import ColorStore, ColorStoreIndex
 from photo import Photo
+from tile_atlas import TileAtlas
+from tile_pyramid import PYRAMID_DIRNAME, TilePyramid, collect_garbage, save_levels, touch
+from utils.instrumentation import Instrumentation
+from utils.assignment import assign_min_cost
+from utils.color_index import ColorIndex
+from utils.lru_cache import LRUCache
+from utils.parallel_utils import imap_bounded, imap_prefetched
 from utils.path import Path
 from utils.type_hinting import Color, Size, size_as_string
 
@@ -16,73 +27,249 @@ class PhotoAnalyzer:
     """
 
     _photos: Dict[str, Photo]
-    _resized_photos: Dict[Tuple[str, Size], Photo]  # Resized image, where key is (filename, (width, height))
-    _photos_to_choose_from: List[str]
+    _tile_cache: LRUCache[str, Photo]  # Resized photos that were read, where key is the filename
+    _color_index: Optional[ColorIndex]  # Nearest neighbour index over the photos that are not used up yet
+    _store_index: Optional[ColorStoreIndex]  # Index over the photos in the color store that are not used up yet
+
+    # Layout of a tile library in src_dir: the originals, the resized photos per tile size, and the analysis cache
+    ORIGINALS_DIRNAME = 'original_input_photos'
+    RESIZEDS_DIRNAME = 'resized_input_photos'
+    ANALYSIS_CACHE_FILENAME = 'photo_analysis.sqlite'
+    LEGACY_ANALYSIS_FILENAME = 'photo_analysis.json'  # Analysis of earlier versions, imported once
+    COLOR_STORE_DIRNAME = 'color_store'
+
+    # Number of photos to decode both exactly and fast, to report the color drift caused by fast decoding
+    FAST_DECODE_DRIFT_SAMPLE_SIZE = 10
+
+    # Number of analyzed photos to store in the analysis cache at once
+    ANALYSIS_CACHE_BATCH_SIZE = 100
+
+    # Maximum number of bytes of the decoded resized photos to keep in memory
+    DEFAULT_MAX_TILE_CACHE_BYTES = 256 * 1024 * 1024
+
+    # Number of threads to read and decode the upcoming resized photos with while rendering
+    DEFAULT_NR_PREFETCH_THREADS = 4
+
+    def __init__(self, src_dir: str, nr_photo_pixels: int, tile_size: Size, fast_decode: bool = False,
+                 use_atlas: bool = False, nr_workers: int = 1, use_content_hash: bool = False,
+                 use_pyramid: bool = False, max_cache_bytes: Optional[int] = None,
+                 max_tile_cache_bytes: Optional[int] = DEFAULT_MAX_TILE_CACHE_BYTES, use_color_store: bool = False,
+                 instrumentation: Optional[Instrumentation] = None):
+        """
+        :param src_dir: Directory with a subdirectory original_input_photos that contains the tile photos
+        :param nr_photo_pixels: Number of tiles in the mosaic
+        :param tile_size: Size of a single tile in the mosaic
+        :param fast_decode: If True, decode originals at the smallest resolution that is still at least tile_size.
+                            This is much faster, at the cost of a slight drift in average color.
+        :param use_atlas: If True, store the resized photos in a memory-mapped TileAtlas instead of in JPEG files
+        :param nr_workers: Number of processes to resize and analyze the originals with
+        :param use_content_hash: If True, identify originals by content hash in the analysis cache, such that
+                                 renamed or touched photos are not analyzed again
+        :param use_pyramid: If True, keep the originals at a few power-of-two sizes in a TilePyramid, and derive
+                            the resized photos of a new tile size from it instead of from the originals
+        :param max_cache_bytes: If given, remove the least recently used resized photos of other tile sizes and
+                                levels of the tile pyramid, until all resized photos take at most this many bytes.
+                                Other analyzers of src_dir that are in use can then no longer read their tiles.
+        :param max_tile_cache_bytes: Maximum number of bytes of the decoded resized photos to keep in memory, of
+                                     which the least recently used are evicted first. None keeps all of them.
+        :param use_color_store: If True, keep the average colors in a memory-mapped ColorStore as well, and select
+                                photos one by one on its k-d tree instead of with a ColorIndex. This takes much
+                                less memory for selection in libraries with hundreds of thousands of photos.
+                                Loading the library is not affected.
+        :param instrumentation: Instrumentation to record timers, counters and progress messages in.
+                                By default, progress messages are printed.
+        """
 
-    def __init__(self, src_dir: str, nr_photo_pixels: int, tile_size: Size):
         self.src_dir = src_dir
         self.nr_photo_pixels = nr_photo_pixels
         self.tile_size = tile_size
+        self.fast_decode = fast_decode
+        self.nr_workers = nr_workers
+        self.instrumentation = instrumentation or Instrumentation()
+
+        self.originals_dir = os.path.join(self.src_dir, self.ORIGINALS_DIRNAME)
+        self.resizeds_dir = self.resizeds_dir_of(self.src_dir, self.tile_size)
+        with self.instrumentation.timer('analyzer.scan'):
+            self.originals = {filename for filename in sorted(os.listdir(self.originals_dir))
+                              if self._is_image(filename)}
+
+        self._tile_cache = LRUCache(max_tile_cache_bytes, size_of=_nr_photo_bytes,
+                                    on_evict=lambda filename, photo: self.instrumentation.count('tile_cache.evictions'))
+        self._color_index = None
+        self._store_index = None
+
+        self.atlas = TileAtlas(os.path.dirname(self.resizeds_dir), self.tile_size) if use_atlas else None
+        self.pyramid = TilePyramid(os.path.join(self.src_dir, self.RESIZEDS_DIRNAME, PYRAMID_DIRNAME)) \
+            if use_pyramid else None
+        self._analysis_cache = AnalysisCache(os.path.join(self.src_dir, self.ANALYSIS_CACHE_FILENAME), use_content_hash)
+        self._changed_originals: Set[str] = set()  # Originals that changed since they were analyzed
+        self._nr_photos_analyzed = 0  # Number of photos analyzed in this run, also while resizing them
+        try:
+            with self.instrumentation.timer('analyzer.read_analysis'):
+                self._photo_analysis = self._read_photo_analysis()
+            with self.instrumentation.timer('analyzer.resize'):
+                self._resize_images()
+                self._collect_garbage(max_cache_bytes)
+            with self.instrumentation.timer('analyzer.analyze'):
+                self._photo_analysis = self._analyze_photos()
+            with self.instrumentation.timer('analyzer.color_store'):
+                self.color_store = self._open_color_store() if use_color_store else None
+        finally:
+            # The analysis cache is only used while loading. Its connection can only be used by the thread that
+            # created it, and would otherwise stay open for as long as a MosaicService keeps the library resident.
+            self._analysis_cache.close()
+
+    @classmethod
+    def resizeds_dir_of(cls, src_dir: str, tile_size: Size) -> str:
+        """
+        Return the directory in which the photos of the tile library in src_dir are stored resized to tile_size
+        """
 
-        self.originals_dir = os.path.join(self.src_dir, 'original_input_photos')
-        self.resizeds_dir = os.path.join(self.src_dir, 'resized_input_photos', size_as_string(self.tile_size))
-        os.makedirs(self.resizeds_dir, exist_ok=True)
-        self.originals = {filename for filename in sorted(os.listdir(self.originals_dir)) if self._is_image(filename)}
+        return os.path.join(src_dir, cls.RESIZEDS_DIRNAME, size_as_string(tile_size))
 
-        self._resized_photos: Dict[str, Photo] = {}
-        self._photos_to_choose_from: List[str] = []
+    @property
+    def photos_to_choose_from(self) -> List[str]:
+        """
+        Return a list of photo filenames that can be used in the photo mosaic
 
-        self._resize_images()
-        self._photo_analysis = self._analyze_photos()
+        Note: this must be a list, since there can be duplicates in it: a photo can be used as often as it occurs
+        """
+
+        return list(self.originals) * self.nr_uses_per_photo
 
     @property
-    def photos_to_choose_from(self) -> List[str]:
+    def nr_uses_per_photo(self) -> int:
         """
-        Return a list of photo filenames that are not used yet in the photo mosaic
+        Return the number of times every photo can be used, such that there are enough photos for all tiles
+        """
+
+        return int(math.ceil(self.nr_photo_pixels / len(self.originals)))
+
+    @property
+    def color_index(self) -> ColorIndex:
+        """
+        Return the nearest neighbour index over the photos that are not used up yet
+
+        When all photos are used up, the index is rebuilt with nr_uses_per_photo uses of every photo
+        """
+
+        if not self._color_index:
+            self._color_index = ColorIndex(self._photo_analysis, self._capacities())
+        return self._color_index
+
+    def for_mosaic(self, nr_photo_pixels: int) -> 'PhotoAnalyzer':
+        """
+        Return an analyzer over the same photos, to select the photos of another mosaic with
+
+        The analysis and the tile cache are shared with this analyzer, such that resized photos are not read again.
+        Which photos are used up is not shared, such that selecting photos with the returned analyzer does not
+        affect this analyzer, also not when that happens in another thread.
 
-        Note: this must be a list, since there can be duplicates in it that need to be popped one by one
+        :param nr_photo_pixels: Number of tiles in the other mosaic
         """
 
-        if not self._photos_to_choose_from:
-            nr_photos = len(self.originals)
-            nr_required_photos = self.nr_photo_pixels
-            duplicate_per_photo = int(math.ceil(nr_required_photos / nr_photos))
-            self._photos_to_choose_from = list(self.originals) * duplicate_per_photo
-        return self._photos_to_choose_from
+        analyzer = copy.copy(self)
+        analyzer.nr_photo_pixels = nr_photo_pixels
+        analyzer._color_index = None
+        analyzer._store_index = None
+        return analyzer
 
     def select_best_photo(self, color: Color) -> Photo:
         """
         Select the photo that most closely matches the input color
+
+        Every selected photo is used once, such that it can not be selected more often than it occurs in
+        photos_to_choose_from. Among equally close photos, the first filename is selected.
+        """
+
+        return self.get_resized_photo(self.select_best_filename(color))
+
+    def select_best_filename(self, color: Color) -> str:
+        """
+        Like select_best_photo, but return the filename of the photo instead of the resized photo itself
+        """
+
+        if self.color_store is not None:
+            return self._pop_nearest_in_color_store(color)
+        return self.color_index.pop_nearest(color)
+
+    def select_best_photos(self, colors: List[Color]) -> List[Photo]:
+        """
+        Select a photo for each of the input colors at once, minimizing the total distance to the input colors
+
+        Every photo is selected at most as often as it occurs in photos_to_choose_from. Unlike repeated calls of
+        select_best_photo, the result does not depend on the order of the input colors.
+        """
+
+        return [self.get_resized_photo(filename) for filename in self.select_best_filenames(colors)]
+
+    def select_best_filenames(self, colors: List[Color]) -> List[str]:
+        """
+        Like select_best_photos, but return the filenames of the photos instead of the resized photos themselves
+        """
+
+        return assign_min_cost(colors, self._photo_analysis, self._capacities())
+
+    def _capacities(self) -> Dict[str, int]:
+        """
+        Return the number of times every photo can be used, without listing every use like photos_to_choose_from
+        """
+
+        return dict.fromkeys(self.originals, self.nr_uses_per_photo)
+
+    def _pop_nearest_in_color_store(self, color: Color) -> str:
+        """
+        Like ColorIndex.pop_nearest, but search the k-d tree of the color store. When all photos are used up, all
+        uses are reset.
         """
 
-        unique_photos_to_choose_from = set(self.photos_to_choose_from)
-        distances = [
-            (self._distance(color, self._photo_analysis[filename]), filename)
-            for filename in unique_photos_to_choose_from
-        ]
-        best_photo_filename = min(distances)[1]
-        self._photos_to_choose_from.remove(best_photo_filename)
-        return self._get_resized_photo(best_photo_filename)
+        if not self._store_index:
+            self._store_index = self.color_store.index(self.nr_uses_per_photo)
+        return self.color_store.filename(self._store_index.pop_nearest(color))
+
+    def _open_color_store(self) -> ColorStore:
+        """
+        Open the color store of the tile library, and write it again if it does not hold the current analysis
+        """
+
+        store_dir = os.path.join(self.src_dir, self.COLOR_STORE_DIRNAME)
+        color_store = ColorStore(store_dir)
+        fingerprint = self._analysis_cache.fingerprint
+        if color_store.fingerprint != fingerprint:
+            color_store = ColorStore.write(store_dir, self._photo_analysis, fingerprint)
+            self.instrumentation.log(f'Wrote color store of {len(color_store)} photos '
+                                     f'in {color_store.nr_shards} shards')
+        return color_store
 
     def _resize_images(self):
         """
         Ensure that all tile images are resized before using them
+
+        Photos that are resized are analyzed at the same time if needed, such that they are only decoded once
         """
 
+        if self.pyramid is not None:
+            self.pyramid.remove(self._changed_originals)
+            self.pyramid.remove_all_except(self.originals)
+
+        if self.atlas is not None:
+            nr_tiles_created, nr_tiles_deleted = self.atlas.update(self.originals, self._create_tiles,
+                                                                   outdated_filenames=self._changed_originals)
+            if nr_tiles_created > 0:
+                self.instrumentation.log(f'Added {nr_tiles_created} photos to tile atlas {self.atlas.array_fp}')
+            if nr_tiles_deleted > 0:
+                self.instrumentation.log(f'Deleted {nr_tiles_deleted} unused photos from tile atlas '
+                                         f'{self.atlas.array_fp}')
+            return
+
+        os.makedirs(self.resizeds_dir, exist_ok=True)
         resizeds = {filename for filename in sorted(os.listdir(self.resizeds_dir))}
 
-        # Resize images that have not been resized yet
-        nr_photos_resized = 0
-        for filename in self.originals:
-            if filename not in resizeds:
-                original_fp = os.path.join(self.originals_dir, filename)
-                resized_fp = os.path.join(self.resizeds_dir, filename)
-                original_photo = Photo.open(original_fp)
-                resized_photo = Photo(img=original_photo.resize(self.tile_size))
-                resized_photo.save(resized_fp)
-                nr_photos_resized += 1
+        # Resize images that have not been resized yet, or of which the original changed
+        filenames_to_resize = sorted(self.originals.difference(resizeds).union(self._changed_originals))
+        nr_photos_resized = sum(1 for _ in self._process_originals(filenames_to_resize, save_resized=True))
         if nr_photos_resized > 0:
-            print(f'Resized {nr_photos_resized} photos to {size_as_string(self.tile_size)}')
+            self.instrumentation.log(f'Resized {nr_photos_resized} photos to {size_as_string(self.tile_size)}')
 
         # Remove resized images that are not in the original
         nr_resized_photos_deleted = 0
@@ -92,75 +279,181 @@ class PhotoAnalyzer:
                 os.remove(resized_fp)
                 nr_resized_photos_deleted += 1
         if nr_resized_photos_deleted > 0:
-            print(f'Deleted {nr_resized_photos_deleted} unused resized photos from {self.resizeds_dir}')
+            self.instrumentation.log(f'Deleted {nr_resized_photos_deleted} unused resized photos '
+                                     f'from {self.resizeds_dir}')
+
+    def _collect_garbage(self, max_cache_bytes: Optional[int]) -> None:
+        """
+        Mark the resized photos of this tile size as used, and remove the least recently used other ones if needed
+
+        :param max_cache_bytes: Maximum number of bytes of all resized photos, or None to remove nothing
+        """
+
+        in_use = [self.atlas.array_fp, self.atlas.index_fp] if self.atlas is not None else [self.resizeds_dir]
+        if self.pyramid is not None:
+            in_use.extend(self.pyramid.source_dirs(self.tile_size))
+        touch(in_use)
+        if max_cache_bytes is None:
+            return
+
+        removed_paths = collect_garbage(os.path.dirname(self.resizeds_dir), max_cache_bytes, in_use)
+        if removed_paths:
+            self.instrumentation.log(f'Deleted {len(removed_paths)} least recently used resized photo directories '
+                                     f'and files to stay within {max_cache_bytes} bytes')
+
+    def _read_photo_analysis(self) -> Dict[str, Color]:
+        """
+        Read the average colors that were determined in an earlier run, for the photos that did not change since
+        """
+
+        json_fp = os.path.join(self.src_dir, self.LEGACY_ANALYSIS_FILENAME)
+        nr_photos_imported = self._analysis_cache.import_json(json_fp, self.originals_dir, self.originals)
+        if nr_photos_imported > 0:
+            self.instrumentation.log(f'Imported analysis of {nr_photos_imported} photos from {json_fp}')
+        nr_photos_deleted = self._analysis_cache.remove_all_except(self.originals)
+        if nr_photos_deleted > 0:
+            self.instrumentation.log(f'Deleted analysis of {nr_photos_deleted} photos that do no longer exist')
+        photo_analysis, self._changed_originals = self._analysis_cache.lookup(self.originals_dir, self.originals)
+        if self._changed_originals:
+            self.instrumentation.log(f'Discarded analysis of {len(self._changed_originals)} photos that changed')
+        return photo_analysis
 
     def _analyze_photos(self) -> Dict[str, Color]:
         """
         Determine the average color of each input photo, and store it on disk for faster reruns
         """
 
-        # Read the existing photo analysis file
-        photo_analysis_file = os.path.join(self.src_dir, 'photo_analysis.json')
-        if os.path.exists(photo_analysis_file):
-            with open(photo_analysis_file) as f:
-                photo_analysis = json.load(f)
-        else:
-            photo_analysis = {}
+        # Photos that were resized are analyzed already, see _resize_images. Add analysis of the other photos.
+        filenames_to_analyze = sorted(self.originals.difference(self._photo_analysis.keys()))
+        for _ in self._process_originals(filenames_to_analyze):
+            if self._nr_photos_analyzed % 100 == 0:
+                # Analyzing thousands of photos can be slow. We therefore inform the user of the progress.
+                self.instrumentation.log(f'Analyzed average color of {self._nr_photos_analyzed} photos...')
+
+        if not self._nr_photos_analyzed:
+            self.instrumentation.log(f'Photo analysis of {len(self._photo_analysis)} photos is up-to-date')
+            return self._photo_analysis
+        self.instrumentation.log(f'Analyzed average color of {self._nr_photos_analyzed} photos')
+        if self.fast_decode:
+            max_drift, mean_drift = self.determine_fast_decode_drift()
+            self.instrumentation.log(f'Fast decoding changed the average color by at most {max_drift:.2f} '
+                                     f'(mean {mean_drift:.2f}) in a sample of the photos')
+
+        return self._photo_analysis
+
+    def _process_originals(self, filenames: Iterable[str], save_resized: bool = False,
+                           return_tiles: bool = False) -> Iterator[Tuple[str, Optional[Image.Image]]]:
+        """
+        Decode the given originals once each, on nr_workers processes, and resize and analyze them as needed
 
-        if not self.originals.difference(photo_analysis.keys()):
-            print(f'Photo analysis of {len(photo_analysis)} photos is up-to-date')
-            return photo_analysis
+        Average colors of photos that were not analyzed yet are added to _photo_analysis and the analysis cache.
 
-        # Delete analysis of photos that do no longer exist
-        keys_to_delete = set()
-        for filename in photo_analysis.keys():
-            if filename not in self.originals:
-                keys_to_delete.add(filename)
-        if keys_to_delete:
-            for key in keys_to_delete:
-                del photo_analysis[key]
-            print(f'Deleted analysis of {len(keys_to_delete)} photos that do no longer exist')
-
-        # Add analysis of photos that are not present yet
-        nr_photos_analyzed = 0
-        for filename in self.originals:
-            if filename not in photo_analysis:
-                original_fp = os.path.join(self.originals_dir, filename)
-                original_photo = Photo.open(original_fp)
-                photo_analysis[filename] = original_photo.avg_color
-                nr_photos_analyzed += 1
-                if nr_photos_analyzed % 100 == 0:
-                    # Analyzing thousands of photos can be slow. We therefore want to save the progress after
-                    # every 100 photos analyzed, and inform the user of the progress.
-                    print(f'Analyzed average color of {nr_photos_analyzed} photos...')
-                    with open(photo_analysis_file, 'w') as f:
-                        json.dump(photo_analysis, f, indent=2)
-        if nr_photos_analyzed > 0:
-            print(f'Analyzed average color of {nr_photos_analyzed} photos')
-
-        # Write the photo analysis to disk
-        with open(photo_analysis_file, 'w') as f:
-            # Sort the result before writing
-            result = {
-                key: photo_analysis[key]
-                for key in sorted(photo_analysis.keys())
-            }
-            json.dump(result, f, indent=2)
+        :param filenames: Filenames of the originals to process
+        :param save_resized: Whether to save the resized photos in resizeds_dir
+        :param return_tiles: Whether to yield the resized photos
+        :return: Iterator over (filename, resized image if return_tiles), in the order of filenames
+        """
 
-        return photo_analysis
+        filenames = list(filenames)
+        args_list = (
+            (
+                os.path.join(self.originals_dir, filename),
+                self.tile_size,
+                self.fast_decode,
+                filename not in self._photo_analysis,
+                os.path.join(self.resizeds_dir, filename) if save_resized else None,
+                return_tiles,
+                self.pyramid.source_fps(filename, self.tile_size) if self.pyramid is not None else [],
+                self.pyramid.level_fps(filename) if self.pyramid is not None else [],
+            )
+            for filename in filenames
+        )
+        results = imap_bounded(_process_original, args_list, nr_workers=self.nr_workers)
+        colors_to_store: Dict[str, Color] = {}
+        for index, (filename, (avg_color, tile, read_fp)) in enumerate(zip(filenames, results)):
+            if read_fp == os.path.join(self.originals_dir, filename):
+                self.instrumentation.count('photos_decoded')
+            else:
+                self.instrumentation.count('pyramid.tiles_derived')
+            self.instrumentation.count('bytes_read', os.path.getsize(read_fp))
+            if avg_color is not None:
+                self._photo_analysis[filename] = avg_color
+                self._nr_photos_analyzed += 1
+                colors_to_store[filename] = avg_color
+            # Store the progress regularly, such that an interrupted run does not need to start over. The last
+            # colors are stored before the last yield, since a consumer like TileAtlas.update does not necessarily
+            # resume this generator after it.
+            is_last = index == len(filenames) - 1
+            if colors_to_store and (len(colors_to_store) >= self.ANALYSIS_CACHE_BATCH_SIZE or is_last):
+                self._analysis_cache.store(colors_to_store)
+                colors_to_store = {}
+            yield filename, tile
+
+    def _create_tiles(self, filenames: List[str]) -> Iterator[Photo]:
+        """
+        Return the resized photos with the given filenames, for in the tile atlas
+        """
+
+        for _, tile in self._process_originals(filenames, return_tiles=True):
+            yield Photo(tile)
+
+    def determine_fast_decode_drift(self) -> Tuple[float, float]:
+        """
+        Return the maximum and mean distance between the exact and the fast decoded average color
 
-    def _get_resized_photo(self, filename: str) -> Photo:
+        The distance is determined on a sample of at most FAST_DECODE_DRIFT_SAMPLE_SIZE originals,
+        since decoding all of them exactly would defeat the purpose of fast decoding.
+        """
+
+        sample = sorted(self.originals)[:self.FAST_DECODE_DRIFT_SAMPLE_SIZE]
+        drifts = []
+        for filename in sample:
+            original_fp = os.path.join(self.originals_dir, filename)
+            exact_color = Photo.open(original_fp).avg_color
+            fast_color = Photo.open(original_fp, min_size=self.tile_size).avg_color
+            drifts.append(self._distance(exact_color, fast_color))
+        if not drifts:
+            return 0.0, 0.0
+        return max(drifts), sum(drifts) / len(drifts)
+
+    def get_resized_photo(self, filename: str) -> Photo:
         """
         Look up the resized photo with the given filename
 
         Since it could be reused when photos are duplicated, we only want to open the image once.
-        We therefore store the opened images in the object variable _resized_photos
+        We therefore keep the opened images in the tile cache, as far as its budget allows.
+        """
+
+        photo = self._tile_cache.get(filename)
+        if photo is not None:
+            self.instrumentation.count('tile_cache.hits')
+            return photo
+
+        self.instrumentation.count('tile_cache.misses')
+        with self.instrumentation.timer('analyzer.decode_tiles'):
+            if self.atlas is not None:
+                photo = self.atlas.get_photo(filename)
+            else:
+                photo_fp = os.path.join(self.resizeds_dir, filename)
+                photo = Photo.open(photo_fp)
+                photo.load()
+                self.instrumentation.count('bytes_read', os.path.getsize(photo_fp))
+        # Analyzers of concurrent mosaics share the tile cache, see for_mosaic. The cache never replaces a stored
+        # photo, since that would close its image while another thread could be using it.
+        return self._tile_cache.put(filename, photo)
+
+    def prefetch_resized_photos(self, filenames: Iterable[str],
+                                nr_threads: int = DEFAULT_NR_PREFETCH_THREADS) -> Iterator[Photo]:
+        """
+        Yield the resized photos with the given filenames in order, reading and decoding the upcoming ones ahead
+
+        The photos are looked up like get_resized_photo, on nr_threads threads, while the caller uses the previous
+        ones. How often the caller has to wait for a photo is counted in the prefetch.stalls counter, see
+        imap_prefetched. With zero threads, every photo is read when the caller asks for it.
         """
 
-        if filename not in self._resized_photos:
-            photo_fp = os.path.join(self.resizeds_dir, filename)
-            self._resized_photos[filename] = Photo.open(photo_fp)
-        return self._resized_photos[filename]
+        return imap_prefetched(self.get_resized_photo, filenames, nr_threads=nr_threads,
+                               instrumentation=self.instrumentation)
 
     @staticmethod
     def _is_image(filename: str) -> bool:
@@ -186,6 +479,58 @@ class PhotoAnalyzer:
         return math.sqrt(sum(quadratic_errors))
 
 
+def _nr_photo_bytes(photo: Photo) -> int:
+    """
+    Return the number of bytes of the decoded image of the given photo
+    """
+
+    width, height = photo.size
+    return width * height * len(photo.getbands())
+
+
+def _process_original(original_fp: str, tile_size: Size, fast_decode: bool, analyze: bool,
+                      resized_fp: Optional[str], return_tile: bool, source_fps: List[str] = (),
+                      level_fps: List[Tuple[int, str]] = ()) -> Tuple[Optional[Color], Optional[Image.Image], str]:
+    """
+    Decode a single original photo and return its average color and resized image, as far as requested
+
+    If the photo does not need to be analyzed, it is resized from the first of source_fps that exists instead.
+    If the original is decoded, it is saved in the levels of the tile pyramid in level_fps that it is not in yet.
+
+    This is a module level function, such that it can be sent to worker processes.
+
+    :param original_fp: Full path to the original photo
+    :param tile_size: Size to resize the photo to
+    :param fast_decode: Whether to decode at the smallest resolution that is still at least tile_size
+    :param analyze: Whether to determine the average color
+    :param resized_fp: If given, save the resized photo to this full path
+    :param return_tile: Whether to return the resized image
+    :param source_fps: Full paths to the photo in the levels of the tile pyramid to resize from, smallest first
+    :param level_fps: Level and full path to the photo in that level of the tile pyramid, for all levels
+    :return: Three-tuple with the average color, the resized image and the full path of the photo that is read
+    """
+
+    if not analyze and (resized_fp or return_tile):
+        source_fp = next((fp for fp in source_fps if os.path.exists(fp)), None)
+        if source_fp:
+            with Photo.open(source_fp) as source_img:
+                resized_img = source_img.resize(tile_size)
+            if resized_fp:
+                resized_img.save(resized_fp)
+            return None, resized_img if return_tile else None, source_fp
+
+    original_photo = Photo.open(original_fp, min_size=tile_size if fast_decode else None)
+    avg_color = original_photo.avg_color if analyze else None
+    resized_img = None
+    if resized_fp or return_tile:
+        resized_img = original_photo.resize(tile_size)
+        if resized_fp:
+            resized_img.save(resized_fp)
+    if level_fps:
+        save_levels(original_photo.img, level_fps)
+    return avg_color, resized_img if return_tile else None, original_fp
+
+
 if __name__ == '__main__':
     pa = PhotoAnalyzer(Path.to_src_photos_dir('cats_small'), 16, (100, 100))
     best_photo = pa.select_best_photo((121, 120, 114))
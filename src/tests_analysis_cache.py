@@ -0,0 +1,101 @@
+import json
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from analysis_cache import AnalysisCache
+from utils.path import Path
+
+
+class AnalysisCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.photos_dir = os.path.join(self.tmp_dir, 'photos')
+        shutil.copytree(os.path.join(Path.testdata, 'cats'), self.photos_dir)
+        self.db_fp = os.path.join(self.tmp_dir, 'cache.sqlite')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def create_cache(self, use_content_hash: bool = False) -> AnalysisCache:
+        cache = AnalysisCache(self.db_fp, use_content_hash=use_content_hash)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_that_stored_colors_are_read_back(self):
+        cache = self.create_cache()
+        self.assertEqual(({}, set()), cache.lookup(self.photos_dir, ['cat001.jpg', 'cat002.jpg']))
+        cache.store({'cat001.jpg': (1, 2, 3), 'cat002.jpg': (4, 5, 6)})
+
+        cache = self.create_cache()
+        colors, changed_filenames = cache.lookup(self.photos_dir, ['cat001.jpg', 'cat002.jpg'])
+        self.assertDictEqual({'cat001.jpg': (1, 2, 3), 'cat002.jpg': (4, 5, 6)}, colors)
+        self.assertSetEqual(set(), changed_filenames)
+
+    def test_that_replaced_photo_is_invalidated(self):
+        cache = self.create_cache()
+        cache.lookup(self.photos_dir, ['cat001.jpg'])
+        cache.store({'cat001.jpg': (1, 2, 3)})
+        shutil.copyfile(os.path.join(self.photos_dir, 'cat002.jpg'), os.path.join(self.photos_dir, 'cat001.jpg'))
+
+        colors, changed_filenames = self.create_cache().lookup(self.photos_dir, ['cat001.jpg'])
+        self.assertDictEqual({}, colors)
+        self.assertSetEqual({'cat001.jpg'}, changed_filenames)
+
+    def test_that_content_hash_recognizes_touched_and_renamed_photos(self):
+        cache = self.create_cache(use_content_hash=True)
+        cache.lookup(self.photos_dir, ['cat001.jpg'])
+        cache.store({'cat001.jpg': (1, 2, 3)})
+        os.utime(os.path.join(self.photos_dir, 'cat001.jpg'), ns=(0, 0))
+        shutil.copyfile(os.path.join(self.photos_dir, 'cat001.jpg'), os.path.join(self.photos_dir, 'copy.jpg'))
+
+        colors, changed_filenames = self.create_cache(use_content_hash=True).lookup(
+            self.photos_dir, ['cat001.jpg', 'copy.jpg', 'cat002.jpg'])
+        self.assertDictEqual({'cat001.jpg': (1, 2, 3), 'copy.jpg': (1, 2, 3)}, colors)
+        self.assertSetEqual(set(), changed_filenames)
+
+    def test_that_content_hash_reuses_color_of_overwritten_photo_but_reports_it_as_changed(self):
+        cache = self.create_cache(use_content_hash=True)
+        cache.lookup(self.photos_dir, ['cat001.jpg', 'cat002.jpg'])
+        cache.store({'cat001.jpg': (1, 2, 3), 'cat002.jpg': (4, 5, 6)})
+        shutil.copyfile(os.path.join(self.photos_dir, 'cat002.jpg'), os.path.join(self.photos_dir, 'cat001.jpg'))
+
+        colors, changed_filenames = self.create_cache(use_content_hash=True).lookup(
+            self.photos_dir, ['cat001.jpg', 'cat002.jpg'])
+        self.assertDictEqual({'cat001.jpg': (4, 5, 6), 'cat002.jpg': (4, 5, 6)}, colors)
+        self.assertSetEqual({'cat001.jpg'}, changed_filenames)
+
+    def test_that_json_analysis_is_imported_once_for_unmodified_photos(self):
+        json_fp = os.path.join(self.tmp_dir, 'photo_analysis.json')
+        with open(json_fp, 'w') as f:
+            json.dump({'cat001.jpg': [1, 2, 3], 'cat002.jpg': [4, 5, 6], 'gone.jpg': [7, 8, 9]}, f)
+        json_mtime_ns = os.stat(json_fp).st_mtime_ns
+        os.utime(os.path.join(self.photos_dir, 'cat002.jpg'), ns=(json_mtime_ns + 1, json_mtime_ns + 1))
+
+        cache = self.create_cache()
+        self.assertEqual(1, cache.import_json(json_fp, self.photos_dir, ['cat001.jpg', 'cat002.jpg']))
+        colors, _ = cache.lookup(self.photos_dir, ['cat001.jpg', 'cat002.jpg'])
+        self.assertDictEqual({'cat001.jpg': (1, 2, 3)}, colors)
+        self.assertEqual(0, cache.import_json(json_fp, self.photos_dir, ['cat001.jpg']))
+
+    def test_that_remove_all_except_removes_other_photos(self):
+        cache = self.create_cache()
+        cache.lookup(self.photos_dir, ['cat001.jpg', 'cat002.jpg'])
+        cache.store({'cat001.jpg': (1, 2, 3), 'cat002.jpg': (4, 5, 6)})
+        self.assertEqual(1, cache.remove_all_except(['cat002.jpg', 'cat003.jpg']))
+        colors, _ = cache.lookup(self.photos_dir, ['cat001.jpg', 'cat002.jpg'])
+        self.assertDictEqual({'cat002.jpg': (4, 5, 6)}, colors)
+
+    def test_that_fingerprint_only_changes_with_cached_colors(self):
+        cache = self.create_cache()
+        fingerprint = cache.fingerprint
+        cache.lookup(self.photos_dir, ['cat001.jpg'])
+        self.assertEqual(fingerprint, self.create_cache().fingerprint)
+        cache.store({'cat001.jpg': (1, 2, 3)})
+        self.assertNotEqual(fingerprint, cache.fingerprint)
+        fingerprint = cache.fingerprint
+        self.assertEqual(0, cache.remove_all_except(['cat001.jpg']))
+        self.assertEqual(fingerprint, self.create_cache().fingerprint)
+        cache.remove_all_except([])
+        self.assertNotEqual(fingerprint, cache.fingerprint)
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import json
+import os.path
+import random
+
+from cli import main
+from mosaic_creator import MosaicCreator
+from photo import Photo
+from utils.path import Path
+from utils.testing import TileLibraryTestCase
+
+
+class CliTestCase(TileLibraryTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.target_fp = Path.to_testphoto('wolf_high_res')
+
+    def run_main(self, *args: str) -> str:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main(list(args))
+        return output.getvalue()
+
+    def test_that_render_returns_same_photo_as_photo_pixelate(self):
+        random.seed(3)
+        creator = MosaicCreator(self.target_fp, nr_pixels_in_x=10, nr_pixels_in_y=8, max_output_size=200,
+                                cheat_parameter=30)
+        expected_photo = creator.photo_pixelate(self.src_dir)
+
+        for extension in ('png', 'ppm'):
+            output_fp = os.path.join(self.tmp_dir, f'wolf.{extension}')
+            self.run_main('render', self.target_fp, self.src_dir, '-x', '10', '-y', '8', '--max-output-size', '200',
+                          '--cheat-parameter', '30', '--seed', '3', '-o', output_fp)
+            self.assertEqual(expected_photo, Photo.open(output_fp))
+
+    def test_that_render_plan_returns_same_photo_as_render(self):
+        render_fp = os.path.join(self.tmp_dir, 'wolf_render.png')
+        self.run_main('render', self.target_fp, self.src_dir, '-x', '10', '-y', '8', '--max-output-size', '200',
+                      '--cheat-parameter', '30', '--seed', '3', '-o', render_fp)
+        plan_fp = os.path.join(self.tmp_dir, 'plan.json')
+        self.run_main('plan', self.target_fp, self.src_dir, '-x', '10', '-y', '8', '--max-output-size', '200',
+                      '--seed', '3', '-o', plan_fp)
+        output_fp = os.path.join(self.tmp_dir, 'wolf_plan.png')
+        self.run_main('render-plan', plan_fp, '--max-output-size', '200', '--cheat-parameter', '30', '-o', output_fp)
+        self.assertEqual(Photo.open(render_fp), Photo.open(output_fp))
+
+    def test_that_pixelate_returns_same_photo_as_pixelate(self):
+        creator = MosaicCreator(self.target_fp, nr_pixels_in_x=10, nr_pixels_in_y=8, max_output_size=200)
+        output_fp = os.path.join(self.tmp_dir, 'wolf.png')
+        self.run_main('pixelate', self.target_fp, '-x', '10', '-y', '8', '--max-output-size', '200', '-o', output_fp)
+        self.assertEqual(creator.pixelate(10, 8), Photo.open(output_fp))
+
+    def test_that_analyze_resizes_tile_photos(self):
+        self.run_main('analyze', self.src_dir, '--tile-size', '20x15')
+        resizeds_dir = os.path.join(self.src_dir, 'resized_input_photos', '20x15')
+        self.assertEqual(len(os.listdir(os.path.join(self.src_dir, 'original_input_photos'))),
+                         len(os.listdir(resizeds_dir)))
+
+    def test_that_timings_and_profile_are_reported(self):
+        profile_fp = os.path.join(self.tmp_dir, 'analyze.prof')
+        output = self.run_main('analyze', self.src_dir, '--tile-size', '20x15', '--timings', '--profile', profile_fp)
+        self.assertTrue(os.path.exists(profile_fp))
+        self.assertIn('cli.load_library', output)
+        self.assertIn('Peak RSS', output)
+
+    def test_that_report_contains_stages_and_counters_of_render(self):
+        report_fp = os.path.join(self.tmp_dir, 'report.json')
+        self.run_main('render', self.target_fp, self.src_dir, '-x', '10', '-y', '8', '--max-output-size', '200',
+                      '-o', os.path.join(self.tmp_dir, 'wolf.jpg'), '--report', report_fp)
+        with open(report_fp) as f:
+            report = json.load(f)
+        for timer in ('cli.load_library', 'analyzer.resize', 'creator.match', 'creator.paste', 'cli.save'):
+            self.assertIn(timer, report['timers'])
+        nr_photos = len(os.listdir(os.path.join(self.src_dir, 'original_input_photos')))
+        self.assertEqual(nr_photos, report['counters']['photos_decoded'])
+        # Every photo is read once for all of its tiles, ahead of pasting on the prefetch threads
+        counters = report['counters']
+        nr_photos_prefetched = counters.get('prefetch.ready', 0) + counters.get('prefetch.stalls', 0)
+        self.assertEqual(counters['tile_cache.misses'], nr_photos_prefetched)
+        self.assertLessEqual(nr_photos_prefetched, nr_photos)
+        self.assertIn(f'Resized {nr_photos} photos to 20x25', report['messages'])
+
+    def test_that_invalid_tile_size_exits(self):
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            main(['analyze', self.src_dir, '--tile-size', '20'])
@@ -0,0 +1,75 @@
+import os.path
+import random
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from color_store import ColorStore
+from utils.color_index import ColorIndex
+from utils.path import Path
+
+
+class ColorStoreTestCase(TestCase):
+    colors = {'black.jpg': (0, 0, 0), 'red.jpg': (255, 0, 0), 'gray.jpg': (128, 128, 128), 'dark.jpg': (0, 0, 0),
+              'white.jpg': (255, 255, 255)}
+
+    def setUp(self) -> None:
+        self.store_dir = os.path.join(tempfile.mkdtemp(dir=Path.tmp), 'color_store')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(os.path.dirname(self.store_dir))
+
+    def test_that_written_store_is_read_back(self):
+        ColorStore.write(self.store_dir, self.colors, shard_size=2)
+        store = ColorStore(self.store_dir)
+        self.assertEqual(5, len(store))
+        self.assertEqual(3, store.nr_shards)
+        self.assertListEqual(sorted(self.colors), store.filenames(range(len(store))))
+        for photo_id, filename in enumerate(sorted(self.colors)):
+            self.assertTupleEqual(self.colors[filename], store.color(photo_id))
+        self.assertIsNone(store.fingerprint)
+        self.assertEqual('cats', ColorStore.write(self.store_dir, self.colors, 'cats').fingerprint)
+
+    def test_that_shards_hold_uint8_colors_and_int32_ids(self):
+        store = ColorStore.write(self.store_dir, self.colors, shard_size=2)
+        for ids, colors in store.shards:
+            self.assertEqual(np.int32, ids.dtype)
+            self.assertEqual(np.uint8, colors.dtype)
+            self.assertIsInstance(colors, np.memmap)
+
+    def test_that_nearest_matches_brute_force_over_all_shards(self):
+        store = ColorStore.write(self.store_dir, self.colors, shard_size=2)
+        queries = [(10, 0, 0), (200, 10, 10), (120, 130, 140), (250, 250, 250)]
+        expected = [min((sum((a - b) ** 2 for a, b in zip(query, color)), filename)
+                        for filename, color in self.colors.items())[1] for query in queries]
+        self.assertListEqual(expected, store.filenames(store.nearest(queries)))
+
+    def test_that_nearest_skips_photos_without_capacity(self):
+        store = ColorStore.write(self.store_dir, self.colors, shard_size=2)
+        capacities = np.ones(len(store), dtype=np.int32)
+        capacities[store.filenames(range(len(store))).index('black.jpg')] = 0
+        self.assertListEqual(['dark.jpg'], store.filenames(store.nearest([(0, 0, 0)], capacities)))
+        with self.assertRaises(KeyError):
+            store.nearest([(0, 0, 0)], np.zeros(len(store), dtype=np.int32))
+
+    def test_that_index_pops_the_same_photos_as_color_index(self):
+        random.seed(0)
+        colors = {f'{i:03d}.jpg': (random.randrange(0, 256, 64), random.randrange(256), random.randrange(256))
+                  for i in range(100)}
+        store = ColorStore.write(self.store_dir, colors, shard_size=16)
+        index, color_index = store.index(nr_uses=2), ColorIndex(colors, dict.fromkeys(colors, 2))
+        for _ in range(200):
+            color = (random.randrange(256), random.randrange(256), random.randrange(256))
+            self.assertEqual(color_index.pop_nearest(color), store.filename(index.pop_nearest(color)))
+        self.assertEqual(0, len(index))
+        with self.assertRaises(KeyError):
+            index.pop_nearest((0, 0, 0))
+
+    def test_that_missing_store_is_empty_and_write_replaces_store(self):
+        self.assertEqual(0, len(ColorStore(self.store_dir)))
+        ColorStore.write(self.store_dir, self.colors)
+        store = ColorStore.write(self.store_dir, {'red.jpg': (255, 0, 0)})
+        self.assertListEqual(['red.jpg'], store.filenames([0]))
+        self.assertListEqual(['color_store'], os.listdir(os.path.dirname(self.store_dir)))
@@ -0,0 +1,95 @@
+import json
+import os.path
+import shutil
+
+from mosaic_batch import read_manifest, render_batch
+from mosaic_service import RenderJob
+from photo import Photo
+from utils.path import Path
+from utils.testing import TileLibraryTestCase
+
+
+class MosaicBatchTestCase(TileLibraryTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        shutil.copy(Path.to_testphoto('wolf_high_res'), self.tmp_dir)
+
+    def write_manifest(self, filename: str, content: str) -> str:
+        manifest_fp = os.path.join(self.tmp_dir, filename)
+        with open(manifest_fp, 'w') as f:
+            f.write(content)
+        return manifest_fp
+
+    def create_jobs(self) -> list:
+        return [
+            RenderJob(os.path.join(self.tmp_dir, 'wolf_high_res.jpg'), self.src_dir,
+                      nr_pixels_in_x=nr_pixels, nr_pixels_in_y=nr_pixels, max_output_size=200, assignment='optimal',
+                      output_fp=os.path.join(self.tmp_dir, f'wolf_{index}.{extension}'))
+            for index, (nr_pixels, extension) in enumerate([(5, 'ppm'), (10, 'png'), (10, 'tif')])
+        ]
+
+    def test_that_jsonl_and_csv_manifests_are_read_relative_to_the_manifest(self):
+        jsonl_fp = self.write_manifest('manifest.jsonl', '\n'.join([
+            json.dumps({'target_fp': 'wolf_high_res.jpg', 'src_dir': 'cats', 'nr_pixels_in_x': 5,
+                        'nr_pixels_in_y': 4, 'output_fp': 'wolf_0.ppm'}),
+            json.dumps({'target_fp': 'wolf_high_res.jpg', 'src_dir': 'cats', 'nr_pixels_in_x': 10,
+                        'nr_pixels_in_y': 10, 'cheat_parameter': 0, 'assignment': 'optimal',
+                        'output_fp': 'wolf_1.png'}),
+        ]))
+        csv_fp = self.write_manifest('manifest.csv', '\n'.join([
+            'target_fp,src_dir,nr_pixels_in_x,nr_pixels_in_y,cheat_parameter,assignment,output_fp',
+            'wolf_high_res.jpg,cats,5,4,,,wolf_0.ppm',
+            'wolf_high_res.jpg,cats,10,10,0,optimal,wolf_1.png',
+        ]))
+        expected_jobs = [
+            RenderJob(os.path.join(self.tmp_dir, 'wolf_high_res.jpg'), self.src_dir,
+                      nr_pixels_in_x=5, nr_pixels_in_y=4, output_fp=os.path.join(self.tmp_dir, 'wolf_0.ppm')),
+            RenderJob(os.path.join(self.tmp_dir, 'wolf_high_res.jpg'), self.src_dir,
+                      nr_pixels_in_x=10, nr_pixels_in_y=10, cheat_parameter=0, assignment='optimal',
+                      output_fp=os.path.join(self.tmp_dir, 'wolf_1.png')),
+        ]
+        self.assertListEqual(expected_jobs, read_manifest(jsonl_fp))
+        self.assertListEqual(expected_jobs, read_manifest(csv_fp))
+
+    def test_that_manifest_without_output_raises(self):
+        manifest_fp = self.write_manifest('manifest.jsonl', json.dumps(
+            {'target_fp': 'wolf_high_res.jpg', 'src_dir': 'cats', 'nr_pixels_in_x': 5, 'nr_pixels_in_y': 4}))
+        with self.assertRaises(ValueError):
+            read_manifest(manifest_fp)
+
+    def test_that_worker_processes_render_same_photos_as_current_process(self):
+        jobs = self.create_jobs()
+        render_batch(jobs)
+        expected_photos = [Photo.open(job.output_fp) for job in jobs]
+        for job in jobs:
+            os.remove(job.output_fp)
+
+        summary_fp = os.path.join(self.tmp_dir, 'summary.json')
+        render_batch(jobs, summary_fp=summary_fp, nr_processes=2)
+        for expected_photo, job in zip(expected_photos, jobs):
+            self.assertEqual(expected_photo, Photo.open(job.output_fp))
+        with open(summary_fp) as f:
+            summary = json.load(f)
+        self.assertEqual(3, summary['nr_jobs'])
+        self.assertEqual(0, summary['nr_failed_jobs'])
+        self.assertListEqual([job.output_fp for job in jobs], [job['output_fp'] for job in summary['jobs']])
+
+    def test_that_failed_job_is_reported_in_summary(self):
+        jobs = self.create_jobs()
+        jobs[1] = jobs[1]._replace(output_fp=os.path.join(self.tmp_dir, 'no_such_dir', 'wolf.png'))
+        summary = render_batch(jobs)
+        self.assertEqual(1, summary['nr_failed_jobs'])
+        self.assertIsNone(summary['jobs'][0]['error'])
+        self.assertIsNotNone(summary['jobs'][1]['error'])
+        self.assertTrue(os.path.exists(jobs[2].output_fp))
+
+    def test_that_job_of_which_library_cannot_be_loaded_is_reported_in_summary(self):
+        jobs = self.create_jobs()[:2]
+        jobs[0] = jobs[0]._replace(target_fp=os.path.join(self.tmp_dir, 'no_such_target.jpg'))
+        summary_fp = os.path.join(self.tmp_dir, 'summary.json')
+        summary = render_batch(jobs, summary_fp=summary_fp)
+        self.assertTrue(os.path.exists(summary_fp))
+        self.assertEqual(1, summary['nr_failed_jobs'])
+        self.assertIn('FileNotFoundError', summary['jobs'][0]['error'])
+        self.assertIsNone(summary['jobs'][1]['error'])
+        self.assertTrue(os.path.exists(jobs[1].output_fp))
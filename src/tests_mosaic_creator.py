@@ -1,10 +1,16 @@
 import os.path
 import random
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import Mock
 
+from PIL import Image
+
 from mosaic_creator import MosaicCreator
 from photo import Photo
+from photo_analyzer import PhotoAnalyzer
+from utils.instrumentation import Instrumentation
 from utils.path import Path
 
 
@@ -32,6 +38,18 @@ class MosaicCreatorTestCase(TestCase):
         expected_pixelated_wolf = Photo.open(output_file)
         self.assertEqual(expected_pixelated_wolf, pixelated_wolf)
 
+    def test_that_pixelate_to_file_returns_same_photo_as_pixelate(self):
+        tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        creator = MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=500,
+                                nr_pixels_in_x=30, nr_pixels_in_y=30)
+        expected_wolf = creator.pixelate(nr_pixels_in_x=50, nr_pixels_in_y=35)
+        self.assertTupleEqual(creator.output_size, expected_wolf.size)
+        for extension in ('ppm', 'tif'):
+            output_fp = os.path.join(tmp_dir, f'wolf.{extension}')
+            creator.pixelate_to_file(nr_pixels_in_x=50, nr_pixels_in_y=35, output_fp=output_fp)
+            self.assertEqual(expected_wolf, Photo.open(output_fp))
+
     def test_that_photo_pixelate_returns_photo_pixelated_photo(self):
         random.seed(1)
         pixelated_wolf = self.creator.photo_pixelate(src_dir=os.path.join(Path.testdata, 'original_input_photos'))
@@ -42,6 +60,100 @@ class MosaicCreatorTestCase(TestCase):
         expected_pixelated_wolf = Photo.open(output_file)
         self.assertEqual(expected_pixelated_wolf, pixelated_wolf)
 
+    def test_that_photo_pixelate_to_file_returns_same_photo_as_photo_pixelate(self):
+        tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        src_dir = os.path.join(tmp_dir, 'cats')
+        shutil.copytree(os.path.join(Path.testdata, 'cats'), os.path.join(src_dir, 'original_input_photos'))
+        creator = MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=200,
+                                nr_pixels_in_x=12, nr_pixels_in_y=9, cheat_parameter=50)
+
+        random.seed(1)
+        expected_wolf = creator.photo_pixelate(src_dir=src_dir)
+        for extension in ('ppm', 'tif'):
+            random.seed(1)
+            output_fp = os.path.join(tmp_dir, f'wolf.{extension}')
+            creator.photo_pixelate_to_file(src_dir=src_dir, output_fp=output_fp)
+            self.assertEqual(expected_wolf, Photo.open(output_fp))
+
+    def test_that_photo_pixelate_in_bands_returns_same_photo_as_serial(self):
+        tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        src_dir = os.path.join(tmp_dir, 'cats')
+        shutil.copytree(os.path.join(Path.testdata, 'cats'), os.path.join(src_dir, 'original_input_photos'))
+        creator = MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=200,
+                                nr_pixels_in_x=12, nr_pixels_in_y=9, cheat_parameter=50)
+
+        for use_atlas in (False, True):
+            random.seed(1)
+            expected_wolf = creator.photo_pixelate(src_dir=src_dir, use_atlas=use_atlas)
+            for nr_render_workers in (2, 4):
+                random.seed(1)
+                wolf = creator.photo_pixelate(src_dir=src_dir, use_atlas=use_atlas,
+                                              nr_render_workers=nr_render_workers)
+                self.assertEqual(expected_wolf, wolf)
+
+    def test_that_prefetching_tiles_returns_same_photo_as_reading_them_one_by_one(self):
+        tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        src_dir = os.path.join(tmp_dir, 'cats')
+        shutil.copytree(os.path.join(Path.testdata, 'cats'), os.path.join(src_dir, 'original_input_photos'))
+        creator = MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=200,
+                                nr_pixels_in_x=12, nr_pixels_in_y=9, cheat_parameter=50, nr_prefetch_threads=0)
+        plan = creator.plan(src_dir=src_dir, seed=1)
+        expected_wolf = creator.render_plan(plan)
+
+        instrumentation = Instrumentation(verbose=False)
+        prefetching_creator = MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=200,
+                                            nr_pixels_in_x=12, nr_pixels_in_y=9, cheat_parameter=50,
+                                            nr_prefetch_threads=3, instrumentation=instrumentation)
+        self.assertEqual(expected_wolf, prefetching_creator.render_plan(plan))
+        nr_photos = len(set(plan.filenames))
+        self.assertEqual(nr_photos, instrumentation.counters.get('prefetch.ready', 0)
+                         + instrumentation.counters.get('prefetch.stalls', 0))
+        self.assertEqual(expected_wolf, prefetching_creator.render_plan(plan, nr_render_workers=2))
+        output_fp = os.path.join(tmp_dir, 'wolf.ppm')
+        prefetching_creator.render_plan_to_file(plan, output_fp)
+        self.assertEqual(expected_wolf, Photo.open(output_fp))
+
+    def test_that_render_plan_returns_same_photo_as_photo_pixelate(self):
+        tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        src_dir = os.path.join(tmp_dir, 'cats')
+        shutil.copytree(os.path.join(Path.testdata, 'cats'), os.path.join(src_dir, 'original_input_photos'))
+        creator = MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=200,
+                                nr_pixels_in_x=12, nr_pixels_in_y=9, cheat_parameter=50)
+
+        for assignment in ('greedy', 'optimal'):
+            random.seed(4)
+            expected_wolf = creator.photo_pixelate(src_dir=src_dir, assignment=assignment)
+            plan = creator.plan(src_dir=src_dir, assignment=assignment, seed=4)
+            self.assertEqual(expected_wolf, creator.render_plan(plan))
+
+        # The same plan can be rendered at another size, with the same photo in every tile
+        small_creator = MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=100,
+                                      nr_pixels_in_x=12, nr_pixels_in_y=9, cheat_parameter=0)
+        small_wolf = small_creator.render_plan(plan)
+        self.assertTupleEqual(small_creator.output_size, small_wolf.size)
+        with self.assertRaises(ValueError):
+            MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=100, nr_pixels_in_x=6,
+                          nr_pixels_in_y=9).render_plan(plan)
+
+    def test_that_photo_pixelate_reads_every_photo_once_with_small_tile_cache(self):
+        tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        src_dir = os.path.join(tmp_dir, 'cats')
+        shutil.copytree(os.path.join(Path.testdata, 'cats'), os.path.join(src_dir, 'original_input_photos'))
+        instrumentation = Instrumentation(verbose=False)
+        creator = MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=200,
+                                nr_pixels_in_x=12, nr_pixels_in_y=9, instrumentation=instrumentation)
+        tile_width, tile_height = creator.tile_size
+        analyzer = PhotoAnalyzer(src_dir, nr_photo_pixels=12 * 9, tile_size=creator.tile_size,
+                                 max_tile_cache_bytes=tile_width * tile_height * 3, instrumentation=instrumentation)
+
+        creator.photo_pixelate(src_dir=src_dir, analyzer=analyzer)
+        self.assertEqual(len(analyzer.originals), instrumentation.counters['tile_cache.misses'])
+
     # Private methods
 
     def test_that_determine_output_size_keeps_aspect_ratio(self):
@@ -72,6 +184,31 @@ class MosaicCreatorTestCase(TestCase):
                           (387, 0, 774, 258), (387, 258, 774, 516), (387, 516, 774, 774)]
         self.assertListEqual(expected_boxes, boxes)
 
+    def test_that_blend_cheat_colors_equals_blending_every_tile(self):
+        mock = Mock(MosaicCreator)
+        mock.cheat_parameter = 100
+        tile = Image.open(Path.to_testphoto('wolf_low_res')).convert('RGB')
+        tiles = [((0, 0, 72, 72), (255, 0, 0), 'red'), ((72, 0, 144, 72), (0, 0, 255), 'blue')]
+        canvas = Image.new(mode='RGB', size=(144, 72))
+        expected_canvas = Image.new(mode='RGB', size=(144, 72))
+        for output_box, color, _ in tiles:
+            canvas.paste(tile, box=output_box)
+            # Blend a single tile the way photo_pixelate used to do
+            blended_tile = tile.convert('RGBA')
+            mask = Image.new(mode='RGBA', size=tile.size, color=(0, 0, 0, mock.cheat_parameter))
+            blended_tile.paste(Image.new(mode='RGB', size=tile.size, color=color), mask=mask)
+            expected_canvas.paste(blended_tile, box=output_box)
+
+        MosaicCreator._blend_cheat_colors(mock, canvas, tiles)
+        self.assertEqual(Photo(expected_canvas), Photo(canvas))
+
+    def test_that_determine_box_colors_equals_average_color_of_every_box(self):
+        creator = MosaicCreator(Path.to_testphoto('wolf_high_res'), max_output_size=500,
+                                nr_pixels_in_x=13, nr_pixels_in_y=7)
+        original_boxes = creator._determine_boxes(*creator.original_size, 13, 7)
+        expected_colors = [Photo(creator.original_photo.crop(box)).avg_color for box in original_boxes]
+        self.assertListEqual(expected_colors, creator._determine_box_colors(original_boxes))
+
     def test_that_determine_box_borders_returns_correct_borders(self):
         box_borders = MosaicCreator._determine_box_borders(total_nr_pixels=774, nr_boxes=10)
         expected_box_borders = [(0, 77), (77, 155), (155, 232), (232, 310), (310, 387),
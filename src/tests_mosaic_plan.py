@@ -0,0 +1,31 @@
+import json
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mosaic_plan import MosaicPlan
+from utils.path import Path
+
+
+class MosaicPlanTestCase(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.plan = MosaicPlan('target.jpg', 'cats', nr_pixels_in_x=2, nr_pixels_in_y=2, assignment='greedy', seed=3,
+                               colors=[(0, 0, 0), (255, 0, 0), (0, 255, 0), (0, 0, 255)],
+                               filenames=['b.jpg', 'a.jpg', 'b.jpg', 'c.jpg'])
+
+    def test_that_saved_plan_is_loaded_again(self):
+        plan_fp = os.path.join(self.tmp_dir, 'plan.json')
+        self.plan.save(plan_fp)
+        self.assertEqual(self.plan, MosaicPlan.load(plan_fp))
+        with open(plan_fp) as f:
+            self.assertListEqual(['a.jpg', 'b.jpg', 'c.jpg'], json.load(f)['photos'])
+
+    def test_that_plan_of_other_version_is_not_loaded(self):
+        plan_fp = os.path.join(self.tmp_dir, 'plan.json')
+        with open(plan_fp, 'w') as f:
+            json.dump({'version': 0}, f)
+        with self.assertRaises(ValueError):
+            MosaicPlan.load(plan_fp)
@@ -0,0 +1,84 @@
+import os.path
+import random
+import threading
+from unittest import mock
+
+from mosaic_creator import MosaicCreator
+from mosaic_service import MosaicService, RenderJob
+from photo import Photo
+from utils.path import Path
+from utils.testing import TileLibraryTestCase
+
+
+class MosaicServiceTestCase(TileLibraryTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.target_fp = Path.to_testphoto('wolf_high_res')
+
+    def create_job(self, nr_pixels: int, **kwargs) -> RenderJob:
+        return RenderJob(self.target_fp, self.src_dir, nr_pixels_in_x=nr_pixels, nr_pixels_in_y=nr_pixels,
+                         max_output_size=200, cheat_parameter=50, **kwargs)
+
+    def test_that_render_returns_same_photo_as_photo_pixelate(self):
+        random.seed(1)
+        creator = MosaicCreator(self.target_fp, nr_pixels_in_x=10, nr_pixels_in_y=10, max_output_size=200,
+                                cheat_parameter=50)
+        expected_photo = creator.photo_pixelate(self.src_dir)
+
+        with MosaicService() as service:
+            random.seed(1)
+            result = service.render(self.create_job(10))
+        self.assertEqual(expected_photo, result.photo)
+        self.assertGreater(result.library_seconds, 0)
+        self.assertGreaterEqual(result.total_seconds, result.library_seconds)
+
+    def test_that_library_is_loaded_once_per_tile_size(self):
+        with MosaicService() as service:
+            first_result = service.render(self.create_job(10))
+            second_result = service.render(self.create_job(10))
+            self.assertIsNot(first_result.photo, second_result.photo)
+            self.assertIs(service.get_library(self.src_dir, (20, 20)), service.get_library(self.src_dir, (20, 20)))
+            self.assertIsNot(service.get_library(self.src_dir, (20, 20)), service.get_library(self.src_dir, (10, 10)))
+        self.assertLess(second_result.library_seconds, first_result.library_seconds)
+
+    def test_that_concurrent_jobs_return_same_photos_as_sequential_jobs(self):
+        jobs = [self.create_job(nr_pixels, assignment='optimal') for nr_pixels in (5, 10, 5, 10)]
+        with MosaicService() as service:
+            expected_photos = [service.render(job).photo for job in jobs]
+        with MosaicService(nr_concurrent_jobs=4) as service:
+            futures = [service.submit(job) for job in jobs]
+            photos = [future.result().photo for future in futures]
+        for expected_photo, photo in zip(expected_photos, photos):
+            self.assertEqual(expected_photo, photo)
+
+    def test_that_render_writes_job_to_output_file(self):
+        output_fp = os.path.join(self.src_dir, 'wolf.ppm')
+        with MosaicService() as service:
+            random.seed(1)
+            expected_photo = service.render(self.create_job(10)).photo
+            random.seed(1)
+            result = service.render(self.create_job(10, output_fp=output_fp))
+        self.assertIsNone(result.photo)
+        self.assertEqual(expected_photo, Photo.open(output_fp))
+
+    def test_that_unload_waits_for_running_load_of_library(self):
+        loading, release = threading.Event(), threading.Event()
+
+        def load_library(*args, **kwargs):
+            loading.set()
+            release.wait()
+            return mock.sentinel.library
+
+        with MosaicService() as service, mock.patch('mosaic_service.PhotoAnalyzer', side_effect=load_library):
+            load = threading.Thread(target=service.get_library, args=(self.src_dir, (20, 20)))
+            load.start()
+            loading.wait()
+            unload = threading.Thread(target=service.unload_library, args=(self.src_dir,))
+            unload.start()
+            unload.join(timeout=0.1)
+            self.assertTrue(unload.is_alive())
+            release.set()
+            load.join()
+            unload.join()
+            self.assertDictEqual({}, service._libraries)
+            self.assertDictEqual({}, service._library_locks)
@@ -1,8 +1,10 @@
+import random
 from unittest import TestCase
 from unittest.mock import patch
 
 from PIL import Image
 
+from benchmarks.avg_color import legacy_avg_color, random_photo
 from photo import Photo
 from utils.path import Path
 
@@ -60,3 +62,40 @@ class PhotoTestCase(TestCase):
     def test_representation_of_photo(self):
         photo = self.equal_rgb_image
         self.assertEqual('<Photo mode=RGB size=120x40>', repr(photo))
+
+    def test_that_avg_color_matches_pure_python_average(self):
+        random.seed(1)
+        photo = random_photo((64, 48))
+        self.assertTupleEqual(legacy_avg_color(photo), photo.avg_color)
+
+    def test_that_grayscale_image_returns_gray(self):
+        photo = Photo.new(size=(10, 10), color=100, mode='L')
+        self.assertTupleEqual((100, 100, 100), photo.avg_color)
+
+    def test_that_palette_image_returns_palette_color(self):
+        rgb_photo = self.equal_rgb_image
+        photo = Photo(rgb_photo.convert('P'))
+        self.assertTupleEqual((85, 85, 85), photo.avg_color)
+
+    def test_that_cmyk_image_returns_rgb_color(self):
+        photo = Photo.new(size=(10, 10), color=(0, 255, 255, 0), mode='CMYK')
+        self.assertTupleEqual((255, 0, 0), photo.avg_color)
+
+    def test_that_transparent_pixels_are_ignored(self):
+        photo = Photo.new(size=(20, 10), color=(0, 0, 0, 0), mode='RGBA')
+        photo.paste(Image.new(size=(10, 10), color=(200, 100, 50, 255), mode='RGBA'), (0, 0))
+        self.assertTupleEqual((200, 100, 50), photo.avg_color)
+
+    def test_that_fully_transparent_image_returns_average_of_all_pixels(self):
+        photo = Photo.new(size=(10, 10), color=(200, 100, 50, 0), mode='RGBA')
+        self.assertTupleEqual((200, 100, 50), photo.avg_color)
+
+    def test_that_open_with_min_size_decodes_at_reduced_resolution(self):
+        photo = Photo.open(Path.to_testphoto('wolf_high_res'), min_size=(100, 100))
+        self.assertGreaterEqual(photo.size[0], 100)
+        self.assertGreaterEqual(photo.size[1], 100)
+        self.assertLess(photo.size[0], 774 / 2)
+
+    def test_that_open_with_min_size_reduces_non_jpeg_images(self):
+        photo = Photo.open(Path.to_testphoto('wolf_pixelated_50_35.bmp'), min_size=(100, 100))
+        self.assertTupleEqual((102, 102), photo.size)
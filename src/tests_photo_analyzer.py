@@ -1,12 +1,28 @@
+import json
 import os.path
+import shutil
+import tempfile
 from unittest import TestCase
 
 from photo import Photo
 from photo_analyzer import PhotoAnalyzer
+from utils.instrumentation import Instrumentation
 from utils.path import Path
 
 
 class PhotoAnalyzerTestCase(TestCase):
+    def setUp(self) -> None:
+        """
+        Create a source directory with the test cats as original input photos
+        """
+
+        self.tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.src_dir = os.path.join(self.tmp_dir, 'cats')
+        shutil.copytree(os.path.join(Path.testdata, 'cats'), os.path.join(self.src_dir, 'original_input_photos'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
     def test_that_photos_are_properly_initialized(self):
         cats = os.path.join(Path.testdata, 'original_input_photos')
         analyzer = PhotoAnalyzer(src_dir=cats, nr_photo_pixels=10)
@@ -29,3 +45,163 @@ class PhotoAnalyzerTestCase(TestCase):
         self.assertAlmostEqual(3, PhotoAnalyzer._distance(color_1, color_2))
         self.assertAlmostEqual(1.7320508075688772, PhotoAnalyzer._distance(color_1, color_3))
         self.assertAlmostEqual(2.449489742783178, PhotoAnalyzer._distance(color_2, color_3))
+
+    def test_that_fast_decode_resizes_all_photos_to_tile_size(self):
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=4, tile_size=(20, 20), fast_decode=True)
+        for filename in analyzer.originals:
+            self.assertTupleEqual((20, 20), analyzer.get_resized_photo(filename).size)
+
+    def test_that_fast_decode_drift_is_small(self):
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=4, tile_size=(20, 20), fast_decode=True)
+        max_drift, mean_drift = analyzer.determine_fast_decode_drift()
+        self.assertLess(max_drift, 3)
+        self.assertLessEqual(mean_drift, max_drift)
+
+    def test_that_photos_analyzed_while_resizing_are_reported(self):
+        instrumentation = Instrumentation(verbose=False)
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=4, tile_size=(20, 20), fast_decode=True,
+                                 instrumentation=instrumentation)
+        self.assertIn(f'Analyzed average color of {len(analyzer.originals)} photos', instrumentation.messages)
+        self.assertTrue(any(message.startswith('Fast decoding changed') for message in instrumentation.messages))
+
+        instrumentation = Instrumentation(verbose=False)
+        PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=4, tile_size=(20, 20), instrumentation=instrumentation)
+        self.assertIn(f'Photo analysis of {len(analyzer.originals)} photos is up-to-date', instrumentation.messages)
+
+    def test_that_analysis_of_earlier_version_is_imported(self):
+        originals = sorted(os.listdir(os.path.join(self.src_dir, 'original_input_photos')))
+        with open(os.path.join(self.src_dir, 'photo_analysis.json'), 'w') as f:
+            json.dump({filename: [index, index, index] for index, filename in enumerate(originals)}, f)
+        instrumentation = Instrumentation(verbose=False)
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=4, tile_size=(20, 20), use_atlas=True,
+                                 instrumentation=instrumentation)
+        self.assertTrue(instrumentation.messages[0].startswith(f'Imported analysis of {len(originals)} photos'))
+        self.assertEqual(originals[2], analyzer.select_best_filename((2, 2, 2)))
+
+    def test_that_select_best_photo_uses_every_photo_as_often_as_allowed(self):
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=12, tile_size=(20, 20))
+        selected = [analyzer.color_index.pop_nearest((0, 0, 0)) for _ in range(12)]
+        self.assertListEqual(sorted(list(analyzer.originals) * 2), sorted(selected))
+
+    def test_that_select_best_photo_returns_closest_photo(self):
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20))
+        color = (121, 120, 114)
+        expected_filename = min(
+            (PhotoAnalyzer._distance(color, analyzer._photo_analysis[filename]), filename)
+            for filename in analyzer.originals
+        )[1]
+        photo = analyzer.select_best_photo(color)
+        self.assertIs(analyzer.get_resized_photo(expected_filename), photo)
+        self.assertEqual(0, analyzer.color_index.capacity(expected_filename))
+
+    def test_that_color_store_selects_the_same_photos_as_color_index(self):
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=12, tile_size=(20, 20))
+        store_analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=12, tile_size=(20, 20),
+                                       use_color_store=True)
+        colors = [(0, 0, 0), (121, 120, 114), (255, 255, 255)] * 5
+        self.assertListEqual([analyzer.select_best_filename(color) for color in colors],
+                             [store_analyzer.select_best_filename(color) for color in colors])
+
+    def test_that_color_store_is_only_written_when_analysis_changed(self):
+        instrumentation = Instrumentation(verbose=False)
+        PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20), use_color_store=True)
+        PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20), use_color_store=True,
+                      instrumentation=instrumentation)
+        self.assertFalse(any('color store' in message for message in instrumentation.messages))
+
+        os.remove(os.path.join(self.src_dir, 'original_input_photos', 'cat001.jpg'))
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20), use_color_store=True)
+        self.assertListEqual(sorted(analyzer.originals), analyzer.color_store.filenames(range(len(analyzer.originals))))
+
+    def test_that_select_best_photos_returns_a_photo_per_color(self):
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20))
+        photos = analyzer.select_best_photos([(0, 0, 0)] * 6)
+        # With six photos and six tiles, every photo must be used exactly once
+        self.assertEqual(6, len({id(photo) for photo in photos}))
+
+    def test_that_atlas_contains_the_same_tiles_as_resized_photos(self):
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20), use_atlas=True)
+        self.assertFalse(os.path.exists(analyzer.resizeds_dir))
+        for filename in analyzer.originals:
+            original_photo = Photo.open(os.path.join(analyzer.originals_dir, filename))
+            expected_photo = Photo(original_photo.resize((20, 20)))
+            self.assertEqual(expected_photo, analyzer.get_resized_photo(filename))
+
+    def test_that_parallel_processing_gives_same_result_as_serial_processing(self):
+        serial_analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20))
+        parallel_src_dir = os.path.join(self.tmp_dir, 'parallel_cats')
+        shutil.copytree(serial_analyzer.originals_dir, os.path.join(parallel_src_dir, 'original_input_photos'))
+        parallel_analyzer = PhotoAnalyzer(src_dir=parallel_src_dir, nr_photo_pixels=6, tile_size=(20, 20),
+                                          nr_workers=2)
+        self.assertDictEqual(serial_analyzer._photo_analysis, parallel_analyzer._photo_analysis)
+        for filename in serial_analyzer.originals:
+            self.assertEqual(serial_analyzer.get_resized_photo(filename),
+                             parallel_analyzer.get_resized_photo(filename))
+
+    def test_that_replaced_photo_is_analyzed_and_resized_again(self):
+        PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20))
+        originals_dir = os.path.join(self.src_dir, 'original_input_photos')
+        shutil.copyfile(os.path.join(originals_dir, 'cat002.jpg'), os.path.join(originals_dir, 'cat001.jpg'))
+
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20))
+        self.assertEqual(analyzer._photo_analysis['cat002.jpg'], analyzer._photo_analysis['cat001.jpg'])
+        self.assertEqual(analyzer.get_resized_photo('cat002.jpg'), analyzer.get_resized_photo('cat001.jpg'))
+
+    def test_that_photo_replaced_by_another_cached_photo_is_resized_again(self):
+        originals_dir = os.path.join(self.src_dir, 'original_input_photos')
+        for use_atlas in (False, True):
+            PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20), use_atlas=use_atlas,
+                          use_content_hash=True)
+            shutil.copyfile(os.path.join(originals_dir, 'cat002.jpg'), os.path.join(originals_dir, 'cat001.jpg'))
+
+            analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20),
+                                     use_atlas=use_atlas, use_content_hash=True)
+            self.assertEqual(analyzer._photo_analysis['cat002.jpg'], analyzer._photo_analysis['cat001.jpg'])
+            self.assertEqual(analyzer.get_resized_photo('cat002.jpg'), analyzer.get_resized_photo('cat001.jpg'))
+            # Restore the original for the next iteration
+            shutil.copyfile(os.path.join(Path.testdata, 'cats', 'cat001.jpg'),
+                            os.path.join(originals_dir, 'cat001.jpg'))
+
+    def test_that_pyramid_derives_new_tile_size_without_decoding_originals(self):
+        PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20), use_pyramid=True)
+        instrumentation = Instrumentation(verbose=False)
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(30, 30), use_pyramid=True,
+                                 instrumentation=instrumentation)
+        self.assertNotIn('photos_decoded', instrumentation.counters)
+        self.assertEqual(len(analyzer.originals), instrumentation.counters['pyramid.tiles_derived'])
+        for filename in analyzer.originals:
+            original_photo = Photo.open(os.path.join(analyzer.originals_dir, filename))
+            expected_color = Photo(original_photo.resize((30, 30))).avg_color
+            derived_color = analyzer.get_resized_photo(filename).avg_color
+            self.assertLess(PhotoAnalyzer._distance(expected_color, derived_color), 3)
+
+    def test_that_pyramid_of_replaced_photo_is_created_again(self):
+        PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20), use_pyramid=True)
+        originals_dir = os.path.join(self.src_dir, 'original_input_photos')
+        shutil.copyfile(os.path.join(originals_dir, 'cat002.jpg'), os.path.join(originals_dir, 'cat001.jpg'))
+
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(30, 30), use_pyramid=True)
+        for level in analyzer.pyramid.levels[:3]:
+            level_dir = analyzer.pyramid.level_dir(level)
+            self.assertEqual(Photo.open(os.path.join(level_dir, 'cat002.jpg')),
+                             Photo.open(os.path.join(level_dir, 'cat001.jpg')))
+
+    def test_that_max_cache_bytes_removes_resized_photos_of_other_tile_sizes(self):
+        old_analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20))
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(30, 30), max_cache_bytes=0)
+        self.assertFalse(os.path.exists(old_analyzer.resizeds_dir))
+        self.assertEqual(len(analyzer.originals), len(os.listdir(analyzer.resizeds_dir)))
+
+    def test_that_tile_cache_evicts_photos_beyond_its_budget(self):
+        instrumentation = Instrumentation(verbose=False)
+        analyzer = PhotoAnalyzer(src_dir=self.src_dir, nr_photo_pixels=6, tile_size=(20, 20),
+                                 max_tile_cache_bytes=2 * 20 * 20 * 3, instrumentation=instrumentation)
+        filenames = sorted(analyzer.originals)
+        for filename in filenames + filenames[::-1]:
+            expected_photo = Photo.open(os.path.join(analyzer.resizeds_dir, filename))
+            self.assertEqual(expected_photo, analyzer.get_resized_photo(filename))
+        self.assertEqual(2, len(analyzer._tile_cache))
+        # Reading the photos in reverse order hits the two most recently used photos only
+        self.assertEqual(2, instrumentation.counters['tile_cache.hits'])
+        self.assertEqual(2 * len(filenames) - 2, instrumentation.counters['tile_cache.misses'])
+        self.assertEqual(2 * len(filenames) - 4, instrumentation.counters['tile_cache.evictions'])
@@ -0,0 +1,61 @@
+import os.path
+import shutil
+import tempfile
+from typing import Iterator, List
+from unittest import TestCase
+from unittest.mock import Mock
+
+import numpy as np
+
+from photo import Photo
+from tile_atlas import TileAtlas
+from utils.path import Path
+
+
+class TileAtlasTestCase(TestCase):
+    tile_size = (4, 3)
+    colors = {'black.jpg': (0, 0, 0), 'red.jpg': (255, 0, 0), 'gray.jpg': (128, 128, 128)}
+
+    def setUp(self) -> None:
+        self.atlas_dir = tempfile.mkdtemp(dir=Path.tmp)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.atlas_dir)
+
+    def create_tile(self, filename: str) -> Photo:
+        return Photo.new('RGB', self.tile_size, self.colors[filename])
+
+    def create_tiles(self, filenames: List[str]) -> Iterator[Photo]:
+        return (self.create_tile(filename) for filename in filenames)
+
+    def test_that_update_stores_all_tiles(self):
+        atlas = TileAtlas(self.atlas_dir, self.tile_size)
+        atlas.update(self.colors.keys(), self.create_tiles)
+        self.assertListEqual(['black.jpg', 'gray.jpg', 'red.jpg'], atlas.filenames)
+        for filename, color in self.colors.items():
+            self.assertEqual(self.create_tile(filename), atlas.get_photo(filename))
+            self.assertTupleEqual((3, 4, 3), atlas.get_array(filename).shape)
+
+    def test_that_atlas_is_read_back_from_disk(self):
+        TileAtlas(self.atlas_dir, self.tile_size).update(self.colors.keys(), self.create_tiles)
+        atlas = TileAtlas(self.atlas_dir, self.tile_size)
+        self.assertEqual(3, len(atlas))
+        self.assertIsInstance(atlas.get_array('red.jpg').base, np.memmap)
+        self.assertTupleEqual((255, 0, 0), atlas.get_photo('red.jpg').avg_color)
+
+    def test_that_update_only_creates_new_tiles(self):
+        TileAtlas(self.atlas_dir, self.tile_size).update(['black.jpg', 'red.jpg'], self.create_tiles)
+        atlas = TileAtlas(self.atlas_dir, self.tile_size)
+        create_tiles = Mock(side_effect=self.create_tiles)
+        atlas.update(['gray.jpg', 'red.jpg'], create_tiles)
+        create_tiles.assert_called_once_with(['gray.jpg'])
+        self.assertNotIn('black.jpg', atlas)
+        self.assertTupleEqual((255, 0, 0), atlas.get_photo('red.jpg').avg_color)
+        self.assertFalse(any(filename.endswith('.tmp') for filename in os.listdir(self.atlas_dir)))
+
+    def test_that_atlas_without_index_is_rebuilt(self):
+        atlas = TileAtlas(self.atlas_dir, self.tile_size)
+        atlas.update(self.colors.keys(), self.create_tiles)
+        os.remove(atlas.index_fp)
+        atlas = TileAtlas(self.atlas_dir, self.tile_size)
+        self.assertEqual(0, len(atlas))
@@ -0,0 +1,46 @@
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+
+from tile_pyramid import TilePyramid, collect_garbage, save_levels
+from utils.path import Path
+
+
+class TilePyramidTestCase(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.pyramid = TilePyramid(os.path.join(self.tmp_dir, 'pyramid'), levels=(16, 32, 64))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def test_that_save_levels_keeps_aspect_ratio_and_skips_larger_levels(self):
+        nr_levels_saved = save_levels(Image.new('RGB', (60, 40)), self.pyramid.level_fps('photo.png'))
+        self.assertEqual(2, nr_levels_saved)
+        with Image.open(os.path.join(self.pyramid.level_dir(32), 'photo.png')) as img:
+            self.assertTupleEqual((48, 32), img.size)
+        with Image.open(os.path.join(self.pyramid.level_dir(16), 'photo.png')) as img:
+            self.assertTupleEqual((24, 16), img.size)
+        self.assertFalse(os.path.exists(os.path.join(self.pyramid.level_dir(64), 'photo.png')))
+        self.assertEqual(0, save_levels(Image.new('RGB', (60, 40)), self.pyramid.level_fps('photo.png')))
+
+    def test_that_source_fps_start_at_smallest_level_that_covers_tile(self):
+        source_fps = self.pyramid.source_fps('photo.png', (20, 10))
+        self.assertListEqual([os.path.join(self.pyramid.level_dir(level), 'photo.png') for level in (32, 64)],
+                             source_fps)
+
+    def test_that_collect_garbage_removes_least_recently_used_entries(self):
+        cache_dir = os.path.join(self.tmp_dir, 'resized_input_photos')
+        for index, name in enumerate(('10x10', '20x20', '30x30')):
+            os.makedirs(os.path.join(cache_dir, name))
+            with open(os.path.join(cache_dir, name, 'photo.jpg'), 'wb') as f:
+                f.write(bytes(100))
+            os.utime(os.path.join(cache_dir, name), ns=(index * 10 ** 9, index * 10 ** 9))
+
+        in_use = [os.path.join(cache_dir, '10x10')]
+        removed_paths = collect_garbage(cache_dir, max_bytes=200, in_use=in_use)
+        self.assertListEqual([os.path.join(cache_dir, '20x20')], removed_paths)
+        self.assertListEqual(['10x10', '30x30'], sorted(os.listdir(cache_dir)))
@@ -0,0 +1,132 @@
+import json
+import os.path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from photo import Photo
+from utils.type_hinting import Size, size_as_string
+
+
+class TileAtlas:
+    """
+    Packed store of all tile photos of a single size
+
+    The tiles are stored uncompressed in a single .npy file with shape (nr_tiles, height, width, 3), next to
+    a .json file with the filename of every tile. The .npy file is memory-mapped, so reading a tile does not
+    decode anything, and processes that open the same atlas share its pages through the OS.
+    """
+
+    def __init__(self, atlas_dir: str, tile_size: Size):
+        """
+        :param atlas_dir: Directory to store the atlas in
+        :param tile_size: Size of every tile in the atlas
+        """
+
+        self.tile_size = tile_size
+        self.array_fp = os.path.join(atlas_dir, f'{size_as_string(tile_size)}.npy')
+        self.index_fp = os.path.join(atlas_dir, f'{size_as_string(tile_size)}.json')
+        os.makedirs(atlas_dir, exist_ok=True)
+
+        self._tiles: Optional[np.ndarray] = None
+        self._index: Dict[str, int] = {}
+        if os.path.exists(self.array_fp) and os.path.exists(self.index_fp):
+            self._load()
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def filenames(self) -> List[str]:
+        """
+        Return the filenames of all tiles, in the order in which they are stored
+        """
+
+        return sorted(self._index, key=self._index.get)
+
+    def update(self, filenames: Iterable[str], create_tiles: Callable[[List[str]], Iterator[Photo]],
+               outdated_filenames: Iterable[str] = ()) -> Tuple[int, int]:
+        """
+        Ensure that the atlas contains exactly the tiles with the given filenames
+
+        Tiles that are already in the atlas are copied, the other tiles are created. The new atlas is written
+        next to the old one and then moved over it, such that a crash never leaves a corrupt atlas behind.
+
+        :param filenames: Filenames of all tiles that should be in the atlas
+        :param create_tiles: Function that yields the tiles with the given filenames in order, in the size of the atlas
+        :param outdated_filenames: Filenames of tiles that must be created again, even if they are in the atlas
+        :return: Two-tuple with the number of created tiles and the number of deleted tiles
+        """
+
+        filenames = sorted(filenames)
+        outdated_filenames = set(outdated_filenames)
+        if filenames == self.filenames and not outdated_filenames:
+            return 0, 0
+
+        tmp_array_fp = f'{self.array_fp}.tmp.npy'
+        width, height = self.tile_size
+        tiles = np.lib.format.open_memmap(tmp_array_fp, mode='w+', dtype=np.uint8,
+                                          shape=(len(filenames), height, width, 3))
+        filenames_to_create = [
+            filename for filename in filenames
+            if filename not in self._index or filename in outdated_filenames
+        ]
+        created_tiles = create_tiles(filenames_to_create)
+        for index, filename in enumerate(filenames):
+            if filename in self._index and filename not in outdated_filenames:
+                tiles[index] = self._tiles[self._index[filename]]
+            else:
+                tile = next(created_tiles)
+                if tile.mode != 'RGB':
+                    tile = Photo(tile.convert('RGB'))
+                tiles[index] = np.asarray(tile.img)
+        nr_tiles_created = len(filenames_to_create)
+        tiles.flush()
+        del tiles
+
+        # Remove the index first, such that a crash halfway never leaves an index that does not match the tiles
+        nr_tiles_deleted = len(set(self._index).difference(filenames))
+        self._tiles = None
+        if os.path.exists(self.index_fp):
+            os.remove(self.index_fp)
+        os.replace(tmp_array_fp, self.array_fp)
+        tmp_index_fp = f'{self.index_fp}.tmp'
+        with open(tmp_index_fp, 'w') as f:
+            json.dump(filenames, f, indent=2)
+        os.replace(tmp_index_fp, self.index_fp)
+        self._load()
+        return nr_tiles_created, nr_tiles_deleted
+
+    def get_array(self, filename: str) -> np.ndarray:
+        """
+        Return a read-only view on the pixels of the tile with the given filename, with shape (height, width, 3)
+        """
+
+        return self._tiles[self._index[filename]]
+
+    def get_photo(self, filename: str) -> Photo:
+        """
+        Return a copy of the tile with the given filename as Photo
+        """
+
+        return Photo(Image.fromarray(self.get_array(filename)))
+
+    def _load(self) -> None:
+        """
+        Memory-map the atlas from disk
+        """
+
+        with open(self.index_fp) as f:
+            filenames = json.load(f)
+        tiles = np.load(self.array_fp, mmap_mode='r')
+        width, height = self.tile_size
+        if tiles.shape != (len(filenames), height, width, 3):
+            # The atlas was changed outside of this class, so we cannot trust it
+            self._tiles, self._index = None, {}
+            return
+        self._tiles = tiles
+        self._index = {filename: index for index, filename in enumerate(filenames)}
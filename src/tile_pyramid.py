@@ -0,0 +1,184 @@
+import os.path
+import shutil
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from PIL import Image
+
+from utils.type_hinting import Size
+
+# Name of the directory with the tile pyramid, inside the directory with the resized photos of a tile library
+PYRAMID_DIRNAME = 'pyramid'
+
+
+class TilePyramid:
+    """
+    Cache of the tile photos of a library at a few power-of-two sizes, to derive tiles of any size from
+
+    Level L holds every original resized such that its shortest side is L, keeping its aspect ratio. A tile is
+    derived from the smallest level of which the shortest side is at least the largest side of the tile, which is
+    much cheaper than decoding the original again. Originals that are smaller than a level are not stored in it,
+    so tiles of those are resized from the original as before.
+    """
+
+    LEVELS = (64, 128, 256, 512)
+
+    def __init__(self, pyramid_dir: str, levels: Sequence[int] = LEVELS):
+        """
+        :param pyramid_dir: Directory to store the levels in, with one subdirectory per level
+        :param levels: Shortest side of the photos in every level
+        """
+
+        self.pyramid_dir = pyramid_dir
+        self.levels = sorted(levels)
+
+    def level_dir(self, level: int) -> str:
+        return os.path.join(self.pyramid_dir, str(level))
+
+    def level_fps(self, filename: str) -> List[Tuple[int, str]]:
+        """
+        Return the level and the full path of the given photo in that level, for all levels
+        """
+
+        return [(level, os.path.join(self.level_dir(level), filename)) for level in self.levels]
+
+    def source_fps(self, filename: str, tile_size: Size) -> List[str]:
+        """
+        Return the full paths of the given photo in the levels that a tile of tile_size can be derived from
+
+        The paths are sorted from the smallest level up. The photo is not necessarily stored in these levels.
+        """
+
+        return [fp for level, fp in self.level_fps(filename) if level >= max(tile_size)]
+
+    def source_dirs(self, tile_size: Size) -> List[str]:
+        """
+        Return the directories of the levels that tiles of tile_size can be derived from
+        """
+
+        return [self.level_dir(level) for level in self.levels if level >= max(tile_size)]
+
+    def remove(self, filenames: Iterable[str]) -> None:
+        """
+        Remove the given photos from all levels, e.g. because their originals changed
+        """
+
+        for filename in filenames:
+            for _, level_fp in self.level_fps(filename):
+                if os.path.exists(level_fp):
+                    os.remove(level_fp)
+
+    def remove_all_except(self, filenames: Iterable[str]) -> int:
+        """
+        Remove all photos that are not in filenames from all levels
+
+        :return: The number of removed photos, counted once per level
+        """
+
+        filenames = set(filenames)
+        nr_photos_removed = 0
+        for level in self.levels:
+            level_dir = self.level_dir(level)
+            if not os.path.isdir(level_dir):
+                continue
+            for filename in os.listdir(level_dir):
+                if filename not in filenames:
+                    os.remove(os.path.join(level_dir, filename))
+                    nr_photos_removed += 1
+        return nr_photos_removed
+
+
+def save_levels(img: Image.Image, level_fps: List[Tuple[int, str]]) -> int:
+    """
+    Save the given decoded original in all given levels in which it is not stored yet
+
+    Every level is resized from the next larger one, instead of from the original. Levels that are larger than
+    the image are skipped, since they would not hold more detail than the image itself.
+
+    This is a module level function, such that it can be called in worker processes.
+
+    :param img: Decoded original photo, upright
+    :param level_fps: Level and the full path of the photo in that level, as returned by TilePyramid.level_fps
+    :return: The number of levels that the image is saved in
+    """
+
+    nr_levels_saved = 0
+    source_img = img
+    for level, level_fp in sorted(level_fps, reverse=True):
+        width, height = img.size
+        if min(width, height) < level or os.path.exists(level_fp):
+            continue
+        level_size = (round(width * level / min(width, height)), round(height * level / min(width, height)))
+        level_img = source_img.resize(level_size)
+        os.makedirs(os.path.dirname(level_fp), exist_ok=True)
+        level_img.save(level_fp)
+        nr_levels_saved += 1
+        source_img = level_img
+    return nr_levels_saved
+
+
+def collect_garbage(cache_dir: str, max_bytes: int, in_use: Iterable[str] = ()) -> List[str]:
+    """
+    Remove the least recently used entries of the tile cache in cache_dir, until it takes at most max_bytes
+
+    The entries are the resized photos of every tile size, both in a directory and in a tile atlas, and the levels
+    of the tile pyramid. An entry is used when its modification time is touched, see touch.
+
+    :param cache_dir: Directory with resized photos of a tile library, i.e. PhotoAnalyzer.RESIZEDS_DIRNAME
+    :param max_bytes: Maximum number of bytes of all entries together
+    :param in_use: Paths that are in use, and are never removed. Entries that are only partly in use, like the
+                   .json file of a tile atlas of which the .npy file is in use, are not removed either.
+    :return: The paths of the removed entries, least recently used first
+    """
+
+    in_use = {os.path.abspath(path) for path in in_use}
+    entries: Dict[str, List[str]] = {}  # Paths per entry, where the key is the name of the entry
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path) and name == PYRAMID_DIRNAME:
+            for level in os.listdir(path):
+                entries[os.path.join(name, level)] = [os.path.join(path, level)]
+        else:
+            # The directory, and the .npy and .json file of the tile atlas of a tile size make up a single entry
+            entries.setdefault(name.split('.')[0], []).append(path)
+
+    def last_used(paths: List[str]) -> int:
+        return max(os.stat(path).st_mtime_ns for path in paths)
+
+    nr_bytes_per_entry = {name: sum(_nr_bytes(path) for path in paths) for name, paths in entries.items()}
+    nr_bytes = sum(nr_bytes_per_entry.values())
+    removed_paths = []
+    for name in sorted(entries, key=lambda name: last_used(entries[name])):
+        if nr_bytes <= max_bytes:
+            break
+        paths = entries[name]
+        if any(os.path.abspath(path) in in_use for path in paths):
+            continue
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            removed_paths.append(path)
+        nr_bytes -= nr_bytes_per_entry[name]
+    return removed_paths
+
+
+def touch(paths: Iterable[str]) -> None:
+    """
+    Mark the given entries of the tile cache as used now, see collect_garbage
+    """
+
+    for path in paths:
+        if os.path.exists(path):
+            os.utime(path)
+
+
+def _nr_bytes(path: str) -> int:
+    """
+    Return the size of the given file, or the total size of the files in the given directory
+    """
+
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(dirpath, filename))
+               for dirpath, _, filenames in os.walk(path) for filename in filenames)
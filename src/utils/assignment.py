@@ -0,0 +1,175 @@
+from typing import Dict, List, Sequence
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment, linprog
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+from utils.type_hinting import Color
+
+# Solve exactly on a dense cost matrix if it has at most this many entries (tiles x photo uses)
+MAX_DENSE_COST_MATRIX_SIZE = 10_000_000
+
+# Number of nearest photos per tile to start with when solving on a sparse cost matrix
+DEFAULT_NR_CANDIDATES = 16
+
+# Solve the sparse problem as a matching if it has at most this many edges (tiles x uses of candidate photos),
+# and as a transportation problem with an edge per tile and candidate photo otherwise
+MAX_MATCHING_EDGES = 10_000_000
+
+# Number of tiles to calculate the distance to all photos for at once, when searching for candidates
+DEFAULT_CHUNK_SIZE = 500
+
+
+def assign_min_cost(tile_colors: Sequence[Color], photo_colors: Dict[str, Color], capacities: Dict[str, int],
+                    nr_candidates: int = DEFAULT_NR_CANDIDATES, chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[str]:
+    """
+    Assign a photo to every tile, such that the total distance between tile colors and photo colors is minimal
+
+    This is solved as a linear assignment problem, where every photo occurs as often as its capacity.
+    Small problems are solved exactly on a dense cost matrix. For large problems, every tile is only
+    allowed to be assigned to one of its nr_candidates nearest photos, and the problem is solved on a
+    sparse cost matrix. If no full assignment exists with that restriction, the number of candidates
+    is doubled until it does.
+
+    >>> assign_min_cost([(0, 0, 0), (10, 10, 10)], {'a': (9, 9, 9), 'b': (1, 1, 1)}, {'a': 1, 'b': 1})
+    ['b', 'a']
+
+    :param tile_colors: Target color per tile
+    :param photo_colors: Average color per photo
+    :param capacities: Maximum number of times every photo can be used
+    :param nr_candidates: Initial number of nearest photos per tile for the sparse cost matrix
+    :param chunk_size: Number of tiles for which distances to all photos are held in memory at once
+    :return: Photo per tile, in the same order as tile_colors
+    """
+
+    nr_tiles = len(tile_colors)
+    if nr_tiles == 0:
+        return []
+    photos = sorted(key for key, capacity in capacities.items() if capacity > 0)
+    if sum(capacities[photo] for photo in photos) < nr_tiles:
+        raise ValueError(f'Not enough photos to fill {nr_tiles} tiles')
+
+    tiles = np.asarray(tile_colors, dtype=np.float64).reshape(-1, 3)
+    colors = np.asarray([photo_colors[photo] for photo in photos], dtype=np.float64).reshape(-1, 3)
+    # A photo never needs more uses than there are tiles
+    photo_capacities = np.minimum([capacities[photo] for photo in photos], nr_tiles)
+
+    if nr_tiles * int(photo_capacities.sum()) <= MAX_DENSE_COST_MATRIX_SIZE:
+        photo_indices = _assign_dense(tiles, colors, photo_capacities)
+    else:
+        while True:
+            try:
+                photo_indices = _assign_sparse(tiles, colors, photo_capacities, nr_candidates, chunk_size)
+                break
+            except ValueError:
+                if nr_candidates >= len(photos):
+                    raise
+                nr_candidates *= 2
+    return [photos[index] for index in photo_indices]
+
+
+def _distances(tiles: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    """
+    Return the matrix with the Euclidean distance between every tile color and every photo color
+    """
+
+    # Expand |t - c|^2 to |t|^2 - 2 t.c + |c|^2, to avoid a tiles x photos x 3 intermediate array
+    squared_distances = (
+            np.einsum('ij,ij->i', tiles, tiles)[:, np.newaxis]
+            - 2 * tiles @ colors.T
+            + np.einsum('ij,ij->i', colors, colors)[np.newaxis, :]
+    )
+    return np.sqrt(np.maximum(squared_distances, 0))
+
+
+def _assign_dense(tiles: np.ndarray, colors: np.ndarray, capacities: np.ndarray) -> np.ndarray:
+    """
+    Return the optimal photo index per tile, using a cost matrix with a column per use of a photo
+    """
+
+    slot_photos = np.repeat(np.arange(len(colors)), capacities)
+    costs = _distances(tiles, colors)[:, slot_photos]
+    tile_indices, slot_indices = linear_sum_assignment(costs)
+    photo_indices = np.empty(len(tiles), dtype=np.int64)
+    photo_indices[tile_indices] = slot_photos[slot_indices]
+    return photo_indices
+
+
+def _assign_sparse(tiles: np.ndarray, colors: np.ndarray, capacities: np.ndarray,
+                   nr_candidates: int, chunk_size: int) -> np.ndarray:
+    """
+    Return the optimal photo index per tile, where every tile can only use one of its nearest photos
+
+    :raises ValueError: if not every tile can be assigned a photo with this restriction
+    """
+
+    nr_candidates = min(nr_candidates, len(colors))
+    candidates = np.empty((len(tiles), nr_candidates), dtype=np.int64)
+    candidate_costs = np.empty((len(tiles), nr_candidates), dtype=np.float64)
+    for start in range(0, len(tiles), chunk_size):
+        distances = _distances(tiles[start:start + chunk_size], colors)
+        if nr_candidates < len(colors):
+            nearest = np.argpartition(distances, nr_candidates - 1, axis=1)[:, :nr_candidates]
+        else:
+            nearest = np.broadcast_to(np.arange(len(colors)), distances.shape)
+        candidates[start:start + chunk_size] = nearest
+        candidate_costs[start:start + chunk_size] = np.take_along_axis(distances, nearest, axis=1)
+
+    # Every photo gets a column per use, but never more than the number of tiles it is a candidate for
+    nr_candidate_tiles = np.bincount(candidates.ravel(), minlength=len(colors))
+    slot_counts = np.minimum(capacities, nr_candidate_tiles)
+    first_slots = np.concatenate(([0], np.cumsum(slot_counts)[:-1]))
+    slot_photos = np.repeat(np.arange(len(colors)), slot_counts)
+    if len(slot_photos) < len(tiles):
+        raise ValueError('Not enough uses of the candidate photos to fill all tiles')
+
+    # Connect every tile to every slot of each of its candidate photos. With few photos and many tiles, every
+    # photo has many slots, and the number of edges grows with tiles x tiles. Solve those as a transportation
+    # problem, that is not affected by the number of slots.
+    edge_slot_counts = slot_counts[candidates].ravel()
+    if int(edge_slot_counts.sum()) > MAX_MATCHING_EDGES:
+        return _assign_transportation(candidates, candidate_costs, capacities)
+    edge_tiles = np.repeat(np.repeat(np.arange(len(tiles)), nr_candidates), edge_slot_counts)
+    edge_first_slots = np.repeat(first_slots[candidates].ravel(), edge_slot_counts)
+    edge_offsets = np.arange(len(edge_first_slots)) - np.repeat(np.cumsum(edge_slot_counts) - edge_slot_counts,
+                                                                edge_slot_counts)
+    edge_slots = edge_first_slots + edge_offsets
+    # The matching ignores edges with weight zero, and adding the same constant to every edge of a full
+    # matching does not change which matching is optimal
+    edge_costs = np.repeat(candidate_costs.ravel(), edge_slot_counts) + 1
+    graph = csr_matrix((edge_costs, (edge_tiles, edge_slots)), shape=(len(tiles), len(slot_photos)))
+
+    tile_indices, slot_indices = min_weight_full_bipartite_matching(graph)
+    photo_indices = np.empty(len(tiles), dtype=np.int64)
+    photo_indices[tile_indices] = slot_photos[slot_indices]
+    return photo_indices
+
+
+def _assign_transportation(candidates: np.ndarray, candidate_costs: np.ndarray, capacities: np.ndarray) -> np.ndarray:
+    """
+    Return the optimal photo index per tile, where every tile can only use one of its candidate photos
+
+    This is a transportation problem, solved as a linear program with a variable per tile and candidate photo:
+    every tile uses exactly one candidate, and every photo is used at most as often as its capacity. Its
+    constraint matrix is totally unimodular, such that the vertex found by the simplex method is integral.
+
+    :param candidates: Candidate photo indices per tile
+    :param candidate_costs: Distance from every tile to each of its candidate photos
+    :param capacities: Maximum number of uses per photo
+    :raises ValueError: if not every tile can be assigned a photo with this restriction
+    """
+
+    nr_tiles, nr_candidates = candidates.shape
+    nr_variables = nr_tiles * nr_candidates
+    variables = np.arange(nr_variables)
+    ones = np.ones(nr_variables)
+    tile_constraints = csr_matrix((ones, (np.repeat(np.arange(nr_tiles), nr_candidates), variables)),
+                                  shape=(nr_tiles, nr_variables))
+    photo_constraints = csr_matrix((ones, (candidates.ravel(), variables)), shape=(len(capacities), nr_variables))
+    result = linprog(candidate_costs.ravel(), A_ub=photo_constraints, b_ub=capacities, A_eq=tile_constraints,
+                     b_eq=np.ones(nr_tiles), bounds=(0, 1), method='highs-ds')
+    if result.status != 0:
+        raise ValueError(f'No assignment of the candidate photos to all tiles: {result.message}')
+    chosen = np.argmax(result.x.reshape(nr_tiles, nr_candidates), axis=1)
+    return candidates[np.arange(nr_tiles), chosen]
@@ -0,0 +1,84 @@
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+def hamming_distance(hash_1: int, hash_2: int) -> int:
+    """
+    Return the number of bits in which the two hashes differ
+
+    >>> hamming_distance(0b1011, 0b0001)
+    2
+    """
+
+    return bin(hash_1 ^ hash_2).count('1')
+
+
+class _Node(Generic[T]):
+    """
+    Node in a BKTree
+    """
+
+    __slots__ = ('key', 'value', 'index', 'children')
+
+    def __init__(self, key: int, value: T, index: int):
+        self.key = key
+        self.value = value
+        self.index = index  # Number of nodes that were added to the tree before this one
+        self.children: Dict[int, _Node[T]] = {}  # Child per distance to the key of this node
+
+
+class BKTree(Generic[T]):
+    """
+    Index over integer hashes, to find all hashes within a Hamming distance of a given hash
+
+    Every child of a node is stored at its distance to that node. By the triangle inequality, a search only
+    needs to descend into children at a distance between d - max_distance and d + max_distance, where d is the
+    distance of the searched hash to the node. This skips most of the tree for small distances.
+    """
+
+    def __init__(self):
+        self._root: Optional[_Node[T]] = None
+        self._nr_nodes = 0
+
+    def __len__(self) -> int:
+        return self._nr_nodes
+
+    def add(self, key: int, value: T) -> None:
+        """
+        Add the given hash with an associated value to the tree
+        """
+
+        new_node = _Node(key, value, index=self._nr_nodes)
+        self._nr_nodes += 1
+        if self._root is None:
+            self._root = new_node
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(key, node.key)
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = new_node
+                return
+            node = child
+
+    def find(self, key: int, max_distance: int) -> List[Tuple[int, T]]:
+        """
+        Return all values of which the hash is at most max_distance from the given hash
+
+        :return: List of (distance, value), sorted by distance and then in the order in which they were added
+        """
+
+        matches: List[Tuple[int, int, T]] = []  # Three-tuple: distance, index of the node, value
+        nodes = [self._root] if self._root else []
+        while nodes:
+            node = nodes.pop()
+            distance = hamming_distance(key, node.key)
+            if distance <= max_distance:
+                matches.append((distance, node.index, node.value))
+            for child_distance, child in node.children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return [(distance, value) for distance, _, value in sorted(matches, key=lambda match: match[:2])]
@@ -0,0 +1,145 @@
+from typing import Dict, List, Optional, Tuple
+
+from utils.type_hinting import Color
+
+
+class _Node:
+    """
+    Node in the k-d tree of a ColorIndex
+    """
+
+    __slots__ = ('color', 'key', 'axis', 'capacity', 'nr_available', 'left', 'right', 'parent')
+
+    def __init__(self, color: Color, key: str, axis: int, capacity: int):
+        self.color = color
+        self.key = key
+        self.axis = axis
+        self.capacity = capacity  # Remaining number of times this key can be used
+        self.nr_available = 0  # Number of nodes in this subtree with capacity left
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+        self.parent: Optional[_Node] = None
+
+
+class ColorIndex:
+    """
+    Nearest neighbour index over colors, where every key can only be used a limited number of times
+
+    The index is a k-d tree over the RGB colors. Keys that are used up stay in the tree, but every node
+    keeps track of how many nodes in its subtree still have capacity left, such that exhausted subtrees
+    are skipped during a search.
+
+    Ties are broken by key, such that the result is identical to taking min((distance, key)) over all
+    keys with capacity left.
+    """
+
+    def __init__(self, colors: Dict[str, Color], capacities: Dict[str, int]):
+        """
+        :param colors: Color per key
+        :param capacities: Number of times each key can be used. Keys without capacity are not indexed.
+        """
+
+        items = sorted((tuple(colors[key]), key) for key, capacity in capacities.items() if capacity > 0)
+        self._nodes: Dict[str, _Node] = {}
+        self._root = self._build(items, depth=0, capacities=capacities)
+
+    def __len__(self) -> int:
+        """
+        Return the number of keys that have capacity left
+        """
+
+        return self._root.nr_available if self._root else 0
+
+    def capacity(self, key: str) -> int:
+        """
+        Return the remaining number of times the given key can be used
+        """
+
+        node = self._nodes.get(key)
+        return node.capacity if node else 0
+
+    def nearest(self, color: Color) -> str:
+        """
+        Return the key with capacity left of which the color is closest to the given color
+
+        :raises KeyError: if no key has capacity left
+        """
+
+        if not len(self):
+            raise KeyError('No keys with capacity left in the index')
+        best: List[Tuple[int, str]] = [(3 * 256 ** 2, '')]
+        self._search(self._root, tuple(color), best)
+        return best[0][1]
+
+    def use(self, key: str) -> None:
+        """
+        Decrease the capacity of the given key by one
+
+        :raises KeyError: if the key has no capacity left
+        """
+
+        node = self._nodes.get(key)
+        if node is None or node.capacity == 0:
+            raise KeyError(f'{key} has no capacity left in the index')
+        node.capacity -= 1
+        if node.capacity == 0:
+            while node is not None:
+                node.nr_available -= 1
+                node = node.parent
+
+    def pop_nearest(self, color: Color) -> str:
+        """
+        Return the key closest to the given color, and use it once
+        """
+
+        key = self.nearest(color)
+        self.use(key)
+        return key
+
+    def _build(self, items: List[Tuple[Color, str]], depth: int, capacities: Dict[str, int]) -> Optional[_Node]:
+        """
+        Recursively build a balanced k-d tree from the given (color, key) items
+        """
+
+        if not items:
+            return None
+        axis = depth % 3
+        items = sorted(items, key=lambda item: item[0][axis])
+        median = len(items) // 2
+        color, key = items[median]
+        node = _Node(color, key, axis, capacities[key])
+        node.left = self._build(items[:median], depth + 1, capacities)
+        node.right = self._build(items[median + 1:], depth + 1, capacities)
+        node.nr_available = 1
+        for child in (node.left, node.right):
+            if child is not None:
+                child.parent = node
+                node.nr_available += child.nr_available
+        self._nodes[key] = node
+        return node
+
+    def _search(self, node: Optional[_Node], color: Color, best: List[Tuple[int, str]]) -> None:
+        """
+        Update best[0] with the (squared distance, key) of the closest node in the subtree, if it is closer
+        """
+
+        if node is None or node.nr_available == 0:
+            return
+
+        if node.capacity > 0:
+            squared_distance = (
+                    (color[0] - node.color[0]) ** 2
+                    + (color[1] - node.color[1]) ** 2
+                    + (color[2] - node.color[2]) ** 2
+            )
+            if (squared_distance, node.key) < best[0]:
+                best[0] = (squared_distance, node.key)
+
+        # Search the side of the splitting plane that contains the color first, since it most likely contains
+        # the nearest neighbour. The other side only needs to be searched if the plane is not further away than
+        # the best match so far. Equal distance is searched too, since a smaller key might be found.
+        difference = color[node.axis] - node.color[node.axis]
+        near, far = (node.left, node.right) if difference < 0 else (node.right, node.left)
+        self._search(near, color, best)
+        if difference ** 2 <= best[0][0]:
+            self._search(far, color, best)
@@ -0,0 +1,136 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # The resource module only exists on Unix
+    resource = None
+
+# Hook that is called on every finished timer and every count, with arguments kind ('timer' or 'counter'), name,
+# and the number of seconds or the counted amount
+InstrumentationHook = Callable[[str, str, float], None]
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Return the peak resident set size in bytes of the current process and its finished child processes
+
+    Returns None on platforms where this cannot be determined.
+    """
+
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) * unit
+
+
+class Instrumentation:
+    """
+    Collect the timers, counters and progress messages of a run, and report them
+
+    A timer accumulates the wall time and the number of calls of the code it wraps, and the peak RSS after it.
+    A counter accumulates amounts, like the number of decoded photos. Names are dotted, e.g. analyzer.resize.
+    Hooks receive every timer and count as it happens, e.g. to forward them to a monitoring system.
+    An instrumentation can be shared between threads.
+    """
+
+    def __init__(self, verbose: bool = True, hooks: Iterable[InstrumentationHook] = ()):
+        """
+        :param verbose: Whether to print progress messages, besides recording them in the report
+        :param hooks: Functions to call on every finished timer and count, see InstrumentationHook
+        """
+
+        self.verbose = verbose
+        self.hooks = list(hooks)
+        self.timers: Dict[str, Dict[str, Any]] = {}  # Per name: seconds, calls and peak_rss_bytes
+        self.counters: Dict[str, int] = {}
+        self.messages: List[str] = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """
+        Context manager that adds the wall time of the code it wraps to the timer with the given name
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            rss = peak_rss()
+            with self._lock:
+                timer = self.timers.setdefault(name, {'seconds': 0.0, 'calls': 0, 'peak_rss_bytes': None})
+                timer['seconds'] += seconds
+                timer['calls'] += 1
+                timer['peak_rss_bytes'] = rss
+            for hook in self.hooks:
+                hook('timer', name, seconds)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """
+        Add the given amount to the counter with the given name
+        """
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        for hook in self.hooks:
+            hook('counter', name, amount)
+
+    def log(self, message: str) -> None:
+        """
+        Record a progress message, and print it if verbose
+        """
+
+        with self._lock:
+            self.messages.append(message)
+        if self.verbose:
+            print(message)
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Return a report of everything that was recorded, that can be serialized to JSON
+
+        Besides the timers, counters and messages, the report contains the total wall time since the creation
+        of this instrumentation, the peak RSS of the process and the hit rate of the tile cache.
+        """
+
+        with self._lock:
+            hits = self.counters.get('tile_cache.hits', 0)
+            misses = self.counters.get('tile_cache.misses', 0)
+            return {
+                'total_seconds': time.perf_counter() - self._start,
+                'peak_rss_bytes': peak_rss(),
+                'tile_cache_hit_rate': hits / (hits + misses) if hits + misses else None,
+                'timers': {name: dict(timer) for name, timer in self.timers.items()},
+                'counters': dict(self.counters),
+                'messages': list(self.messages),
+            }
+
+    def write_report(self, fp: str) -> None:
+        """
+        Write the report to the given JSON file
+        """
+
+        with open(fp, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def format_timers(self) -> str:
+        """
+        Return a table with the recorded timers, in the order in which they first finished
+        """
+
+        lines = [f'{"Timer":<28} {"Calls":>7} {"Wall time (s)":>14} {"Peak RSS (MB)":>14}']
+        with self._lock:
+            for name, timer in self.timers.items():
+                rss = timer['peak_rss_bytes']
+                rss_text = f'{rss / 2 ** 20:.1f}' if rss is not None else 'n/a'
+                lines.append(f'{name:<28} {timer["calls"]:>7} {timer["seconds"]:>14.3f} {rss_text:>14}')
+        lines.append(f'{"total":<28} {"":>7} {time.perf_counter() - self._start:>14.3f}')
+        return '\n'.join(lines)
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Thread-safe cache that evicts the least recently used values when their total size exceeds a budget
+
+    A value that is larger than the budget on its own is still returned by put, but evicted right away.
+    Evicted values are only dropped from the cache, such that a thread that still uses one is not affected.
+
+    >>> cache = LRUCache(max_bytes=2, size_of=len)
+    >>> cache.put('a', 'x'), cache.put('b', 'y'), cache.get('a'), cache.put('c', 'z'), cache.get('b')
+    ('x', 'y', 'x', 'z', None)
+    """
+
+    def __init__(self, max_bytes: Optional[int], size_of: Callable[[V], int],
+                 on_evict: Optional[Callable[[K, V], None]] = None):
+        """
+        :param max_bytes: Maximum total size of the cached values, or None for no maximum
+        :param size_of: Function that returns the size of a value in bytes
+        :param on_evict: Function that is called with the key and the value of every evicted value
+        """
+
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.on_evict = on_evict
+        self.nr_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values: 'OrderedDict[K, V]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._values
+
+    def get(self, key: K) -> Optional[V]:
+        """
+        Return the cached value of the given key and mark it as most recently used, or None if it is not cached
+        """
+
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._values.move_to_end(key)
+            return value
+
+    def put(self, key: K, value: V) -> V:
+        """
+        Cache the given value, unless a value is cached for the key already, and return the cached value
+
+        Keeping the cached value makes concurrent puts of the same key return the same value.
+
+        :return: The value that is cached for the key, evicting least recently used values if needed
+        """
+
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key]
+            self._values[key] = value
+            self.nr_bytes += self.size_of(value)
+            while self.max_bytes is not None and self.nr_bytes > self.max_bytes:
+                evicted_key, evicted_value = self._values.popitem(last=False)
+                self.nr_bytes -= self.size_of(evicted_value)
+                self.evictions += 1
+                if self.on_evict:
+                    self.on_evict(evicted_key, evicted_value)
+            return value
@@ -0,0 +1,96 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, Optional, Tuple, TypeVar
+
+from utils.instrumentation import Instrumentation
+
+S = TypeVar('S')
+T = TypeVar('T')
+
+
+def imap_bounded(func: Callable[..., T], args_list: Iterable[Tuple], nr_workers: int = 1,
+                 max_in_flight: Optional[int] = None) -> Iterator[T]:
+    """
+    Apply func to every tuple of arguments on a pool of worker processes, and yield the results in input order
+
+    At most max_in_flight calls are submitted but not yet yielded at any time, such that neither the pending
+    arguments nor the finished results pile up in memory when the consumer is slower than the workers.
+    With a single worker, everything runs in the current process, without the overhead of a pool.
+
+    >>> list(imap_bounded(pow, [(2, 3), (3, 2)]))
+    [8, 9]
+
+    :param func: Function to apply. Must be picklable, i.e. defined at module level.
+    :param args_list: Positional arguments per call
+    :param nr_workers: Number of worker processes
+    :param max_in_flight: Maximum number of calls in flight, default is twice the number of workers
+    """
+
+    if nr_workers <= 1:
+        for args in args_list:
+            yield func(*args)
+        return
+
+    max_in_flight = max_in_flight or 2 * nr_workers
+    with ProcessPoolExecutor(max_workers=nr_workers) as executor:
+        in_flight: Deque[Future] = deque()
+        for args in args_list:
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+            in_flight.append(executor.submit(func, *args))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def imap_prefetched(func: Callable[[S], T], items: Iterable[S], nr_threads: int = 1,
+                    max_in_flight: Optional[int] = None, instrumentation: Optional[Instrumentation] = None,
+                    name: str = 'prefetch') -> Iterator[T]:
+    """
+    Apply func to the upcoming items on a pool of threads, ahead of the consumer, and yield the results in order
+
+    Unlike imap_bounded, func runs in the current process, so it can use the caches of the current process. This
+    only speeds up functions that release the GIL for most of their time, like reading files and decoding images
+    with Pillow. At most max_in_flight results are computed ahead, such that they do not pile up in memory.
+    With zero threads, func is applied to an item only when the consumer asks for its result.
+
+    Every time the consumer has to wait for a result that is not finished yet, this is counted as a stall in the
+    <name>.stalls counter, and the time waited is added to the <name>.stall timer. Results that are finished
+    in time are counted in the <name>.ready counter.
+
+    >>> list(imap_prefetched(abs, [-2, 3, -4], nr_threads=2))
+    [2, 3, 4]
+
+    :param func: Function to apply to every item
+    :param items: Items to apply func to
+    :param nr_threads: Number of threads
+    :param max_in_flight: Maximum number of results computed ahead, default is twice the number of threads
+    :param instrumentation: Instrumentation to record the stalls in
+    :param name: Prefix of the names of the counters and the timer
+    """
+
+    if nr_threads <= 0:
+        for item in items:
+            yield func(item)
+        return
+
+    max_in_flight = max_in_flight or 2 * nr_threads
+    with ThreadPoolExecutor(max_workers=nr_threads) as executor:
+        in_flight: Deque[Future] = deque()
+
+        def next_result() -> T:
+            future = in_flight.popleft()
+            if instrumentation is None:
+                return future.result()
+            if future.done():
+                instrumentation.count(f'{name}.ready')
+                return future.result()
+            instrumentation.count(f'{name}.stalls')
+            with instrumentation.timer(f'{name}.stall'):
+                return future.result()
+
+        for item in items:
+            if len(in_flight) >= max_in_flight:
+                yield next_result()
+            in_flight.append(executor.submit(func, item))
+        while in_flight:
+            yield next_result()
@@ -12,6 +12,7 @@ class Path:
     photos = os.path.join(root, 'photos')
     raw = os.path.join(root, 'raw')
     testdata = os.path.join(root, 'testdata')
+    tmp = os.path.join(root, 'tmp')
 
     assert os.path.exists(utils)
     assert os.path.exists(src)
@@ -19,6 +20,7 @@ class Path:
     assert os.path.exists(photos)
     assert os.path.exists(raw)
     assert os.path.exists(testdata)
+    assert os.path.exists(tmp)
 
     @staticmethod
     def to_photo(name: str) -> str:
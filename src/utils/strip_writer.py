@@ -0,0 +1,186 @@
+import os.path
+import struct
+from typing import BinaryIO
+
+from PIL import Image
+
+from utils.type_hinting import Size
+
+
+class StripWriter:
+    """
+    Base class to write an RGB image to a file in horizontal strips, from top to bottom
+
+    Only the strip that is being written needs to be in memory, regardless of the size of the image.
+    """
+
+    def __init__(self, fp: str, size: Size):
+        """
+        :param fp: Full path to the file to write
+        :param size: Size of the complete image
+        """
+
+        self.fp = fp
+        self.size = size
+        self.nr_rows_written = 0
+        self._file: BinaryIO = open(fp, 'wb')
+        self._write_header()
+
+    def __enter__(self) -> 'StripWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # Do not hide the original exception behind an incomplete image
+            self._file.close()
+
+    def write_strip(self, strip: Image.Image) -> None:
+        """
+        Write the next strip of the image, which must be as wide as the image
+        """
+
+        assert strip.mode == 'RGB' and strip.size[0] == self.size[0]
+        assert self.nr_rows_written + strip.size[1] <= self.size[1]
+        self._write_pixels(strip.tobytes())
+        self.nr_rows_written += strip.size[1]
+
+    def close(self) -> None:
+        """
+        Finish and close the file. All rows of the image must be written by then.
+        """
+
+        if self._file.closed:
+            return
+        assert self.nr_rows_written == self.size[1], f'Only {self.nr_rows_written} of {self.size[1]} rows written'
+        self._write_footer()
+        self._file.close()
+
+    def _write_header(self) -> None:
+        pass
+
+    def _write_pixels(self, pixels: bytes) -> None:
+        self._file.write(pixels)
+
+    def _write_footer(self) -> None:
+        pass
+
+
+class PpmStripWriter(StripWriter):
+    """
+    Write a binary PPM (P6) file, which is a small header followed by the raw RGB pixels
+    """
+
+    def _write_header(self) -> None:
+        self._file.write(f'P6\n{self.size[0]} {self.size[1]}\n255\n'.encode('ascii'))
+
+
+class TiffStripWriter(StripWriter):
+    """
+    Write an uncompressed baseline TIFF file
+
+    The pixels are written contiguously, directly after the header. The TIFF strips are therefore independent
+    of the written strips: every TIFF strip has ROWS_PER_STRIP rows, except for the last one. The image file
+    directory is written after the pixels, and the header is updated to point to it when the file is closed.
+    """
+
+    ROWS_PER_STRIP = 64
+    HEADER_SIZE = 8
+
+    # Offsets in a baseline TIFF file are 32-bit, so the complete file must be smaller than 4 GB
+    MAX_FILE_SIZE = 2 ** 32
+    MAX_FOOTER_SIZE_PER_STRIP = 8  # Offset and byte count of every strip
+    MAX_FOOTER_SIZE = 256  # Bits per sample, image file directory and padding
+
+    def __init__(self, fp: str, size: Size):
+        """
+        :raises ValueError: if the file would be too large for the 32-bit offsets of TIFF. This is checked before
+                            the file is created, instead of when the file is closed after writing all pixels.
+        """
+
+        width, height = size
+        nr_strips = -(-height // self.ROWS_PER_STRIP)
+        file_size = (self.HEADER_SIZE + width * height * 3 + nr_strips * self.MAX_FOOTER_SIZE_PER_STRIP
+                     + self.MAX_FOOTER_SIZE)
+        if file_size > self.MAX_FILE_SIZE:
+            raise ValueError(f'An image of {width}x{height} pixels does not fit in a TIFF file of at most 4 GB, '
+                             f'write a .ppm file instead')
+        super().__init__(fp, size)
+
+    def _write_header(self) -> None:
+        # Little endian, TIFF magic number, offset of the image file directory to be filled in later
+        self._file.write(struct.pack('<2sHI', b'II', 42, 0))
+
+    def _write_footer(self) -> None:
+        width, height = self.size
+        strip_size = self.ROWS_PER_STRIP * width * 3
+        image_size = height * width * 3
+        strip_offsets = list(range(self.HEADER_SIZE, self.HEADER_SIZE + image_size, strip_size))
+        strip_byte_counts = [min(strip_size, self.HEADER_SIZE + image_size - offset) for offset in strip_offsets]
+        nr_strips = len(strip_offsets)
+
+        # Values that do not fit in the 4 bytes of an entry are written before the directory
+        bits_per_sample_offset = self._tell_word_aligned()
+        self._file.write(struct.pack('<3H', 8, 8, 8))
+        strip_offsets_offset = self._tell_word_aligned()
+        self._file.write(struct.pack(f'<{nr_strips}I', *strip_offsets))
+        strip_byte_counts_offset = self._tell_word_aligned()
+        self._file.write(struct.pack(f'<{nr_strips}I', *strip_byte_counts))
+
+        short, long = 3, 4
+        entries = [
+            (256, long, 1, width),  # ImageWidth
+            (257, long, 1, height),  # ImageLength
+            (258, short, 3, bits_per_sample_offset),  # BitsPerSample
+            (259, short, 1, 1),  # Compression: none
+            (262, short, 1, 2),  # PhotometricInterpretation: RGB
+            (273, long, nr_strips, strip_offsets[0] if nr_strips == 1 else strip_offsets_offset),  # StripOffsets
+            (277, short, 1, 3),  # SamplesPerPixel
+            (278, long, 1, self.ROWS_PER_STRIP),  # RowsPerStrip
+            (279, long, nr_strips, strip_byte_counts[0] if nr_strips == 1 else strip_byte_counts_offset),
+            (284, short, 1, 1),  # PlanarConfiguration: chunky
+        ]
+        directory_offset = self._tell_word_aligned()
+        self._file.write(struct.pack('<H', len(entries)))
+        for tag, field_type, count, value in entries:
+            value_format = 'H2x' if field_type == short and count == 1 else 'I'
+            self._file.write(struct.pack(f'<HHI{value_format}', tag, field_type, count, value))
+        self._file.write(struct.pack('<I', 0))  # No next image file directory
+
+        self._file.seek(4)
+        self._file.write(struct.pack('<I', directory_offset))
+
+    def _tell_word_aligned(self) -> int:
+        """
+        Return the current position in the file, after padding it to an even offset as required by TIFF
+        """
+
+        if self._file.tell() % 2:
+            self._file.write(b'\0')
+        return self._file.tell()
+
+
+def can_write_in_strips(fp: str) -> bool:
+    """
+    Return whether open_strip_writer supports the file format of the given file, based on the extension
+    """
+
+    _, ext = os.path.splitext(fp)
+    return ext.lower() in ('.ppm', '.tif', '.tiff')
+
+
+def open_strip_writer(fp: str, size: Size) -> StripWriter:
+    """
+    Return a StripWriter for the file format that matches the extension of the given file
+
+    :param fp: Full path to the file to write, with extension .ppm, .tif or .tiff
+    :param size: Size of the complete image
+    """
+
+    _, ext = os.path.splitext(fp)
+    if ext.lower() == '.ppm':
+        return PpmStripWriter(fp, size)
+    if ext.lower() in ('.tif', '.tiff'):
+        return TiffStripWriter(fp, size)
+    raise ValueError(f'Cannot write {fp} in strips, the extension must be .ppm, .tif or .tiff')
@@ -0,0 +1,20 @@
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from utils.path import Path
+
+
+class TileLibraryTestCase(TestCase):
+    """
+    Test case with a temporary directory, that contains a tile library with the test cats as original input photos
+
+    The temporary directory is self.tmp_dir, and the tile library is self.src_dir. Both are removed after every test.
+    """
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.src_dir = os.path.join(self.tmp_dir, 'cats')
+        shutil.copytree(os.path.join(Path.testdata, 'cats'), os.path.join(self.src_dir, 'original_input_photos'))
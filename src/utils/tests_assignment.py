@@ -0,0 +1,63 @@
+import itertools
+import math
+import random
+from collections import Counter
+from unittest import TestCase
+from unittest.mock import patch
+
+from utils import assignment
+from utils.assignment import assign_min_cost
+
+
+class AssignmentTestCase(TestCase):
+    @staticmethod
+    def total_distance(tile_colors, photo_colors, photos) -> float:
+        return sum(math.dist(color, photo_colors[photo]) for color, photo in zip(tile_colors, photos))
+
+    def setUp(self) -> None:
+        random.seed(1)
+        self.photo_colors = {f'{index:02}.jpg': tuple(random.randint(0, 255) for _ in range(3)) for index in range(4)}
+        self.capacities = {photo: 2 for photo in self.photo_colors}
+        self.tile_colors = [tuple(random.randint(0, 255) for _ in range(3)) for _ in range(6)]
+
+    def test_that_assignment_is_optimal(self):
+        photos = assign_min_cost(self.tile_colors, self.photo_colors, self.capacities)
+        pool = [photo for photo, capacity in self.capacities.items() for _ in range(capacity)]
+        best_distance = min(self.total_distance(self.tile_colors, self.photo_colors, permutation)
+                            for permutation in itertools.permutations(pool, len(self.tile_colors)))
+        self.assertAlmostEqual(best_distance, self.total_distance(self.tile_colors, self.photo_colors, photos))
+
+    def test_that_capacities_are_respected(self):
+        capacities = {'black': 1, 'white': 5}
+        photo_colors = {'black': (0, 0, 0), 'white': (255, 255, 255)}
+        photos = assign_min_cost([(0, 0, 0)] * 3, photo_colors, capacities)
+        self.assertEqual(Counter({'black': 1, 'white': 2}), Counter(photos))
+
+    def test_that_sparse_assignment_equals_dense_assignment_with_all_candidates(self):
+        dense_photos = assign_min_cost(self.tile_colors, self.photo_colors, self.capacities)
+        with patch.object(assignment, 'MAX_DENSE_COST_MATRIX_SIZE', 0):
+            sparse_photos = assign_min_cost(self.tile_colors, self.photo_colors, self.capacities,
+                                            nr_candidates=4, chunk_size=4)
+        self.assertAlmostEqual(self.total_distance(self.tile_colors, self.photo_colors, dense_photos),
+                               self.total_distance(self.tile_colors, self.photo_colors, sparse_photos))
+
+    def test_that_sparse_assignment_adds_candidates_until_all_tiles_are_assigned(self):
+        with patch.object(assignment, 'MAX_DENSE_COST_MATRIX_SIZE', 0):
+            photos = assign_min_cost([(0, 0, 0)] * 3, self.photo_colors, {photo: 1 for photo in self.photo_colors},
+                                     nr_candidates=1)
+        self.assertEqual(3, len(set(photos)))
+
+    def test_that_too_few_photos_raises(self):
+        with self.assertRaises(ValueError):
+            assign_min_cost([(0, 0, 0)] * 3, {'black': (0, 0, 0)}, {'black': 2})
+
+    def test_that_transportation_assignment_equals_matching_assignment(self):
+        tile_colors = [tuple(random.randint(0, 255) for _ in range(3)) for _ in range(40)]
+        capacities = {photo: 10 for photo in self.photo_colors}
+        with patch.object(assignment, 'MAX_DENSE_COST_MATRIX_SIZE', 0):
+            matching_photos = assign_min_cost(tile_colors, self.photo_colors, capacities, nr_candidates=2)
+            with patch.object(assignment, 'MAX_MATCHING_EDGES', 0):
+                transportation_photos = assign_min_cost(tile_colors, self.photo_colors, capacities, nr_candidates=2)
+        self.assertLessEqual(max(Counter(transportation_photos).values()), 10)
+        self.assertAlmostEqual(self.total_distance(tile_colors, self.photo_colors, matching_photos),
+                               self.total_distance(tile_colors, self.photo_colors, transportation_photos))
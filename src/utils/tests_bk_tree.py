@@ -0,0 +1,28 @@
+import random
+from unittest import TestCase
+
+from utils.bk_tree import BKTree, hamming_distance
+
+
+class BKTreeTestCase(TestCase):
+    def test_that_find_returns_same_matches_as_brute_force(self):
+        random.seed(1)
+        # Hashes that are close to a few centers, to get many matches and ties in distance
+        centers = [random.getrandbits(64) for _ in range(5)]
+        hashes = [random.choice(centers) ^ (1 << random.randrange(64)) ^ (1 << random.randrange(64))
+                  for _ in range(300)]
+        tree = BKTree()
+        for index, key in enumerate(hashes):
+            tree.add(key, index)
+        self.assertEqual(300, len(tree))
+
+        for key in centers + [random.getrandbits(64)]:
+            for max_distance in (0, 2, 5):
+                expected_matches = sorted(
+                    (hamming_distance(key, other_key), index) for index, other_key in enumerate(hashes)
+                    if hamming_distance(key, other_key) <= max_distance
+                )
+                self.assertListEqual(expected_matches, tree.find(key, max_distance))
+
+    def test_that_empty_tree_finds_nothing(self):
+        self.assertListEqual([], BKTree().find(0, 64))
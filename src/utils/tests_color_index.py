@@ -0,0 +1,49 @@
+import random
+from typing import Dict
+from unittest import TestCase
+
+from utils.color_index import ColorIndex
+from utils.type_hinting import Color
+
+
+class ColorIndexTestCase(TestCase):
+    @staticmethod
+    def brute_force_nearest(colors: Dict[str, Color], capacities: Dict[str, int], color: Color) -> str:
+        distances = [
+            (sum((color[index] - colors[key][index]) ** 2 for index in range(3)), key)
+            for key, capacity in capacities.items() if capacity > 0
+        ]
+        return min(distances)[1]
+
+    def test_that_pop_nearest_selects_same_keys_as_brute_force(self):
+        random.seed(1)
+        # Few distinct channel values, to get many ties in distance and on the splitting planes
+        colors = {f'{index:03}.jpg': tuple(random.choice((0, 64, 128, 255)) for _ in range(3)) for index in range(200)}
+        capacities = {key: random.randint(0, 3) for key in colors}
+        index = ColorIndex(colors, capacities)
+        expected_capacities = dict(capacities)
+        for _ in range(sum(capacities.values())):
+            color = tuple(random.randint(0, 255) for _ in range(3))
+            expected_key = self.brute_force_nearest(colors, expected_capacities, color)
+            expected_capacities[expected_key] -= 1
+            self.assertEqual(expected_key, index.pop_nearest(color))
+        self.assertEqual(0, len(index))
+
+    def test_that_ties_are_broken_by_key(self):
+        index = ColorIndex({'b': (10, 10, 10), 'a': (10, 10, 10), 'c': (12, 10, 10)}, {'a': 1, 'b': 1, 'c': 1})
+        self.assertEqual('a', index.pop_nearest((11, 10, 10)))
+        self.assertEqual('b', index.pop_nearest((11, 10, 10)))
+        self.assertEqual('c', index.pop_nearest((11, 10, 10)))
+
+    def test_that_capacity_is_decremented(self):
+        index = ColorIndex({'a': (0, 0, 0)}, {'a': 2})
+        self.assertEqual(1, len(index))
+        index.use('a')
+        self.assertEqual(1, index.capacity('a'))
+        index.use('a')
+        self.assertEqual(0, index.capacity('a'))
+        self.assertEqual(0, len(index))
+        with self.assertRaises(KeyError):
+            index.use('a')
+        with self.assertRaises(KeyError):
+            index.nearest((0, 0, 0))
@@ -0,0 +1,46 @@
+import contextlib
+import io
+from unittest import TestCase
+
+from utils.instrumentation import Instrumentation
+
+
+class InstrumentationTestCase(TestCase):
+    def test_that_timers_accumulate_seconds_and_calls(self):
+        instrumentation = Instrumentation()
+        for _ in range(3):
+            with instrumentation.timer('stage'):
+                pass
+        timer = instrumentation.report()['timers']['stage']
+        self.assertEqual(3, timer['calls'])
+        self.assertGreaterEqual(timer['seconds'], 0)
+
+    def test_that_timer_is_recorded_when_code_raises(self):
+        instrumentation = Instrumentation()
+        with self.assertRaises(ValueError), instrumentation.timer('stage'):
+            raise ValueError
+        self.assertEqual(1, instrumentation.report()['timers']['stage']['calls'])
+
+    def test_that_counters_and_hit_rate_are_reported(self):
+        instrumentation = Instrumentation()
+        instrumentation.count('tile_cache.hits', 3)
+        instrumentation.count('tile_cache.misses')
+        report = instrumentation.report()
+        self.assertDictEqual({'tile_cache.hits': 3, 'tile_cache.misses': 1}, report['counters'])
+        self.assertEqual(0.75, report['tile_cache_hit_rate'])
+
+    def test_that_hooks_receive_timers_and_counts(self):
+        events = []
+        instrumentation = Instrumentation(hooks=[lambda kind, name, value: events.append((kind, name))])
+        with instrumentation.timer('stage'):
+            instrumentation.count('photos_decoded', 2)
+        self.assertListEqual([('counter', 'photos_decoded'), ('timer', 'stage')], events)
+
+    def test_that_messages_are_only_printed_if_verbose(self):
+        for verbose, expected_output in ((True, 'Hello\n'), (False, '')):
+            instrumentation = Instrumentation(verbose=verbose)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                instrumentation.log('Hello')
+            self.assertEqual(expected_output, output.getvalue())
+            self.assertListEqual(['Hello'], instrumentation.report()['messages'])
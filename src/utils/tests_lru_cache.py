@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from utils.lru_cache import LRUCache
+
+
+class LRUCacheTestCase(TestCase):
+    def test_that_least_recently_used_values_are_evicted_first(self):
+        evicted_keys = []
+        cache = LRUCache(max_bytes=5, size_of=len, on_evict=lambda key, value: evicted_keys.append(key))
+        cache.put('a', 'aa')
+        cache.put('b', 'bb')
+        cache.get('a')
+        cache.put('c', 'cc')
+        self.assertListEqual(['b'], evicted_keys)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual('aa', cache.get('a'))
+        self.assertEqual(4, cache.nr_bytes)
+        self.assertTupleEqual((2, 1, 1), (cache.hits, cache.misses, cache.evictions))
+
+    def test_that_put_keeps_the_cached_value(self):
+        cache = LRUCache(max_bytes=None, size_of=len)
+        self.assertEqual('first', cache.put('a', 'first'))
+        self.assertEqual('first', cache.put('a', 'second'))
+        self.assertEqual(5, cache.nr_bytes)
+
+    def test_that_value_larger_than_budget_is_not_cached(self):
+        cache = LRUCache(max_bytes=2, size_of=len)
+        self.assertEqual('abc', cache.put('a', 'abc'))
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.nr_bytes)
@@ -0,0 +1,49 @@
+import threading
+import time
+from unittest import TestCase
+
+from utils.instrumentation import Instrumentation
+from utils.parallel_utils import imap_bounded, imap_prefetched
+
+
+class ParallelUtilsTestCase(TestCase):
+    def test_that_imap_bounded_returns_results_in_order(self):
+        args_list = [(index, 2) for index in range(20)]
+        expected_results = [index ** 2 for index in range(20)]
+        self.assertListEqual(expected_results, list(imap_bounded(pow, args_list)))
+        self.assertListEqual(expected_results, list(imap_bounded(pow, args_list, nr_workers=3, max_in_flight=2)))
+
+    def test_that_imap_prefetched_returns_results_in_order(self):
+        expected_results = [index ** 2 for index in range(20)]
+        for nr_threads in (0, 1, 3):
+            results = imap_prefetched(lambda index: index ** 2, range(20), nr_threads=nr_threads, max_in_flight=2)
+            self.assertListEqual(expected_results, list(results))
+
+    def test_that_imap_prefetched_computes_at_most_max_in_flight_results_ahead(self):
+        nr_started = 0
+        lock = threading.Lock()
+
+        def start(index: int) -> int:
+            nonlocal nr_started
+            with lock:
+                nr_started += 1
+            return index
+
+        results = imap_prefetched(start, range(20), nr_threads=2, max_in_flight=3)
+        for index, result in enumerate(results):
+            self.assertEqual(index, result)
+            # The results up to this one are consumed, and at most three more are computed ahead
+            self.assertLessEqual(nr_started, index + 1 + 3)
+
+    def test_that_imap_prefetched_counts_stalls(self):
+        instrumentation = Instrumentation(verbose=False)
+
+        def slow_identity(index: int) -> int:
+            time.sleep(0.01)
+            return index
+
+        results = imap_prefetched(slow_identity, range(4), nr_threads=1, instrumentation=instrumentation)
+        self.assertListEqual([0, 1, 2, 3], list(results))
+        self.assertEqual(4, instrumentation.counters.get('prefetch.ready', 0)
+                         + instrumentation.counters['prefetch.stalls'])
+        self.assertEqual(instrumentation.counters['prefetch.stalls'], instrumentation.timers['prefetch.stall']['calls'])
@@ -0,0 +1,60 @@
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+
+from photo import Photo
+from utils.path import Path
+from utils.strip_writer import open_strip_writer
+
+
+class StripWriterTestCase(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp(dir=Path.tmp)
+        self.img = Image.open(Path.to_testphoto('wolf_low_res')).convert('RGB')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def write_in_strips(self, filename: str, rows_per_strip: int) -> str:
+        fp = os.path.join(self.tmp_dir, filename)
+        width, height = self.img.size
+        with open_strip_writer(fp, self.img.size) as writer:
+            for upper in range(0, height, rows_per_strip):
+                writer.write_strip(self.img.crop((0, upper, width, min(upper + rows_per_strip, height))))
+        return fp
+
+    def test_that_ppm_file_contains_image(self):
+        fp = self.write_in_strips('wolf.ppm', rows_per_strip=10)
+        self.assertEqual(Photo(self.img.copy()), Photo.open(fp))
+
+    def test_that_tiff_file_contains_image(self):
+        for rows_per_strip in (10, 72):
+            fp = self.write_in_strips(f'wolf_{rows_per_strip}.tif', rows_per_strip=rows_per_strip)
+            self.assertEqual(Photo(self.img.copy()), Photo.open(fp))
+
+    def test_that_unknown_extension_raises(self):
+        with self.assertRaises(ValueError):
+            open_strip_writer(os.path.join(self.tmp_dir, 'wolf.jpg'), self.img.size)
+
+    def test_that_closing_incomplete_image_raises(self):
+        writer = open_strip_writer(os.path.join(self.tmp_dir, 'wolf.ppm'), self.img.size)
+        writer.write_strip(self.img.crop((0, 0, 72, 10)))
+        with self.assertRaises(AssertionError):
+            writer.close()
+
+    def test_that_tiff_file_contains_image_written_in_strips_of_different_heights(self):
+        fp = os.path.join(self.tmp_dir, 'wolf.tif')
+        width, height = self.img.size
+        with open_strip_writer(fp, self.img.size) as writer:
+            for upper, lower in ((0, 7), (7, 8), (8, 50), (50, height)):
+                writer.write_strip(self.img.crop((0, upper, width, lower)))
+        self.assertEqual(Photo(self.img.copy()), Photo.open(fp))
+
+    def test_that_tiff_file_larger_than_4_gb_raises_before_writing(self):
+        fp = os.path.join(self.tmp_dir, 'huge.tif')
+        with self.assertRaises(ValueError):
+            open_strip_writer(fp, (40000, 40000))
+        self.assertFalse(os.path.exists(fp))